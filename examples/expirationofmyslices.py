@@ -57,11 +57,15 @@ def main(argv=None):
   # (2) For each returned slicename run equivalent of: 
   #        'omni.py print_slice_expiration slicename'
   ##############################################################################
+  # Use one Omni session for all calls, so the framework and
+  # credentials are loaded only once
+  session = omni.OmniSession()
+
   # (1) Run equivalent of 'omni.py listmyslices username'
   if username:
-    text, sliceList = omni.call( ['listmyslices', username], options )
+    text, sliceList = session.call( ['listmyslices', username], options )
   else:
-    text, sliceList = omni.call( ['listmyslices'], options )
+    text, sliceList = session.call( ['listmyslices'], options )
     username = "(you)"
   
   #  print some summary info
@@ -78,7 +82,7 @@ def main(argv=None):
     omniargs = []
     omniargs.append('print_slice_expiration')
     omniargs.append(slicename)
-    text, expiration = omni.call( omniargs, options )        
+    text, expiration = session.call( omniargs, options )        
 
     printStr += "%s\n"%(str(expiration))
   printStr += "="*80            
@@ -31,11 +31,15 @@ from optparse import OptionParser
 import xml.etree.ElementTree as etree
 import re
 import getpass
+import tempfile
+import threading
 
 import gcf.oscript as omni
 import gcf.omnilib.util.omnierror as oe
 from gcf.omnilib.handler import CallHandler
+from gcf.omnilib.util import credparsing as credutils
 from gcf.omnilib.util.handler_utils import _lookupAggNickURLFromURNInNicknames as lookupURL
+from gcf.omnilib.util.parallel import parallel_map
 
 ################################################################################
 # Requires that you have omni installed and add the path to gcf/src in your
@@ -51,7 +55,9 @@ options = None
 slicename = None
 config = None
 geni_username = None
-NSPrefix = None
+session = None
+# Aggregates are queried from several threads: print whole messages
+printLock = threading.Lock()
 VALID_NS = ['{http://www.geni.net/resources/rspec/3}',
             '{http://www.protogeni.net/resources/rspec/2}'
            ]
@@ -98,22 +104,27 @@ def getFileName(filename, defaultAnswer):
     return filename
 
 
-def setNSPrefix(prefix):
-  ''' Helper function for parsing rspecs. It sets the global variabl NSPrefix to
-  the currently parsed rspec namespace. 
+def printMsg(msg):
+  ''' Print msg, without interleaving with messages from other threads
   '''
-  global NSPrefix
+  with printLock:
+    print msg
+
+def getNSPrefix(dom):
+  ''' Helper function for parsing rspecs. It returns the namespace of the
+  given parsed rspec, as a prefix for tag().
+  '''
+  prefix = re.findall(r'\{.*\}', dom.tag)[0]
   if prefix not in VALID_NS:
-    print "Listresources namespace %s is not valid. Exit!" % prefix
+    printMsg("Listresources namespace %s is not valid. Exit!" % prefix)
     sys.exit(-1)
+  return prefix
 
-  NSPrefix = prefix
-
-def tag(tag):
-  ''' Helper function for parsing rspecs. It gets a tag and uses the global
-  NSPrefix to return the full name
+def tag(tag, nsPrefix):
+  ''' Helper function for parsing rspecs. It gets a tag and uses the
+  namespace prefix from getNSPrefix to return the full name
   '''
-  return "%s%s" %(NSPrefix,tag)
+  return "%s%s" %(nsPrefix,tag)
 
 def getInfoFromManifest(manifestStr):
   ''' Function that takes as input a manifest rspec in a string and parses the
@@ -124,29 +135,28 @@ def getInfoFromManifest(manifestStr):
   try:
     dom = etree.fromstring(manifestStr) 
   except Exception, e:
-    print "Couldn't parse the manifest RSpec."
+    printMsg("Couldn't parse the manifest RSpec.")
     sys.exit(-1)
 
-  setNSPrefix(re.findall(r'\{.*\}', dom.tag)[0])
+  nsPrefix = getNSPrefix(dom)
   gsiNS = "{http://groups.geni.net/exogeni/attachment/wiki/RspecExtensions/sliver-info/1}" # Use to look up sliverstatus in RSpec for EG
   loginInfo = []
-  for node_el in dom.findall(tag("node")):
+  for node_el in dom.findall(tag("node", nsPrefix)):
     # Try to get the per node status from the EG specific geni_sliver_info RSpec extension
     geni_status = "unknown"
     for gsi_el in node_el.findall("%s%s" % (gsiNS, "geni_sliver_info")):
         if 'state' in gsi_el.keys():
             # print "Got a geni_sliver_info that says state is: %s" % (gsi_el.attrib['state'])
             geni_status = gsi_el.attrib['state']
-    for serv_el in node_el.findall(tag("services")):
-      for login_el in serv_el.findall(tag("login")):
+    for serv_el in node_el.findall(tag("services", nsPrefix)):
+      for login_el in serv_el.findall(tag("login", nsPrefix)):
          # print "Looking in login tag: %s with attribute %s in node %s" % (login_el, login_el.attrib, node_el.attrib["client_id"])
          try:
            loginInfo.append(login_el.attrib)
            loginInfo[-1]["client_id"] = node_el.attrib["client_id"]
            loginInfo[-1]["sliver_urn"] = node_el.attrib["sliver_id"]
          except AttributeError, ae:
-           print "Couldn't get login information, maybe your sliver is not ready.  Run sliverstatus."
-           print "Error: %s" % ae
+           printMsg("Couldn't get login information, maybe your sliver is not ready.  Run sliverstatus.\nError: %s" % ae)
            sys.exit(-1)
          if not loginInfo[-1].has_key("geni_status"):
              loginInfo[-1]["geni_status"] = geni_status #From the geni_sliver_info sub element
@@ -180,8 +190,45 @@ def findUsersAndKeys( ):
         #print "Found %d keys for %s" % (len(keyList[username]), username)
     return keyList
 
-def getInfoFromSliceManifest( amUrl ) :
-    tmpoptions = copy.deepcopy(options)
+def omniCall( argv, opts ):
+    '''Run an omni command using our one omni session, which re-uses the
+    loaded framework and user credential across calls'''
+    global session
+    if session is None:
+      session = omni.OmniSession()
+    return session.call( argv, opts )
+
+def saveSliceCred( opts ):
+    '''Get the slice credential once and save it to a temporary file, so
+    that later omni calls can read it from there (--slicecredfile) instead
+    of each fetching it again. opts is not changed.
+    Return the file name, or None if none was saved.'''
+    if opts.slicecredfile and os.path.exists(opts.slicecredfile):
+      # User supplied the slice credential
+      return None
+    try:
+      text, cred = omniCall( ['getslicecred', slicename], opts )
+    except (oe.AMAPIError, oe.OmniError) as err:
+      # Each call will fetch the slice credential itself
+      return None
+    credXML = credutils.get_cred_xml(cred)
+    if not credXML:
+      return None
+    (fd, filename) = tempfile.mkstemp(prefix="readyToLogin-", suffix="-cred.xml")
+    with os.fdopen(fd, 'w') as f:
+      f.write(credXML)
+    return filename
+
+def forEachAggregate( func, items ):
+    '''Call func(*item) for each of the items, for up to options.parallel
+    aggregates at once. Return the list of results, in order.
+    Exits if any call exits.'''
+    return parallel_map(lambda item: func(*item), items, options.parallel)
+
+def getInfoFromSliceManifest( amUrl, opts=None ) :
+    if opts is None:
+      opts = options
+    tmpoptions = copy.deepcopy(opts)
     tmpoptions.aggregate = [amUrl]
 
     
@@ -193,9 +240,9 @@ def getInfoFromSliceManifest( amUrl ) :
 
     argv = [apicall, slicename]
     try:
-      text, apicallout = omni.call( argv, tmpoptions )
+      text, apicallout = omniCall( argv, tmpoptions )
     except (oe.AMAPIError, oe.OmniError) as err:
-      print "ERROR: There was an error executing %s, review the logs." % apicall
+      printMsg("ERROR: There was an error executing %s, review the logs." % apicall)
       #print "error was: %s" % err
       return []
     key = amUrl
@@ -206,18 +253,18 @@ def getInfoFromSliceManifest( amUrl ) :
     if not apicallout.has_key(key):
       if len(apicallout.keys()) == 1 :
         newkey = apicallout.keys()[0]
-        print "WARN: Got result for AM URL %s instead of %s - did Omni redirect you?" % (newkey, key)
+        printMsg("WARN: Got result for AM URL %s instead of %s - did Omni redirect you?" % (newkey, key))
         key = newkey
       else:
-        print "ERROR: No manifest found from %s at %s; review the logs." % \
+        printMsg("ERROR: No manifest found from %s at %s; review the logs." % (apicall, amUrl))
         sys.exit(-1)
 
     if tmpoptions.api_version == 1:
       manifest = apicallout[key]
     else:
       if not apicallout[key].has_key("value"):
-        print "ERROR: No value slot in return from %s from %s; review the logs."\
-              % (apicall, amUrl)
+        printMsg("ERROR: No value slot in return from %s from %s; review the logs."\
+              % (apicall, amUrl))
         return []
       if not apicallout[key].has_key('code') or not isinstance(apicallout[key]['code'], dict) or not apicallout[key]['code'].has_key('geni_code') or apicallout[key]['code']['geni_code'] != 0:
           msg = "ERROR: Failed to get manifest from %s call at %s; " % (apicall, amUrl)
@@ -225,7 +272,7 @@ def getInfoFromSliceManifest( amUrl ) :
               msg += apicallout[key]['output']
           else:
               msg += "review the logs"
-          print msg
+          printMsg(msg)
           return []
       value = apicallout[key]["value"]
 
@@ -234,11 +281,11 @@ def getInfoFromSliceManifest( amUrl ) :
       else:
         if tmpoptions.api_version == 3:
             if not (isinstance(value, dict) and value.has_key('geni_rspec')):
-                print "ERROR: Malformed return from %s at %s - no rspec found" % (apicall, amUrl)
+                printMsg("ERROR: Malformed return from %s at %s - no rspec found" % (apicall, amUrl))
                 return []
             manifest = value['geni_rspec']
         else:
-          print "ERROR: API v%s not yet supported" %tmpoptions.api_version
+          printMsg("ERROR: API v%s not yet supported" %tmpoptions.api_version)
           return []          
 
     maniInfo = getInfoFromManifest(manifest)
@@ -250,7 +297,7 @@ def getInfoFromSliverStatusPL( sliverStat ):
 
     loginInfo = []
     if not sliverStat or not sliverStat.has_key('geni_resources'):
-      print "ERROR: Empty Sliver Status, or no geni_resources listed"
+      printMsg("ERROR: Empty Sliver Status, or no geni_resources listed")
       return loginInfo
 
     for resourceDict in sliverStat['geni_resources']: 
@@ -266,8 +313,10 @@ def getInfoFromSliverStatusPL( sliverStat ):
                        })
     return loginInfo
 
-def getSliverStatus( amUrl, amType ) :
-    tmpoptions = copy.deepcopy(options)
+def getSliverStatus( amUrl, amType, opts=None ) :
+    if opts is None:
+      opts = options
+    tmpoptions = copy.deepcopy(opts)
     tmpoptions.aggregate = [amUrl]
         
     # Run equivalent of 'omni.py sliverstatus username'
@@ -281,27 +330,27 @@ def getSliverStatus( amUrl, amType ) :
         argv = ['sliverstatus', slicename]
         
     try:
-      text, sliverStatus = omni.call( argv, tmpoptions )
+      text, sliverStatus = omniCall( argv, tmpoptions )
     except (oe.AMAPIError, oe.OmniError) :
-      print "ERROR: There was an error executing sliverstatus, review the logs."
+      printMsg("ERROR: There was an error executing sliverstatus, review the logs.")
       sys.exit(-1)
 
     if not sliverStatus:
-      print "ERROR: Got no SliverStatus for AM %s; check the logs. Message: %s" % (amUrl, text)
+      printMsg("ERROR: Got no SliverStatus for AM %s; check the logs. Message: %s" % (amUrl, text))
       sys.exit(-1)
 
     if not sliverStatus.has_key(amUrl):
       if len(sliverStatus.keys()) == 1 :
         newAmUrl = sliverStatus.keys()[0]
-        print "WARN: Got result for AM URL %s instead of %s - did Omni redirect you?" % (newAmUrl, amUrl)
+        printMsg("WARN: Got result for AM URL %s instead of %s - did Omni redirect you?" % (newAmUrl, amUrl))
         amUrl = newAmUrl
       else:
-        print "ERROR: Got no SliverStatus for AM %s; check the logs." % (amUrl)
+        printMsg("ERROR: Got no SliverStatus for AM %s; check the logs." % (amUrl))
         sys.exit(-1)
     return sliverStatus[amUrl]
 
-def getInfoFromSliverStatus( amUrl, amType ) :
-    sliverStatus = getSliverStatus( amUrl, amType )
+def getInfoFromSliverStatus( amUrl, amType, opts=None ) :
+    sliverStatus = getSliverStatus( amUrl, amType, opts )
     if amType == 'sfa' : 
       loginInfo = getInfoFromSliverStatusPL(sliverStatus)
     return loginInfo
@@ -366,6 +415,10 @@ def getParser() :
                     dest="no_ansible_username",
                     help="Never include the username to use in the ansible inventory file.",
                     action="store_true", default=False)
+  parser.add_option("--parallel",
+                    dest="parallel",
+                    action="store", type="int", default=5,
+                    help="Number of aggregates to query at once (default %default). Use 1 to query one at a time.")
   return parser
 
 
@@ -390,35 +443,37 @@ def parseArguments( argv=None, opts=None ) :
       sys.exit("Must pass in slicename as argument of script.\nRun '%s -h' for more information."%sys.argv[0])
 
 
-def addNodeStatus(amUrl, amType, amLoginInfo):
+def addNodeStatus(amUrl, amType, amLoginInfo, opts=None):
   ''' This function is intended to get the node status from SliverStatus, in
   case the login information comes from the manifest rspec that does not contain
   status information
   '''
+  if opts is None:
+    opts = options
   # Call SliverStatus
-  sliverStatus = getSliverStatus( amUrl, amType )
+  sliverStatus = getSliverStatus( amUrl, amType, opts )
   if not sliverStatus:
-      print "ERROR: empty sliver status!"
+      printMsg("ERROR: empty sliver status!")
       return amLoginInfo
   try:
       amSliverStat = sliverStatus
   except:
-      print "ERROR: empty aggregate sliver status!"
+      printMsg("ERROR: empty aggregate sliver status!")
       return amLoginInfo      
   if not isinstance(amSliverStat, dict) or not amSliverStat.has_key('geni_resources'):
-      print "ERROR: aggregate sliver status lists no geni_resources!"
+      printMsg("ERROR: aggregate sliver status lists no geni_resources!")
       return amLoginInfo
   if amType == "protogeni":
     amLoginInfo = addNodeStatusPG( amLoginInfo, amSliverStat )
     # 10/9/13 PG code is switching to include login info in manifest
     # a future release should remove the following line so that we don't fall back to SliverStatus
-    if options.fallback_status_PG:
-        print "Looking for information in the result of SliverStatus/Status"
+    if opts.fallback_status_PG:
+        printMsg("Looking for information in the result of SliverStatus/Status")
         amLoginInfo = addNodeStatusCheckForPGFallback( amLoginInfo, amSliverStat )
   elif amType == "GRAM":
       amLoginInfo = addNodeStatusGRAM( amLoginInfo, amSliverStat )
   else:
-      print "NOT IMPLEMENTED YET"
+      printMsg("NOT IMPLEMENTED YET")
   return amLoginInfo
 
 def addNodeStatusPG( amLoginInfo, amSliverStat ):
@@ -462,24 +517,24 @@ def addNodeStatusCheckForPGFallback( userLoginInfo, sliverStat ):
     loginInfo = []
     pgKeyList = {}
     if not sliverStat:
-      print "ERROR: empty sliver status!"
+      printMsg("ERROR: empty sliver status!")
       return loginInfo
 
     if not sliverStat.has_key("users"):
-      print "ERROR: No 'users' key in sliver status!"
+      printMsg("ERROR: No 'users' key in sliver status!")
       return loginInfo
 
     if not sliverStat.has_key('geni_resources'):
-      print "ERROR: Sliver Status lists no resources"
+      printMsg("ERROR: Sliver Status lists no resources")
       return loginInfo
 
     for userDict in sliverStat['users'] :
       if not userDict.has_key('login'):
-        print "User entry had no 'login' key"
+        printMsg("User entry had no 'login' key")
         continue
       pgKeyList[userDict['login']] = [] 
       if not userDict.has_key("keys"):
-        print "User entry for %s had no keys" % userDict['login']
+        printMsg("User entry for %s had no keys" % userDict['login'])
         continue
       for k in userDict['keys']:
           #XXX nriga Keep track of keys, in the future we can verify what key goes with
@@ -487,14 +542,14 @@ def addNodeStatusCheckForPGFallback( userLoginInfo, sliverStat ):
           pgKeyList[userDict['login']].append(k['key'])  
     for resourceDict in sliverStat['geni_resources']:
       if not resourceDict.has_key("pg_manifest"):
-        print "No pg_manifest in this entry"
+        printMsg("No pg_manifest in this entry")
         continue
       sliver_urn = ""
       if resourceDict.has_key("geni_urn"):
          sliver_urn = resourceDict["geni_urn"]
 
       if not resourceDict['pg_manifest'].has_key('children'):
-        print "pg_manifest entry has no children"
+        printMsg("pg_manifest entry has no children")
         continue
       for children1 in resourceDict['pg_manifest']['children']:
         if not children1.has_key('children'):
@@ -771,7 +826,7 @@ def main_no_print(argv=None, opts=None, slicen=None):
       # Run equivalent of 'omni.py listslivers'
       argv = ['listslivers', slicename]
       try:
-          text, slivers = omni.call( argv, options )
+          text, slivers = omniCall( argv, options )
       except (oe.AMAPIError, oe.OmniError) :
           print "ERROR: There was an error executing listslivers, review the logs."
           sys.exit(-1)
@@ -797,7 +852,7 @@ def main_no_print(argv=None, opts=None, slicen=None):
   # Run equivalent of 'omni.py getversion'
   argv = ['--ForceUseGetVersionCache', 'getversion']
   try:
-    text, getVersion = omni.call( argv, options )
+    text, getVersion = omniCall( argv, options )
   except (oe.AMAPIError, oe.OmniError) :
     print "ERROR: There was an error executing getVersion, review the logs."
     sys.exit(-1)
@@ -806,40 +861,63 @@ def main_no_print(argv=None, opts=None, slicen=None):
     print "ERROR: Got no GetVersion output; review the logs."
     sys.exit(-1)
 
+  # Get the slice credential once for all the aggregates. The aggregate
+  # queries use a copy of the options that reads it from a file.
+  amOptions = copy.deepcopy(options)
+  credFile = saveSliceCred(amOptions)
+  if credFile:
+    amOptions.slicecredfile = credFile
+  try:
+    # Query the aggregates, several at once
+    loginInfos = forEachAggregate(lambda amUrl, amOutput: getAMLoginInfo(amUrl, amOutput, amOptions),
+                                  getVersion.items())
+  finally:
+    if credFile:
+      os.unlink(credFile)
+
   loginInfoDict = {}
-  for amUrl, amOutput in getVersion.items() :
+  for (amUrl, amOutput), amInfo in zip(getVersion.items(), loginInfos) :
+    if amInfo is not None:
+      loginInfoDict[amUrl] = amInfo
+  return loginInfoDict, keyList
+
+def getAMLoginInfo( amUrl, amOutput, opts=None ):
+    '''Get the login information at one aggregate, given its GetVersion output.
+    Return a dictionary with the amType and the login info, or None if
+    there is none.'''
+    if opts is None:
+      opts = options
     if not amOutput :
-      print "%s returned an error on getVersion, skip!" % amUrl
-      continue
+      printMsg("%s returned an error on getVersion, skip!" % amUrl)
+      return None
     amType = getAMTypeFromGetVersionOut(amUrl, amOutput) 
 
     if amType == "foam" :
-      print "No login information for FOAM! Skip %s" %amUrl
-      continue
+      printMsg("No login information for FOAM! Skip %s" %amUrl)
+      return None
     # XXX Although ProtoGENI returns the service tag in the manifest
     # it does not contain information for all the users, so we will 
     # stick with the sliverstatus until this is fixed
     if amType == "sfa": 
-      amLoginInfo = getInfoFromSliverStatus(amUrl, amType)
+      amLoginInfo = getInfoFromSliverStatus(amUrl, amType, opts)
       if len(amLoginInfo) > 0 :
-        loginInfoDict[amUrl] = {'amType' : amType,
-                                'info' : amLoginInfo
-                               }
-      continue
+        return {'amType' : amType,
+                'info' : amLoginInfo
+               }
+      return None
     else:
       # Getting login info from manifest"
-      amLoginInfo = getInfoFromSliceManifest(amUrl)
+      amLoginInfo = getInfoFromSliceManifest(amUrl, opts)
       # Get the status only if we care
       if len(amLoginInfo) > 0 :
-        if options.readyonly or (amType == "protogeni") or (amType == "GRAM"):
-          amLoginInfo = addNodeStatus(amUrl, amType, amLoginInfo)
-        loginInfoDict[amUrl] = {'amType':amType,
-                                'info':amLoginInfo
-                               }
+        if opts.readyonly or (amType == "protogeni") or (amType == "GRAM"):
+          amLoginInfo = addNodeStatus(amUrl, amType, amLoginInfo, opts)
+        return {'amType':amType,
+                'info':amLoginInfo
+               }
       #else:
       #    print "Not getting node status for %s" % amUrl
-        
-  return loginInfoDict, keyList
+      return None
 
 def createAnsibleInventory(loginInfoDict, keyList):
   global options, geni_username
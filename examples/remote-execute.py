@@ -24,14 +24,19 @@
 #----------------------------------------------------------------------
 
 import copy
+import json
 import string
+import subprocess
 import sys
 import os.path
+import signal
+import threading
 import time
 
 import readyToLogin
 
 import gcf.oscript as omni
+from gcf.omnilib.util.parallel import parallel_map
 
 ################################################################################
 # Requires that you have omni installed and add the paths to gcf/src and
@@ -48,6 +53,10 @@ import gcf.oscript as omni
 # execution of the script is :
 # remote-execute.py <slicename> -a <AMURL1> -a <AMURL2> -m '<command>'
 #
+# The command is run on up to --ssh-parallel hosts at once. The output of each
+# host is printed when it is done, or as it arrives prefixed by the host name
+# with --stream. Use --json-summary to save the output and exit code of each host.
+#
 ################################################################################
 
 #Global variables
@@ -98,12 +107,100 @@ def modifyToIgnoreHostChecking(loginCommands) :
     c = loginCommands[k]['command']
     loginCommands[k]['command'] = c.replace("ssh ", "ssh -q -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no ")
 
+# Serializes printing from the threads running commands
+printLock = threading.Lock()
+
+def readOutput( stream, host, prefix, lines ):
+  '''Read the lines of output from the stream, saving them in lines, and
+  printing them as they arrive prefixed by the host name if stream mode is set'''
+  for line in iter(stream.readline, ''):
+    lines.append(line)
+    if options.stream:
+      with printLock:
+        sys.stdout.write("[%s]%s %s" % (host, prefix, line))
+        sys.stdout.flush()
+  stream.close()
+
 def executeCommand( loginCommands, host, command) :
-  print "2. Send command '%s' to %s\n" % (command, host)
+  '''Run the command on the host. Return a dictionary describing the result:
+  the host, command, exit_code (None if it timed out), timed_out, stdout,
+  stderr, and seconds taken.'''
+  with printLock:
+    print "2. Send command '%s' to %s\n" % (command, host)
   finalCommand = loginCommands[host]["command"] + " '" + command +"'"
-  os.system(finalCommand)
-  print "... Done with command '%s' at %s" % (command, host)
-  time.sleep(5)
+  start = time.time()
+  # ssh must not read our stdin: several commands may run at once
+  devnull = open(os.devnull, 'r')
+  # Run it in its own process group, so a timeout kills ssh and not just the shell
+  proc = subprocess.Popen(finalCommand, shell=True, stdin=devnull,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          preexec_fn=getattr(os, 'setsid', None))
+  timedOut = []
+  timer = None
+  if options.ssh_timeout > 0:
+    def kill():
+      timedOut.append(True)
+      try:
+        if hasattr(os, 'killpg'):
+          os.killpg(proc.pid, signal.SIGKILL)
+        else:
+          proc.kill()
+      except OSError:
+        pass
+    timer = threading.Timer(options.ssh_timeout, kill)
+    timer.start()
+  stdout = []
+  stderr = []
+  readers = [threading.Thread(target=readOutput, args=(proc.stdout, host, "", stdout)),
+             threading.Thread(target=readOutput, args=(proc.stderr, host, " stderr:", stderr))]
+  for r in readers:
+    r.start()
+  for r in readers:
+    r.join()
+  exitCode = proc.wait()
+  if timer is not None:
+    timer.cancel()
+  devnull.close()
+  stdout = "".join(stdout)
+  stderr = "".join(stderr)
+  # Commands may print anything: decode so the result can be saved as JSON
+  result = {'host': host,
+            'command': command,
+            'exit_code': exitCode,
+            'timed_out': bool(timedOut),
+            'stdout': stdout.decode('utf-8', 'replace'),
+            'stderr': stderr.decode('utf-8', 'replace'),
+            'seconds': round(time.time() - start, 3)}
+  if result['timed_out']:
+    result['exit_code'] = None
+
+  with printLock:
+    if not options.stream:
+      sys.stdout.write(stdout)
+      sys.stderr.write(stderr)
+    if result['timed_out']:
+      print "... Command '%s' at %s timed out after %d seconds" % (command, host, options.ssh_timeout)
+    elif exitCode != 0:
+      print "... Done with command '%s' at %s: exit code %d" % (command, host, exitCode)
+    else:
+      print "... Done with command '%s' at %s" % (command, host)
+  return result
+
+def executeCommands( loginCommands, hosts, command ) :
+  '''Run the command on each of the hosts, on up to options.ssh_parallel hosts
+  at once. Return the list of results from executeCommand, in the order of hosts.'''
+  return parallel_map(lambda host: executeCommand(loginCommands, host, command),
+                      hosts, options.ssh_parallel)
+
+def saveSummary( results, filename ) :
+  '''Save the results as JSON to the given file, or print them if the filename is "-"'''
+  summary = json.dumps(results, indent=2, sort_keys=True)
+  if filename == '-':
+    print summary
+  else:
+    with open(filename, 'w') as f:
+      f.write(summary + "\n")
+    print "Command results saved at: %s" % os.path.abspath(filename)
 
 def getParser() : 
   parser = readyToLogin.getParser()
@@ -122,6 +219,18 @@ def getParser() :
                     dest="forward_agent",
                     help="Forward the SSH agent.  Exactly like using '-A' with ssh.",
                     action="store_true", default=False)  
+  parser.add_option("--ssh-parallel", dest="ssh_parallel",
+                    action="store", type="int", default=10,
+                    help="Number of hosts to run the command on at once (default %default).")
+  parser.add_option("--ssh-timeout", dest="ssh_timeout",
+                    action="store", type="int", default=0,
+                    help="Seconds to let the command run on each host before killing it (default: no limit).")
+  parser.add_option("--stream", dest="stream",
+                    action="store_true", default=False,
+                    help="Print output as it arrives, each line prefixed by the host, instead of all the output of each host when it is done.")
+  parser.add_option("--json-summary", dest="json_summary",
+                    default=None, metavar="FILENAME",
+                    help="Save the output and exit code of the command at each host as JSON to this file ('-' to print it).")
 
   return parser
 
@@ -153,7 +262,9 @@ def parseArguments( argv=None ) :
    
 
 def main(argv=None):
-  
+  '''Run the command on the hosts. Return 0 if it succeeded on all of them,
+  1 if it failed or timed out on any.'''
+
   if not argv:
     argv = sys.argv[1:]
 
@@ -175,9 +286,15 @@ def main(argv=None):
   else :
     hosts = loginCommands.keys()
 
-  for h in hosts : 
-    executeCommand( loginCommands, h, options.command) 
-    
+  results = executeCommands( loginCommands, hosts, options.command )
+  if options.json_summary:
+    saveSummary( results, options.json_summary )
+  failed = [r['host'] for r in results if r['exit_code'] != 0]
+  if failed:
+    print "Command failed or timed out at %d of %d host(s): %s" % (len(failed), len(results), ", ".join(failed))
+    return 1
+  return 0
+
 
 if __name__ == "__main__":
     sys.exit(main())
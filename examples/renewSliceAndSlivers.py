@@ -91,6 +91,9 @@ def main(argv=None):
   # Strip fractional seconds from times to avoid errors at PG AMs
   newDate = newDate.replace(microsecond=0)
   retcode = 0
+  # Use one Omni session for both calls, so the framework and
+  # credentials are loaded only once
+  session = omni.OmniSession()
 
   for command in ['renewslice', 'renewsliver']:
     # Here we use --raise-error-on-v2-amapi-error. Note though that if 1 AM has a problem, the script stops. Is that what we want?
@@ -100,7 +103,7 @@ def main(argv=None):
 
     print "Calling Omni to renew slice %s%s until %sZ\n" % (sliceName, (" slivers" if command=="renewsliver" else ""), newDate.isoformat())
     try:
-      text, retItem = omni.call(omniargs, options)
+      text, retItem = session.call(omniargs, options)
     except OmniError, oe:
       print "\n ***** Omni call failed: %s\n" % oe
       retcode = str(oe)
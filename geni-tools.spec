@@ -90,6 +90,9 @@ rm -rf $RPM_BUILD_ROOT
 %{python_sitelib}/gcf/geni/am/resource.py
 %{python_sitelib}/gcf/geni/am/resource.pyc
 %{python_sitelib}/gcf/geni/am/resource.pyo
+%{python_sitelib}/gcf/geni/am/schedule.py
+%{python_sitelib}/gcf/geni/am/schedule.pyc
+%{python_sitelib}/gcf/geni/am/schedule.pyo
 %{python_sitelib}/gcf/geni/am/test_ams.py
 %{python_sitelib}/gcf/geni/am/test_ams.pyc
 %{python_sitelib}/gcf/geni/am/test_ams.pyo
@@ -168,6 +171,9 @@ rm -rf $RPM_BUILD_ROOT
 %{python_sitelib}/gcf/geni/util/secure_xmlrpc_client.py
 %{python_sitelib}/gcf/geni/util/secure_xmlrpc_client.pyc
 %{python_sitelib}/gcf/geni/util/secure_xmlrpc_client.pyo
+%{python_sitelib}/gcf/geni/util/slice_registry.py
+%{python_sitelib}/gcf/geni/util/slice_registry.pyc
+%{python_sitelib}/gcf/geni/util/slice_registry.pyo
 %{python_sitelib}/gcf/geni/util/speaksfor_util.py
 %{python_sitelib}/gcf/geni/util/speaksfor_util.pyc
 %{python_sitelib}/gcf/geni/util/speaksfor_util.pyo
@@ -186,6 +192,9 @@ rm -rf $RPM_BUILD_ROOT
 %{python_sitelib}/gcf/omnilib/chhandler.py
 %{python_sitelib}/gcf/omnilib/chhandler.pyc
 %{python_sitelib}/gcf/omnilib/chhandler.pyo
+%{python_sitelib}/gcf/omnilib/daemon.py
+%{python_sitelib}/gcf/omnilib/daemon.pyc
+%{python_sitelib}/gcf/omnilib/daemon.pyo
 %{python_sitelib}/gcf/omnilib/frameworks/__init__.py
 %{python_sitelib}/gcf/omnilib/frameworks/__init__.pyc
 %{python_sitelib}/gcf/omnilib/frameworks/__init__.pyo
@@ -267,6 +276,12 @@ rm -rf $RPM_BUILD_ROOT
 %{python_sitelib}/gcf/omnilib/util/abac.py
 %{python_sitelib}/gcf/omnilib/util/abac.pyc
 %{python_sitelib}/gcf/omnilib/util/abac.pyo
+%{python_sitelib}/gcf/omnilib/util/configcache.py
+%{python_sitelib}/gcf/omnilib/util/configcache.pyc
+%{python_sitelib}/gcf/omnilib/util/configcache.pyo
+%{python_sitelib}/gcf/omnilib/util/credcache.py
+%{python_sitelib}/gcf/omnilib/util/credcache.pyc
+%{python_sitelib}/gcf/omnilib/util/credcache.pyo
 %{python_sitelib}/gcf/omnilib/util/credparsing.py
 %{python_sitelib}/gcf/omnilib/util/credparsing.pyc
 %{python_sitelib}/gcf/omnilib/util/credparsing.pyo
@@ -294,6 +309,9 @@ rm -rf $RPM_BUILD_ROOT
 %{python_sitelib}/gcf/omnilib/util/omnierror.py
 %{python_sitelib}/gcf/omnilib/util/omnierror.pyc
 %{python_sitelib}/gcf/omnilib/util/omnierror.pyo
+%{python_sitelib}/gcf/omnilib/util/parallel.py
+%{python_sitelib}/gcf/omnilib/util/parallel.pyc
+%{python_sitelib}/gcf/omnilib/util/parallel.pyo
 %{python_sitelib}/gcf/omnilib/util/paths.py
 %{python_sitelib}/gcf/omnilib/util/paths.pyc
 %{python_sitelib}/gcf/omnilib/util/paths.pyo
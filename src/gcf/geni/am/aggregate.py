@@ -23,31 +23,92 @@
 
 from __future__ import absolute_import
 
+import collections
+import itertools
+
 from .resource import Resource
 
 class Aggregate(object):
+    """The resources of an aggregate, and the containers (e.g. slices
+    and users) they are allocated to.
+    Resources not allocated to any container are kept in a free pool,
+    in the order they became free, also by resource type, so that
+    finding free resources does not scan the whole catalog.
+    """
 
     def __init__(self):
         self.resources = []
-        self.containers = {} # of resources, not slivers
+        self.containers = {} # of resources, not slivers: id => resource
+        # resource id => {container: number of allocations}
+        self._holders = {}
+        # Free resources, id => resource, overall and by type
+        self._free = collections.OrderedDict()
+        self._free_by_type = {}
 
     def add_resources(self, resources):
         self.resources.extend(resources)
+        for r in resources:
+            if not self._holders.get(r.id):
+                self._add_free(r)
+
+    def _add_free(self, resource):
+        self._free[resource.id] = resource
+        if resource.type not in self._free_by_type:
+            self._free_by_type[resource.type] = collections.OrderedDict()
+        self._free_by_type[resource.type][resource.id] = resource
+
+    def _remove_free(self, resource):
+        if self._free.pop(resource.id, None) is not None:
+            del self._free_by_type[resource.type][resource.id]
 
     def catalog(self, container=None):
         if container:
             if container in self.containers:
-                return self.containers[container]
+                return self.containers[container].values()
             else:
                 return []
         else:
             return self.resources
 
+    def is_free(self, resource):
+        """Is the resource not allocated to any container?"""
+        return resource.id in self._free
+
+    def iter_free(self, rtype=None):
+        """Iterate over the free resources (of the given type),
+        those free the longest first."""
+        if rtype is None:
+            return self._free.itervalues()
+        return self._free_by_type.get(rtype, {}).itervalues()
+
+    def free_resources(self, count=None, rtype=None):
+        """Return at most count free resources (of the given type)."""
+        return list(itertools.islice(self.iter_free(rtype), count))
+
     def allocate(self, container, resources):
-        if container not in self.containers:
-            self.containers[container] = []
         for r in resources:
-            self.containers[container].append(r)
+            if container not in self.containers:
+                self.containers[container] = collections.OrderedDict()
+            self.containers[container][r.id] = r
+            holders = self._holders.setdefault(r.id, {})
+            holders[container] = holders.get(container, 0) + 1
+            self._remove_free(r)
+
+    def _release(self, container, resource, completely=False):
+        """Undo one (or all) allocations of the resource to the container,
+        deleting the container if it is left empty"""
+        holders = self._holders.get(resource.id)
+        if not holders or container not in holders:
+            return
+        holders[container] -= 1
+        if completely or holders[container] == 0:
+            del holders[container]
+            del self.containers[container][resource.id]
+            if not self.containers[container]:
+                del self.containers[container]
+        if not holders:
+            del self._holders[resource.id]
+            self._add_free(resource)
 
     def deallocate(self, container, resources):
         if container and not self.containers.has_key(container):
@@ -57,28 +118,20 @@ class Aggregate(object):
         if container and resources:
             # deallocate the given resources from the container
             for r in resources:
-                self.containers[container].remove(r)
+                self._release(container, r)
         elif container:
             # deallocate all the resources in the container
-            container_resources = list(self.containers[container])
+            container_resources = list(self.containers[container].values())
             for r in container_resources:
-                self.containers[container].remove(r)
+                self._release(container, r, completely=True)
         elif resources:
-            # deallocate the resources from their container
+            # deallocate the resources from their containers
             for r in resources:
-                for c in self.containers.values():
-                    if r in c:
-                        c.remove(r)
-        # Finally, check if container is empty. If so, delete it.
-        # Note cache the keys because we will be modifying the dict
-        # inside the loop
-        allkeys = self.containers.keys()
-        for k in allkeys:
-            if not self.containers[k]:
-                del self.containers[k]
+                for c in self._holders.get(r.id, {}).keys():
+                    self._release(c, r)
 
     def stop(self, container):
         # Mark the resources as 'SHUTDOWN'
         if container in self.containers:
-            for r in self.containers[container]:
+            for r in self.containers[container].values():
                 r.status = Resource.STATUS_SHUTDOWN
@@ -86,6 +86,8 @@ class Slice(object):
         self.urn = urn
         self.expiration = expiration
         self.resources = dict()
+        # URN of the user who created the sliver
+        self.owner = None
 
     def getURN(self) : return self.urn
 
@@ -321,27 +323,19 @@ class ReferenceAggregateManager(object):
         # EG if both V1 and V2 are supported, and the user gives V2 request,
         # then you must return a V2 request and not V1
 
-        allresources = self._agg.catalog()
-        allrdict = dict()
-        for r in allresources:
-            if r.available:
-                allrdict[r.id] = r
-
         # Note: This only handles unbound nodes. Any attempt by the client
         # to specify a node is ignored.
         resources = dict()
         unbound = list()
         for elem in rspec_dom.documentElement.getElementsByTagName('node'):
             unbound.append(elem)
-        for elem in unbound:
+        # Resources not allocated to any slice are available
+        available = self._agg.free_resources(len(unbound))
+        if len(available) < len(unbound):
+            return self.errorResult(6, 'Too Big: insufficient resources to fulfill request')
+        for elem, r in zip(unbound, available):
             client_id = elem.getAttribute('client_id')
-            keys = allrdict.keys()
-            if keys:
-                rid = keys[0]
-                resources[client_id] = allrdict[rid]
-                del allrdict[rid]
-            else:
-                return self.errorResult(6, 'Too Big: insufficient resources to fulfill request')
+            resources[client_id] = r
 
         # determine max expiration time from credentials
         # do not create a sliver that will outlive the slice!
@@ -352,6 +346,7 @@ class ReferenceAggregateManager(object):
                 expiration = credexp
 
         newslice = Slice(slice_urn, expiration)
+        newslice.owner = user_urn
         self._agg.allocate(slice_urn, resources.values())
         self._agg.allocate(user_urn, resources.values())
         for cid, r in resources.items():
@@ -396,10 +391,6 @@ class ReferenceAggregateManager(object):
         except Exception, e:
             raise xmlrpclib.Fault('Insufficient privileges', str(e))
 
-        # Grab the user_urn
-        user_urn = gid.GID(string=options['geni_true_caller_cert']).get_urn()
-
-
         # If we get here, the credentials give the caller
         # all needed privileges to act on the given target.
         if slice_urn in self._slices:
@@ -414,7 +405,10 @@ class ReferenceAggregateManager(object):
                 r.reset()
 
             self._agg.deallocate(slice_urn, None)
-            self._agg.deallocate(user_urn, None)
+            # Release the hold of the user who created the sliver, who
+            # may not be the caller, on this sliver's resources only
+            if sliver.owner:
+                self._agg.deallocate(sliver.owner, resources)
             del self._slices[slice_urn]
             self.logger.info("Sliver %r deleted" % slice_urn)
             return self.successResult(True)
@@ -39,6 +39,7 @@ import base64
 import collections
 import datetime
 import dateutil.parser
+import itertools
 import logging
 import os
 import traceback
@@ -49,6 +50,7 @@ import zlib
 
 from .aggregate import Aggregate
 from .fakevm import FakeVM
+from .schedule import ResourceSchedule
 from ... import geni
 from ..util.tz_util import tzd
 from ..util.urn_util import publicid_to_urn
@@ -143,6 +145,8 @@ class Sliver(object):
     def __init__(self, parent_slice, resource):
         self._id = str(uuid.uuid4())
         self._resource = resource
+        # The resource may be reserved by other slivers at other times
+        self._client_id = resource.external_id
         self._slice = parent_slice
         self._expiration = None
         self._start_time = None
@@ -150,6 +154,8 @@ class Sliver(object):
         self._allocation_state = STATE_GENI_UNALLOCATED
         self._operational_state = OPSTATE_GENI_PENDING_ALLOCATION
         self._urn = None
+        # URN of the user who allocated this sliver
+        self._owner = None
         global RESOURCE_NAMESPACE
         self._base = RESOURCE_NAMESPACE
         self._setUrnFromParent(resource.urn(self._base))
@@ -158,6 +164,9 @@ class Sliver(object):
     def resource(self):
         return self._resource
 
+    def clientId(self):
+        return self._client_id
+
     def slice(self):
         return self._slice
 
@@ -181,6 +190,12 @@ class Sliver(object):
     def expiration(self):
         return self._expiration
 
+    def setOwner(self, owner_urn):
+        self._owner = owner_urn
+
+    def owner(self):
+        return self._owner
+
     def setStartTime(self, new_start_time):
         self._start_time = new_start_time
 
@@ -207,7 +222,11 @@ class Sliver(object):
     def delete(self):
         if self.allocationState() == STATE_GENI_PROVISIONED:
             self._resource.deprovision()
-        self.resource().reset()
+        # A sliver in the future has not touched its resource,
+        # which may be in use by another sliver now
+        if self._start_time is None or \
+                self._start_time <= datetime.datetime.utcnow():
+            self.resource().reset()
         self._resource = None
         self.setAllocationState(STATE_GENI_UNALLOCATED)
         self.setOperationalState(OPSTATE_GENI_PENDING_ALLOCATION)
@@ -287,6 +306,8 @@ class ReferenceAggregateManager(object):
         self._slices = dict()
         self._agg = Aggregate()
         self._agg.add_resources([FakeVM(self._agg) for _ in range(20)])
+        # Reservations of the resources for windows of time, by sliver
+        self._schedule = ResourceSchedule()
         self._my_urn = publicid_to_urn("IDN %s %s %s" % (self._urn_authority, 'authority', 'am'))
         self.max_lease = datetime.timedelta(minutes=REFAM_MAXLEASE_MINUTES)
         self.max_alloc = datetime.timedelta(seconds=ALLOCATE_EXPIRATION_SECONDS)
@@ -400,6 +421,7 @@ class ReferenceAggregateManager(object):
 #                return self._no_such_slice(slice_urn)
 #        else:
         all_resources = self._agg.catalog(None)
+        self._update_availability(all_resources)
         available = 'geni_available' in options and options['geni_available']
         resource_xml = ""
         for r in all_resources:
@@ -456,27 +478,11 @@ class ReferenceAggregateManager(object):
         # EG if both V1 and V2 are supported, and the user gives V2 request,
         # then you must return a V2 manifest and not V1
 
-        available = self.resources(available=True)
-
         # Note: This only handles unbound nodes. Any attempt by the client
         # to specify a node is ignored.
         unbound = list()
         for elem in rspec_dom.documentElement.getElementsByTagName('node'):
             unbound.append(elem)
-        if len(unbound) > len(available):
-            # There aren't enough resources
-            self.logger.error('Too big: requesting %d resources but I only have %d',
-                              len(unbound), len(available))
-            return self.errorResult(AM_API.TOO_BIG,
-                                    'Too Big: insufficient resources to fulfill request')
-
-        resources = list()
-        for elem in unbound:
-            client_id = elem.getAttribute('client_id')
-            resource = available.pop(0)
-            resource.external_id = client_id
-            resource.available = False
-            resources.append(resource)
 
         # determine max expiration time from credentials
         # do not create a sliver that will outlive the slice!
@@ -501,6 +507,9 @@ class ReferenceAggregateManager(object):
         if (start_time > self.min_expire(creds)):
             return self.errorResult(AM_API.BAD_ARGS, 
                                     "Can't request start time on sliver after slice expiration")
+        if end_time <= start_time:
+            return self.errorResult(AM_API.BAD_ARGS,
+                                    "Can't request end time on sliver before start time")
 
         # determine max expiration time from credentials
         # do not create a sliver that will outlive the slice!
@@ -534,14 +543,42 @@ class ReferenceAggregateManager(object):
         else:
             newslice = Slice(slice_urn)
 
+        # Find resources that are free for the whole requested window.
+        # Resources in the aggregate's free pool have no reservations,
+        # so only look at the others if the pool runs out.
+        candidates = itertools.chain(self._agg.iter_free(),
+                                     self._schedule.reserved_resources())
+        available = self._schedule.free_resources(candidates,
+                                                  start_time, end_time,
+                                                  len(unbound))
+        if len(unbound) > len(available):
+            # There aren't enough resources
+            self.logger.error('Too big: requesting %d resources but I only have %d',
+                              len(unbound), len(available))
+            return self.errorResult(AM_API.TOO_BIG,
+                                    'Too Big: insufficient resources to fulfill request')
+
+        resources = list()
+        for elem in unbound:
+            client_id = elem.getAttribute('client_id')
+            resource = available[len(resources)]
+            resource.external_id = client_id
+            if start_time <= now:
+                resource.available = False
+            resources.append(resource)
+
         for resource in resources:
             sliver = newslice.add_resource(resource)
             sliver.setExpiration(expiration)
             sliver.setStartTime(start_time)
             sliver.setEndTime(end_time)
             sliver.setAllocationState(STATE_GENI_ALLOCATED)
-        self._agg.allocate(slice_urn, newslice.resources())
-        self._agg.allocate(user_urn, newslice.resources())
+            sliver.setOwner(user_urn)
+            self._schedule.reserve(resource, start_time, end_time, sliver)
+        # Only the new resources: those of earlier slivers are already
+        # held by the slice and by the users who allocated them
+        self._agg.allocate(slice_urn, resources)
+        self._agg.allocate(user_urn, resources)
         self._slices[slice_urn] = newslice
 
         # Log the allocation
@@ -620,6 +657,8 @@ class ReferenceAggregateManager(object):
             # Extend the lease and set to PROVISIONED
             expiration = min(sliver.endTime(), max_expiration)
             sliver.setEndTime(expiration)
+            if expiration > sliver.startTime():
+                self._schedule.change_end(sliver, expiration)
             sliver.setExpiration(expiration)
             sliver.setAllocationState(STATE_GENI_PROVISIONED)
             sliver.setOperationalState(OPSTATE_GENI_NOT_READY)
@@ -638,9 +677,6 @@ class ReferenceAggregateManager(object):
 
         self.getVerifiedCredentials(the_slice.urn, credentials, options, privileges)
 
-        # Grab the user_urn
-        user_urn = gid.GID(string=options['geni_true_caller_cert']).get_urn()
-
         # If we get here, the credentials give the caller
         # all needed privileges to act on the given target.
         if the_slice.isShutdown():
@@ -651,8 +687,12 @@ class ReferenceAggregateManager(object):
                                      % (the_slice.urn)))
         resources = [sliver.resource() for sliver in slivers]
         self._agg.deallocate(the_slice.urn, resources)
-        self._agg.deallocate(user_urn, resources)
         for sliver in slivers:
+            # Release the hold of the user who allocated the sliver,
+            # who may not be the caller
+            if sliver.owner():
+                self._agg.deallocate(sliver.owner(), [sliver.resource()])
+            self._schedule.release(sliver)
             slyce = sliver.slice()
             slyce.delete_sliver(sliver)
             # If slice is now empty, delete it.
@@ -880,11 +920,23 @@ class ReferenceAggregateManager(object):
             self.logger.error(msg)
             return self.errorResult(AM_API.OUT_OF_RANGE, msg)
         else:
+            # The resources must be free until the new end times
+            for sliver in slivers:
+                end_time = max(sliver.endTime(), requested)
+                if not self._schedule.is_free(sliver.resource(),
+                                              sliver.startTime(), end_time,
+                                              sliver):
+                    msg = (("Unavailable: Resource of sliver %s is reserved"
+                            + " by another sliver before %s.")
+                           % (sliver.urn(), expiration_time))
+                    self.logger.error(msg)
+                    return self.errorResult(AM_API.UNAVAILABLE, msg)
             # Renew all the named slivers
             for sliver in slivers:
                 sliver.setExpiration(requested)
                 end_time = max(sliver.endTime(), requested)
                 sliver.setEndTime(end_time)
+                self._schedule.change_end(sliver, end_time)
 
         geni_slivers = [s.status() for s in slivers]
         return self.successResult(geni_slivers)
@@ -1041,7 +1093,7 @@ class ReferenceAggregateManager(object):
         component_manager_id="%s"
         sliver_id="%s"/>
 '''
-        return tmpl % (sliver.resource().external_id,
+        return tmpl % (sliver.clientId(),
                        sliver.resource().urn(self._urn_authority),
                        self._my_urn, sliver.urn())
 
@@ -1064,9 +1116,17 @@ class ReferenceAggregateManager(object):
         """
         result = self._agg.catalog()
         if available is not None:
+            self._update_availability(result)
             result = [r for r in result if r.available is available]
         return result
 
+    def _update_availability(self, resources):
+        """Mark the given resources available if not reserved now
+        (they may have reservations in the future)."""
+        now = datetime.datetime.utcnow()
+        for r in resources:
+            r.available = not self._schedule.in_use(r, now)
+
     def rfc3339format(self, dt):
         """Return a string representing the given datetime in rfc3339 format.
         """
@@ -1092,7 +1152,15 @@ class ReferenceAggregateManager(object):
                     expired.append(sliver)
         self.logger.info('Expiring %d slivers', len(expired))
         for sliver in expired:
+            self._schedule.release(sliver)
+            # Release the resource from this slice and the user who
+            # allocated it only, as Delete does: other slivers may
+            # hold it for other times
             slyce = sliver.slice()
+            resources = [sliver.resource()]
+            self._agg.deallocate(slyce.urn, resources)
+            if sliver.owner():
+                self._agg.deallocate(sliver.owner(), resources)
             slyce.delete_sliver(sliver)
             # If slice is now empty, delete it.
             if not slyce.slivers():
@@ -21,6 +21,9 @@
 # IN THE WORK.
 #----------------------------------------------------------------------
 
+import heapq
+from collections import deque
+
 
 class GraphNode(object) :
     """ This is the base class for all the objects that correspond to 
@@ -38,30 +41,96 @@ class GraphNode(object) :
         pass
 
 
-def findShortestPath(startNode, endNode, pathSoFar =[]) :
+def buildAdjacency(nodes) :
+    """ Return a dictionary mapping every GraphNode reachable from the
+        given GraphNodes to its list of neighbors, so that the neighbors
+        of each node are computed only once.
+    """
+    adjacency = {}
+    toVisit = list(nodes)
+    while toVisit :
+        node = toVisit.pop()
+        if node in adjacency :
+            continue
+        neighbors = list(node.getNeighbors())
+        adjacency[node] = neighbors
+        for neighbor in neighbors :
+            if neighbor not in adjacency :
+                toVisit.append(neighbor)
+    return adjacency
+
+
+def shortestPathTree(startNode, adjacency=None, weight=None) :
+    """ Find the shortest paths from startNode to every GraphNode reachable
+        from it.  Returns a dictionary mapping each reachable node to its
+        predecessor on the shortest path from startNode (startNode maps
+        to None).  Use pathFromTree to get the path to a given node.
+
+        adjacency is an optional dictionary from buildAdjacency.  Without
+        it the neighbors come from getNeighbors.
+        weight is an optional function of (node, neighbor) giving the cost
+        of that hop (e.g. based on link capacity).  Without it every hop
+        costs 1.  Of equally short paths, the one found first going through
+        the neighbors in order is used.
+    """
+    if adjacency is None :
+        neighborsOf = lambda node : node.getNeighbors()
+    else :
+        neighborsOf = lambda node : adjacency.get(node, [])
+
+    predecessors = {startNode : None}
+    if weight is None :
+        # Breadth first search
+        toVisit = deque([startNode])
+        while toVisit :
+            node = toVisit.popleft()
+            for neighbor in neighborsOf(node) :
+                if neighbor not in predecessors :
+                    predecessors[neighbor] = node
+                    toVisit.append(neighbor)
+        return predecessors
+
+    # Dijkstra.  The count keeps the heap order stable and avoids
+    #    comparing nodes.
+    distances = {startNode : 0}
+    done = set()
+    count = 0
+    toVisit = [(0, count, startNode)]
+    while toVisit :
+        distance, ignore, node = heapq.heappop(toVisit)
+        if node in done :
+            continue
+        done.add(node)
+        for neighbor in neighborsOf(node) :
+            newDistance = distance + weight(node, neighbor)
+            if neighbor not in distances or newDistance < distances[neighbor] :
+                distances[neighbor] = newDistance
+                predecessors[neighbor] = node
+                count += 1
+                heapq.heappush(toVisit, (newDistance, count, neighbor))
+    return predecessors
+
+
+def pathFromTree(predecessors, endNode) :
+    """ Return the path (list of GraphNodes) to endNode in the given
+        result of shortestPathTree, or None if endNode is not reachable.
+    """
+    if endNode not in predecessors :
+        return None
+    path = []
+    node = endNode
+    while node is not None :
+        path.append(node)
+        node = predecessors[node]
+    path.reverse()
+    return path
+
+
+def findShortestPath(startNode, endNode, adjacency=None, weight=None) :
     """ Find the shortest path between the specified GraphNode objects 
-        that form the nodes of a graph.
+        that form the nodes of a graph.  Returns the list of nodes on the
+        path, from startNode to endNode, or None if there is no path.
+        See shortestPathTree for adjacency and weight.
     """
-    # Add this node to the path explored so far
-    pathSoFar = pathSoFar + [startNode]
-
-    if startNode == endNode :
-        # Found path to the endNode!
-        return pathSoFar
-
-    # Path from here to the endNode.  We currently don't have such a path
-    pathFromHere =  None
-
-    # See if we can get to the endNode through one of our neighbors
-    neighbors = startNode.getNeighbors() 
-    for i in range(len(neighbors)) :
-        if neighbors[i] not in pathSoFar :
-            pathThruNeighbor = findShortestPath(neighbors[i], endNode, \
-                                                    pathSoFar)
-            if pathThruNeighbor != None :
-                if (pathFromHere == None) or (len(pathThruNeighbor) < \
-                                                  len(pathFromHere)) :
-                    # Found a new or shorter path to the endNode 
-                    pathFromHere = pathThruNeighbor
-
-    return pathFromHere
+    return pathFromTree(shortestPathTree(startNode, adjacency, weight),
+                        endNode)
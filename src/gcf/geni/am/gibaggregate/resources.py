@@ -390,6 +390,10 @@ def _generateBashScript(users) :
 
     # Now we are ready to set up the IP routing tables on each container
     scriptFile.write('\n## Set up IP routing tables on each host \n');
+    # Neighbors of every node in the topology, for the shortest path
+    #    searches below
+    adjacency = graphUtils.buildAdjacency([experimentHosts[hostName] \
+                                               for hostName in hostNames])
     for i in range(len(hostNames)) :
         hostObject = experimentHosts[hostNames[i]]
     
@@ -447,11 +451,14 @@ def _generateBashScript(users) :
         #    connected.  For these links find the shortes path to the link
         #    (subnet) and route packes in that direction (first host in that
         #    direction acts as a gateway)
+        #    One search finds the shortest paths from this host to all links
+        if len(notDirectlyConnectedLinks) > 0 :
+            pathTree = graphUtils.shortestPathTree(hostObject, adjacency)
         for j in range(len(notDirectlyConnectedLinks)) :
             linkObject = notDirectlyConnectedLinks[j]
 
             # Find the shortest path from this host to this subnet (linkObject)
-            path = graphUtils.findShortestPath(hostObject, linkObject)
+            path = graphUtils.pathFromTree(pathTree, linkObject)
             if path != None :
                 # We found a path from this host to the subnet (link)
                 #    Path is a NIC -> Link -> NIC -> Host (gateway) -> ...
@@ -26,9 +26,14 @@ Speaks only AM API v2.'''
 
 from __future__ import absolute_import
 
+import atexit
 import logging
 import os
 import socket
+import ssl
+import threading
+import time
+import xmlrpclib
 
 from ... import geni
 from ...geni.am.am2 import AggregateManager
@@ -50,12 +55,15 @@ class ProxyAggregateManager(ReferenceAggregateManager):
     # URL of actual AM to which we're connecting
     am_url = None
 
-    # *** TO DO ***
-    # keep a cache of member_id => key/cert
-    # And a cache of connections
+    # Seconds to keep using a member's inside key/cert before
+    # looking them up again
+    INSIDE_CERT_TTL = 600
+
+    # Max number of idle clients to keep per member
+    MAX_IDLE_CLIENTS = 4
 
     def __init__(self, am_url, root_cert, urn_authority):
-        super(ProxyAggregateManager, self).__init__(root_cert, urn_authority);
+        super(ProxyAggregateManager, self).__init__(root_cert, urn_authority, am_url);
         self.am_url = am_url
 #        print("SELF.AM_URL = " + self.am_url)
         dictargs = dict(service_type=3) # Member Authority
@@ -65,49 +73,166 @@ class ProxyAggregateManager(ReferenceAggregateManager):
             self.ma_url = ma_service_row['service_url']
             # print("MA_URL " + str(self.ma_url)) 
         self.logger = logging.getLogger('gcf.pxam')
+        # Cache of member_id => dict of inside key/cert files, their
+        # expiration time, and idle clients to the real AM using them
+        self._inside_certs = dict()
+        self._inside_certs_lock = threading.Lock()
+        # Inside key/cert files not yet deleted. Any left at exit are
+        # deleted then.
+        self._inside_cert_files = set()
+        atexit.register(self._remove_inside_cert_files)
 
-    # Helper function to create a proxy client that talks 
-    # to real AM using inside keys
-    def make_proxy_client(self):
+    # Close the given idle proxy client
+    def _close_client(self, client):
+        try:
+            client('close')()
+        except Exception, e:
+            self.logger.debug("Failed to close client to %s: %s", self.am_url, e)
+
+    # Delete the inside key/cert files of the given cache entry,
+    # once no client using them is checked out
+    # Call with _inside_certs_lock held
+    def _release_inside_cert(self, entry):
+        if entry['in_use'] > 0 or not entry['dropped']:
+            return
+        for fname in (entry['key'], entry['cert']):
+            self._inside_cert_files.discard(fname)
+            try:
+                os.unlink(fname)
+            except OSError:
+                pass
+
+    # Delete all remaining inside key/cert files, whether or not
+    # a client is still using them. Run at exit.
+    def _remove_inside_cert_files(self):
+        with self._inside_certs_lock:
+            for fname in self._inside_cert_files:
+                try:
+                    os.unlink(fname)
+                except OSError:
+                    pass
+            self._inside_cert_files.clear()
+
+    # Forget the cached inside key/cert (and clients) for the given member.
+    # Idle clients are closed now; the key/cert files are deleted
+    # when the last checked out client is returned.
+    # Call with _inside_certs_lock held
+    def _drop_inside_cert(self, member_id):
+        entry = self._inside_certs.pop(member_id, None)
+        if entry is None:
+            return
+        entry['dropped'] = True
+        for client in entry['clients']:
+            self._close_client(client)
+        entry['clients'] = []
+        self._release_inside_cert(entry)
+
+    # Forget the cached inside key/cert of all members whose entry
+    # has expired, so that the files of members who do not come back
+    # are not kept forever.
+    # Call with _inside_certs_lock held
+    def _sweep_inside_certs(self, now):
+        for member_id in [member_id for (member_id, entry) in self._inside_certs.items()
+                          if entry['expires'] <= now]:
+            self._drop_inside_cert(member_id)
+
+    # Return the cache entry for the given member, looking up
+    # the member's inside key and cert if needed.
+    # The entry is counted as in use: pass it to close_proxy_client
+    # (on a client made with it) when done.
+    def _get_inside_cert(self, member_id):
+        now = time.time()
+        with self._inside_certs_lock:
+            self._sweep_inside_certs(now)
+            entry = self._inside_certs.get(member_id)
+            if entry is not None:
+                entry['in_use'] += 1
+                return entry
         key_certs = get_inside_cert_and_key(self._server.peercert, \
                                                 self.ma_url, self.logger);
-        key_fname = key_certs['key'];
-        cert_fname = key_certs['cert'];
-        client = make_client(self.am_url, key_fname, cert_fname)
-        client.key_fname = key_fname;
-        client.cert_fname = cert_fname;
+        if not key_certs:
+            raise Exception("Failed to get inside key and cert for member %s" % member_id)
+        entry = dict(key=key_certs['key'], cert=key_certs['cert'],
+                     expires=now + self.INSIDE_CERT_TTL, clients=[],
+                     in_use=1, dropped=False)
+        with self._inside_certs_lock:
+            self._inside_cert_files.update((entry['key'], entry['cert']))
+            self._drop_inside_cert(member_id)
+            self._inside_certs[member_id] = entry
+        return entry
+
+    # Helper function to get a proxy client that talks 
+    # to real AM using inside keys. Re-uses an idle client
+    # for the same member if there is one.
+    # Return the client with close_proxy_client
+    def make_proxy_client(self):
+        member_id = get_member_id(self._server.peercert)
+        entry = self._get_inside_cert(member_id)
+        with self._inside_certs_lock:
+            if entry['clients']:
+                return entry['clients'].pop()
+        try:
+            client = make_client(self.am_url, entry['key'], entry['cert'])
+        except:
+            with self._inside_certs_lock:
+                entry['in_use'] -= 1
+                self._release_inside_cert(entry)
+            raise
+        client.member_id = member_id
+        client.inside_cert = entry
         return client;
 
-    def close_proxy_client(self, client):
-        os.unlink(client.key_fname);
-        os.unlink(client.cert_fname);
+    # Done with the given client. If error is an authentication
+    # failure, forget the member's inside key/cert.
+    def close_proxy_client(self, client, error=None):
+        with self._inside_certs_lock:
+            entry = client.inside_cert
+            entry['in_use'] -= 1
+            if entry['dropped']:
+                # Entry was replaced or dropped while the client was in use
+                self._close_client(client)
+                self._release_inside_cert(entry)
+            elif error is None:
+                if len(entry['clients']) < self.MAX_IDLE_CLIENTS:
+                    entry['clients'].append(client)
+                else:
+                    self._close_client(client)
+            else:
+                self._close_client(client)
+                if isinstance(error, ssl.SSLError) or \
+                        (isinstance(error, xmlrpclib.ProtocolError) and error.errcode in (401, 403)):
+                    self.logger.info("Authentication failure at %s for member %s: forgetting inside key/cert", self.am_url, client.member_id)
+                    self._drop_inside_cert(client.member_id)
 
-    # *** GetVersion should return something to indicate there is a proxy
-    def GetVersion(self, options):
+    # Invoke the given method on the real AM, using the
+    # inside key/cert of the member making this call
+    def _proxy_call(self, method, *args):
         client = self.make_proxy_client();
         client_ret = None;
         try:
-            client_ret = client.GetVersion();
-        except Exception:
-            print "Error in remote GetVersion call";
-        print("GetVersion.CLIENT_RET = " + str(client_ret));
+            client_ret = getattr(client, method)(*args);
+        except Exception, e:
+            self.logger.error("Error in remote %s call: %s", method, e)
+            self.close_proxy_client(client, e);
+            return client_ret;
         self.close_proxy_client(client);
         return client_ret;
 
+    # *** GetVersion should return something to indicate there is a proxy
+    def GetVersion(self, options):
+        client_ret = self._proxy_call('GetVersion');
+        self.logger.debug("GetVersion.CLIENT_RET = " + str(client_ret));
+        return client_ret;
+
     def ListResources(self, credentials, options):
-        client = self.make_proxy_client();
 #        # Shouldn't need this - it is an indication of an version mismatch
 #        options['geni_rspec_version'] = dict(type='geni', version='3');
 #        print("OPTS = " + str(options));
 #        print("CREDS = " + str(credentials));
-        try:
-            client_ret = client.ListResources(credentials, options);
-        except Exception:
-            print "Error in remote ListResources call";
-        print("ListResources.CLIENT_RET = " + str(client_ret));
+        client_ret = self._proxy_call('ListResources', credentials, options);
+        self.logger.debug("ListResources.CLIENT_RET = " + str(client_ret));
         # Why do I need to do this?
 #        client_ret = client_ret['value'];
-        self.close_proxy_client(client);
         return client_ret;
 
     def CreateSliver(self, slice_urn, credentials, rspec, users, options):
@@ -116,50 +241,19 @@ class ProxyAggregateManager(ReferenceAggregateManager):
 #        print("CREDS = " + str(credentials));
 #        print("RSPEC = " + str(rspec));
 #        print("USERS = " + str(users));
-        client = self.make_proxy_client();
-        try:
-            client_ret = client.CreateSliver(slice_urn, credentials, rspec, users, options);
-        except Exception:
-            print "Error in remote CreateSliver call";
-#        print("CreateSliver.CLIENT_RET = " + str(client_ret));
-        self.close_proxy_client(client);
-        return client_ret;
+        return self._proxy_call('CreateSliver', slice_urn, credentials, rspec, users, options);
             
     def DeleteSliver(self, slice_urn, credentials, options):
-        client = self.make_proxy_client();
-        try:
-            client_ret = client.DeleteSliver(slice_urn, credentials, options);
-        except Exception:
-            print "Error in remote DeleteSliver call";
-        self.close_proxy_client(client);
-        return client_ret;
+        return self._proxy_call('DeleteSliver', slice_urn, credentials, options);
 
     def SliverStatus(self, slice_urn, credentials, options):
-        client = self.make_proxy_client();
-        try:
-            client_ret = client.SliverStatus(slice_urn, credentials, options);
-        except Exception:
-            print "Error in remote SliverStatus call";
-        self.close_proxy_client(client);
-        return client_ret;
+        return self._proxy_call('SliverStatus', slice_urn, credentials, options);
 
     def RenewSliver(self, slice_urn, credentials, expiration_time, options):
-        client = self.make_proxy_client();
-        try:
-            client_ret = client.RenewSliver(slice_urn, credentials, expiration_time, options);
-        except Exception:
-            print "Error in remote RenewSliver call"
-        self.close_proxy_client(client);
-        return client_ret;
+        return self._proxy_call('RenewSliver', slice_urn, credentials, expiration_time, options);
 
     def Shutdown(self, slice_urn, credentials, options):
-        client = self.make_proxy_client();
-        try:
-            client_ret = client.Shutdown(slice_urn, credentials, options);
-        except Exception:
-            print "Error in remote Shutdown call"
-        self.close_proxy_client(client);
-        return client_ret;
+        return self._proxy_call('Shutdown', slice_urn, credentials, options);
 
 class ProxyAggregateManagerServer(AggregateManagerServer):
     "A server that provides the AM API to tools, but passes requests"
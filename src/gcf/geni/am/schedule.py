@@ -0,0 +1,219 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Reservation calendars for the resources of an aggregate, so that
+resources can be allocated for a window of time in the future
+(see README-scheduling.txt). Times are naive UTC datetimes.
+"""
+
+from __future__ import absolute_import
+
+import bisect
+
+class ReservationCalendar(object):
+    """The reservations of one resource: non overlapping, non empty
+    [start, end) time windows, each with an owner (e.g. a sliver),
+    sorted by start time.
+    Because the windows do not overlap, their end times are sorted too,
+    so checking a window takes a binary search.
+    """
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+        self._owners = []
+
+    def __len__(self):
+        return len(self._starts)
+
+    def last_end(self):
+        """The end of the last reservation, or None if there are none"""
+        if not self._ends:
+            return None
+        return self._ends[-1]
+
+    def _index(self, owner, start):
+        i = bisect.bisect_left(self._starts, start)
+        while i < len(self._starts) and self._starts[i] == start:
+            if self._owners[i] is owner:
+                return i
+            i += 1
+        raise KeyError("No reservation starting %s for %r" % (start, owner))
+
+    def is_free(self, start, end, owner=None):
+        """Is the window [start, end) free, ignoring any reservation by owner?"""
+        # The reservation starting last before end is the one
+        # ending last, so the only one that may overlap
+        j = bisect.bisect_left(self._starts, end) - 1
+        if j >= 0 and owner is not None and self._owners[j] is owner:
+            j -= 1
+        return j < 0 or self._ends[j] <= start
+
+    def in_use(self, when):
+        """Is there a reservation at the given time?"""
+        j = bisect.bisect_right(self._starts, when) - 1
+        return j >= 0 and self._ends[j] > when
+
+    def reserve(self, start, end, owner):
+        if end <= start:
+            raise ValueError("Window %s to %s is empty" % (start, end))
+        if not self.is_free(start, end):
+            raise ValueError("Window %s to %s is already reserved" % (start, end))
+        i = bisect.bisect_right(self._starts, start)
+        self._starts.insert(i, start)
+        self._ends.insert(i, end)
+        self._owners.insert(i, owner)
+
+    def release(self, owner, start):
+        i = self._index(owner, start)
+        del self._starts[i]
+        del self._ends[i]
+        del self._owners[i]
+
+    def change_end(self, owner, start, end):
+        """Change the end of the reservation of owner starting at start.
+        Return False (changing nothing) if the new window is not free."""
+        if end <= start:
+            raise ValueError("Window %s to %s is empty" % (start, end))
+        i = self._index(owner, start)
+        if not self.is_free(start, end, owner):
+            return False
+        self._ends[i] = end
+        return True
+
+
+class ResourceSchedule(object):
+    """The reservation calendars of a set of resources, by resource id.
+    Each owner (e.g. sliver) has at most one reservation.
+    Resources with reservations are also indexed by the end of their
+    last reservation, so those free from a given time on are found
+    with a binary search.
+    """
+
+    def __init__(self):
+        # resource id => ReservationCalendar
+        self._calendars = dict()
+        # resource id => resource, for resources with reservations
+        self._resources = dict()
+        # Sorted (end of last reservation, resource id) of the
+        # resources with reservations
+        self._last_ends = []
+        # owner => (resource id, start, end)
+        self._reservations = dict()
+
+    def _calendar(self, resource):
+        calendar = self._calendars.get(resource.id)
+        if calendar is None:
+            calendar = ReservationCalendar()
+            self._calendars[resource.id] = calendar
+            self._resources[resource.id] = resource
+        return calendar
+
+    def _unindex(self, rid):
+        # Take the resource out of _last_ends, before changing its calendar
+        calendar = self._calendars.get(rid)
+        if calendar is None or len(calendar) == 0:
+            return
+        i = bisect.bisect_left(self._last_ends, (calendar.last_end(), rid))
+        del self._last_ends[i]
+
+    def _index(self, rid):
+        # Put the resource back in _last_ends, after changing its
+        # calendar. Forget it if it has no reservations left.
+        calendar = self._calendars[rid]
+        if len(calendar) == 0:
+            del self._calendars[rid]
+            del self._resources[rid]
+        else:
+            bisect.insort(self._last_ends, (calendar.last_end(), rid))
+
+    def is_free(self, resource, start, end, owner=None):
+        """Is the resource free for the window [start, end)?"""
+        calendar = self._calendars.get(resource.id)
+        return calendar is None or calendar.is_free(start, end, owner)
+
+    def in_use(self, resource, when):
+        """Is the resource reserved at the given time?"""
+        calendar = self._calendars.get(resource.id)
+        return calendar is not None and calendar.in_use(when)
+
+    def reserved_resources(self):
+        """Generate the resources with reservations, by the end of their
+        last reservation: those free for a window come first, if their
+        reservations all end by its start."""
+        for (last_end, rid) in self._last_ends:
+            yield self._resources[rid]
+
+    def free_resources(self, resources, start, end, count=None):
+        """Return the given resources that are free for the window
+        [start, end), at most count of them if count is given."""
+        result = []
+        for resource in resources:
+            if count is not None and len(result) >= count:
+                break
+            if self.is_free(resource, start, end):
+                result.append(resource)
+        return result
+
+    def reserve(self, resource, start, end, owner):
+        """Reserve the resource for the window [start, end) for owner.
+        Raises ValueError if the window is empty or not free."""
+        if owner in self._reservations:
+            raise ValueError("%r already has a reservation" % owner)
+        calendar = self._calendar(resource)
+        self._unindex(resource.id)
+        try:
+            calendar.reserve(start, end, owner)
+        finally:
+            self._index(resource.id)
+        self._reservations[owner] = (resource.id, start, end)
+
+    def reservation(self, owner):
+        """Return the (resource id, start, end) reserved by owner, or None."""
+        return self._reservations.get(owner)
+
+    def release(self, owner):
+        """Release any reservation by owner."""
+        if owner not in self._reservations:
+            return
+        (rid, start, end) = self._reservations.pop(owner)
+        self._unindex(rid)
+        self._calendars[rid].release(owner, start)
+        self._index(rid)
+
+    def change_end(self, owner, end):
+        """Change the end of the reservation by owner.
+        Return False (changing nothing) if the resource is reserved by
+        someone else in the new window, True otherwise.
+        Raises ValueError if the new window is empty."""
+        if owner not in self._reservations:
+            return False
+        (rid, start, old_end) = self._reservations[owner]
+        self._unindex(rid)
+        try:
+            changed = self._calendars[rid].change_end(owner, start, end)
+        finally:
+            self._index(rid)
+        if changed:
+            self._reservations[owner] = (rid, start, end)
+        return changed
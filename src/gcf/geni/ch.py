@@ -42,7 +42,9 @@ from .util import cred_util
 from .util import cert_util
 from .util.tz_util import tzd
 from .util import urn_util
+from .util.slice_registry import SliceRegistry
 from ..sfa.trust import gid
+from ..sfa.trust.certificate import Keypair
 
 # Variable to turn on multi-threaded CH server
 # If true, spawn a different thread for each RPC
@@ -62,6 +64,11 @@ SLICE_CRED_LIFE = 3600
 # Make the max life of a slice 30 days (an arbitrary length).
 SLICE_MAX_LIFE_SECS = 30 * 24 * 60 * 60
 
+# How often to remove expired slices, in seconds.
+# Override with slice_cleanup_interval in the clearinghouse section of gcf_config
+# (0 means only remove expired slices as they are found by ListMySlices)
+SLICE_CLEANUP_SECS = 300
+
 # The list of Aggregates that this Clearinghouse knows about
 # should be defined in the gcf_config file in the am_* properties.
 # ListResources will refer the client to these aggregates
@@ -116,8 +123,12 @@ class Clearinghouse(object):
 
     def __init__(self):
         self.logger = cred_util.logging.getLogger('gcf-ch')
-        self.slices = {}
+        # Slice credentials by slice URN
+        self.slices = SliceRegistry(logger=self.logger)
         self.aggs = []
+        # Our key and cert, loaded by get_issuer
+        self.issuer_keys = None
+        self.issuer_gid = None
 
     def load_aggregates(self):
         """Loads aggregates from the clearinghouse section of the config file.
@@ -150,6 +161,19 @@ class Clearinghouse(object):
             self.logger.info("Registering AM %s at %s", urn, url)
             self.aggs.append((urn, url))
         
+    def load_slices(self):
+        """Use the slice database named by slice_db in the clearinghouse
+        section of the config file, if any, so slices survive a restart.
+        Then start removing expired slices in the background every
+        slice_cleanup_interval seconds."""
+        chconfig = self.config.get('clearinghouse', dict())
+        slice_db = chconfig.get('slice_db', '').strip()
+        if slice_db:
+            self.slices = SliceRegistry(os.path.expanduser(slice_db), self.logger)
+        interval = int(chconfig.get('slice_cleanup_interval', SLICE_CLEANUP_SECS))
+        if interval > 0:
+            self.slices.start_cleanup(interval)
+
     def runserver(self, addr, keyfile=None, certfile=None,
                   ca_certs=None, authority=None,
                   user_len=None, slice_len=None, config=None):
@@ -183,6 +207,9 @@ class Clearinghouse(object):
 
         # Load up the aggregates
         self.load_aggregates()
+
+        # Load up the slices, if we save them
+        self.load_slices()
         
         # This is the arg to _make_server
         ca_certs_onefname = cred_util.CredentialVerifier.getCAsFileFromDir(ca_certs)
@@ -201,6 +228,14 @@ class Clearinghouse(object):
         self.logger.info('GENI CH Listening on port %d...' % (addr[1]))
         self._server.serve_forever()
 
+    def get_issuer(self):
+        '''Return our (Keypair, GID) for issuing slice certs and credentials,
+        loading them from our key and cert files the first time.'''
+        if self.issuer_keys is None or self.issuer_gid is None:
+            self.issuer_gid = gid.GID(filename=os.path.expanduser(self.certfile))
+            self.issuer_keys = Keypair(filename=os.path.expanduser(self.keyfile))
+        return (self.issuer_keys, self.issuer_gid)
+
     def _make_server(self, addr, keyfile=None, certfile=None,
                      ca_certs=None):
         """Creates the XML RPC server."""
@@ -247,10 +282,12 @@ class Clearinghouse(object):
         self.logger.info("Called CreateSlice URN REQ %r" % urn_req)
         slice_gid = None
 
-        if urn_req and self.slices.has_key(urn_req):
+        slice_cred = None
+        if urn_req:
+            slice_cred = self.slices.get(urn_req)
+        if slice_cred is not None:
             # If the Slice has expired, treat this as
             # a request to renew
-            slice_cred = self.slices[urn_req]
             slice_exp = self._naiveUTC(slice_cred.expiration)
             if slice_exp <= datetime.datetime.utcnow():
                 # Need to renew this slice
@@ -298,7 +335,8 @@ class Clearinghouse(object):
             # - slice email address
             # - unique cert serial number
             try:
-                slice_gid = cert_util.create_cert(urn, self.keyfile, self.certfile, uuidarg = slice_uuid)[0]
+                (issuer_keys, issuer_gid) = self.get_issuer()
+                slice_gid = cert_util.create_cert(urn, issuer_keys, issuer_gid, uuidarg = slice_uuid)[0]
             except Exception, exc:
                 self.logger.error("Cant create slice gid for slice urn %s: %s", urn, traceback.format_exc())
                 raise Exception("Failed to create slice %s. Cant create slice gid" % urn, exc)
@@ -339,7 +377,8 @@ class Clearinghouse(object):
     
     def RenewSlice(self, slice_urn, expire_str):
         self.logger.info("Called RenewSlice(%s, %s)", slice_urn, expire_str)
-        if not self.slices.has_key(slice_urn):
+        slice_cred = self.slices.get(slice_urn)
+        if slice_cred is None:
             self.logger.warning('Slice %s was not found', slice_urn)
             return False
         try:
@@ -366,7 +405,6 @@ class Clearinghouse(object):
         else:
             user_gid = gid.GID(string=self._server.pem_cert)
 
-        slice_cred = self.slices[slice_urn]
         slice_gid = slice_cred.get_gid_object()
         # if original slice' privileges were all delegatable,
         # make all the privs here delegatable
@@ -382,8 +420,8 @@ class Clearinghouse(object):
 
     def DeleteSlice(self, urn_req):
         self.logger.info("Called DeleteSlice %r" % urn_req)
-        if self.slices.has_key(urn_req):
-            self.slices.pop(urn_req)
+        # The slice may expire at any time: check and remove in one step
+        if self.slices.pop(urn_req, None) is not None:
             self.logger.info("Deleted slice")
             return True
         self.logger.info('Slice was not found')
@@ -405,23 +443,15 @@ class Clearinghouse(object):
 
         # We could take hrn or return hrn too. Or return hrn and uuid.
         # Here we take a URN and return a URN
-        if not self.slices:
-#            self.logger.debug("Returning from lms early")
-            return ret
-
-        for slicecred in self.slices.values():
-            if slicecred.get_gid_caller().get_urn() == urn:
-                # Confirm it has not expired. If it has, remove it from the list of slices
-                slice_exp = self._naiveUTC(slicecred.expiration)
-                sliceurn = slicecred.get_gid_object().get_urn()
-#                self.logger.debug("Matching slice %s", sliceurn)
-                if slice_exp <= datetime.datetime.utcnow():
-                    self.logger.info("Removing expired slice %s", sliceurn)
-                    self.slices.pop(sliceurn)
-                    continue
-                ret.append(sliceurn)
-            else:
-                self.logger.debug("Found slice %s owned by different user %s", slicecred.get_gid_object().get_urn(), slicecred.get_gid_caller().get_urn())
+        now = datetime.datetime.utcnow()
+        for (sliceurn, slice_exp) in self.slices.owned_by(urn):
+            # Confirm it has not expired. If it has, remove it from the list of slices
+#            self.logger.debug("Matching slice %s", sliceurn)
+            if slice_exp <= now:
+                self.logger.info("Removing expired slice %s", sliceurn)
+                self.slices.pop(sliceurn, None)
+                continue
+            ret.append(sliceurn)
  
         return ret
     
@@ -434,7 +464,7 @@ class Clearinghouse(object):
         self.logger.info("Called CreateUserCredential for GID %s" % user_gid.get_hrn())
         expiration = datetime.datetime.utcnow() + datetime.timedelta(seconds=USER_CRED_LIFE)
         try:
-            ucred = cred_util.create_credential(user_gid, user_gid, expiration, 'user', self.keyfile, self.certfile, self.trusted_root_files)
+            ucred = cred_util.create_credential(user_gid, user_gid, expiration, 'user', self.keyfile, self.certfile, self.trusted_root_files, issuer_gid=self.get_issuer()[1])
         except Exception, exc:
             self.logger.error("Failed to create user credential for %s: %s", user_gid.get_hrn(), traceback.format_exc())
             raise Exception("Failed to create user credential for %s" % user_gid.get_hrn(), exc)
@@ -444,5 +474,5 @@ class Clearinghouse(object):
         '''Create a Slice credential object for this user_gid (object) on given slice gid (object)'''
         # FIXME: Validate the user_gid and slice_gid
         # are my user and slice
-        return cred_util.create_credential(user_gid, slice_gid, expiration, 'slice', self.keyfile, self.certfile, self.trusted_root_files, delegatable)
+        return cred_util.create_credential(user_gid, slice_gid, expiration, 'slice', self.keyfile, self.certfile, self.trusted_root_files, delegatable, issuer_gid=self.get_issuer()[1])
 
@@ -30,8 +30,12 @@ list of aggregates read from a config file, and create a new Slice Credential.
 
 from __future__ import absolute_import
 
+import collections
 import datetime
 import dateutil.parser
+import hashlib
+import threading
+import time
 import traceback
 import uuid as uuidModule
 import os
@@ -64,6 +68,17 @@ CODE_VERSION = "2.4"
 CH_HOSTNAME = "ch.geni.net"
 CH_PORT = "8443"
 
+# Seconds to remember that a client cert was verified against the trusted roots
+VERIFIED_GID_TTL = 600
+# Max number of verified client certs to remember
+VERIFIED_GID_CACHE_SIZE = 1000
+# Seconds to keep a user's inside key and certs
+INSIDE_KEYS_TTL = 600
+# Max number of users whose inside keys to keep
+INSIDE_KEYS_CACHE_SIZE = 100
+# Seconds to re-use the list of AMs from the service registry
+SR_AMS_TTL = 300
+
 class PGSAnCHServer(object):
     def __init__(self, delegate, logger):
         self._delegate = delegate
@@ -391,8 +406,15 @@ class PGClearinghouse(Clearinghouse):
         Clearinghouse.__init__(self)
         self.logger = cred_util.logging.getLogger('gcf-pgch')
         self.gcf=gcf
-        # Cache inside keys for users.
-        self.inside_keys = dict()
+        # Cache inside keys for users: uuid => (time fetched, (key, certs))
+        # Least recently used first
+        self.inside_keys = collections.OrderedDict()
+        # Cache verified client certs:
+        # client cert hash => (time verified, user cert chain, user gid)
+        self.verified_gids = dict()
+        # Cache list of AMs from the SR: (time fetched, list of AMs)
+        self.sr_ams = None
+        self.cache_lock = threading.Lock()
 
     def loadURLs(self):
         for (key, val) in self.config['clearinghouse'].items():
@@ -439,6 +461,9 @@ class PGClearinghouse(Clearinghouse):
 
         # Load up the aggregates
         self.load_aggregates()
+
+        # Load up the slices, if we save them
+        self.load_slices()
         
         # load up URLs for things we proxy for
         self.loadURLs()
@@ -499,10 +524,60 @@ class PGClearinghouse(Clearinghouse):
             x = x[pos+1:]
         return out
 
+    def getVerifiedUserGID(self, method):
+        """Return the client cert chain (with any MA cert) and GID of the
+        caller, after checking the GID is trusted by our roots.
+        Re-uses a recent verification of the same client cert."""
+        if THREADED:
+            client_certstr=SecureThreadedXMLRPCRequestHandler.get_pem_cert()
+        else:
+            client_certstr = self._server.pem_cert
+
+        certhash = hashlib.sha1(client_certstr).hexdigest()
+        now = time.time()
+        with self.cache_lock:
+            if self.verified_gids.has_key(certhash):
+                (verified, user_certstr, user_gid) = self.verified_gids[certhash]
+                if now - verified < VERIFIED_GID_TTL:
+                    return user_certstr, user_gid
+                del self.verified_gids[certhash]
+
+        # Construct cert, pulling in the intermediate signer cert if any (SSL doesn't give us the chain)
+        user_certstr = addMACert(client_certstr, self.logger, self.macert)
+
+        # Construct the GID
+        try:
+            user_gid = gid.GID(string=user_certstr)
+        except Exception, exc:
+            self.logger.error("%s failed to create user_gid from SSL client cert: %s", method, traceback.format_exc())
+            raise Exception("Failed to %s. Cant get user GID from SSL client certificate: %s" % (method, exc))
+
+        # Validate the GID is trusted by our roots
+        try:
+            user_gid.verify_chain(self.trusted_roots)
+        except Exception, exc:
+            self.logger.error("%s got unverifiable experimenter cert: %s", method, exc)
+            raise
+
+        with self.cache_lock:
+            if len(self.verified_gids) >= VERIFIED_GID_CACHE_SIZE:
+                for (key, entry) in self.verified_gids.items():
+                    if now - entry[0] >= VERIFIED_GID_TTL:
+                        del self.verified_gids[key]
+                if len(self.verified_gids) >= VERIFIED_GID_CACHE_SIZE:
+                    self.verified_gids.clear()
+            self.verified_gids[certhash] = (now, user_certstr, user_gid)
+        return user_certstr, user_gid
+
     def getInsideKeys(self, uuid):
-        if self.inside_keys.has_key(uuid):
-            self.logger.info("Already had keys for %r", uuid);
-            return self.inside_keys[uuid]
+        with self.cache_lock:
+            if self.inside_keys.has_key(uuid):
+                (fetched, result) = self.inside_keys.pop(uuid)
+                if time.time() - fetched < INSIDE_KEYS_TTL:
+                    self.logger.info("Already had keys for %r", uuid);
+                    # Mark it most recently used
+                    self.inside_keys[uuid] = (fetched, result)
+                    return result
         # Fetch the inside keys...
         self.logger.info("get inside keys for %r", uuid);
         argsdict = dict(member_id=uuid)
@@ -527,8 +602,12 @@ class PGClearinghouse(Clearinghouse):
         inside_key = keysdict['private_key']
         inside_certs = self.split_chain(keysdict['certificate'])
         result = (inside_key, inside_certs)
-        # Put it in the cache
-        self.inside_keys[uuid] = result
+        # Put it in the cache, dropping the least recently used if full
+        with self.cache_lock:
+            self.inside_keys.pop(uuid, None)
+            while len(self.inside_keys) >= INSIDE_KEYS_CACHE_SIZE:
+                self.inside_keys.popitem(last=False)
+            self.inside_keys[uuid] = (time.time(), result)
         return result
 
     def GetCredential(self, args=None):
@@ -547,33 +626,7 @@ class PGClearinghouse(Clearinghouse):
             uuid = args['uuid']
         self.logger.debug("In getCred")
         
-        if THREADED:
-            client_certstr=SecureThreadedXMLRPCRequestHandler.get_pem_cert()
-        else:
-            client_certstr = self._server.pem_cert
-
-        # Construct cert, pulling in the intermediate signer cert if any (SSL doesn't give us the chain)
-        user_certstr = addMACert(client_certstr, self.logger, self.macert)
-
-        # Construct the GID
-        try:
-            user_gid = gid.GID(string=user_certstr)
-            # FIXME: Next 3 lines for debugging only
-            #username = user_gid.get_hrn().split('.')[-1]
-            #if args and args.has_key('cert') and not username in args['cert']:
-                #self.logger.error("GetCred got arg of user cert %s, server.pem_cert for user %s" % (args['cert'], user_gid.get_hrn()))
-        except Exception, exc:
-            self.logger.error("GetCredential failed to create user_gid from SSL client cert: %s", traceback.format_exc())
-            raise Exception("Failed to GetCredential. Cant get user GID from SSL client certificate." % exc)
-
-        self.logger.debug("Constructed user_gid")
-
-        # Validate the GID is trusted by our roots
-        try:
-            user_gid.verify_chain(self.trusted_roots)
-        except Exception, exc:
-            self.logger.error("GetCredential got unverifiable experimenter cert: %s", exc)
-            raise
+        user_certstr, user_gid = self.getVerifiedUserGID('GetCredential')
 
         if not user_gid:
             raise Exception("user_gid is None")
@@ -707,27 +760,7 @@ class PGClearinghouse(Clearinghouse):
         # type is Slice or User
         # Return is dict: (see above)
 
-        if THREADED:
-            client_certstr=SecureThreadedXMLRPCRequestHandler.get_pem_cert()
-        else:
-            client_certstr = self._server.pem_cert
-
-        # Get full user cert chain (append MA if any)
-        user_certstr = addMACert(client_certstr, self.logger, self.macert)
-
-        # Construct GID
-        try:
-            user_gid = gid.GID(string=user_certstr)
-        except Exception, exc:
-            self.logger.error("GetCredential failed to create user_gid from SSL client cert: %s", traceback.format_exc())
-            raise Exception("Failed to GetCredential. Cant get user GID from SSL client certificate." % exc)
-
-        # Validate GID
-        try:
-            user_gid.verify_chain(self.trusted_roots)
-        except Exception, exc:
-            self.logger.error("GetCredential got unverifiable experimenter cert: %s", exc)
-            raise
+        user_certstr, user_gid = self.getVerifiedUserGID('Resolve')
 
         credential = None
         if args and args.has_key('credential'):
@@ -788,8 +821,9 @@ class PGClearinghouse(Clearinghouse):
             if self.gcf:
                 # FIXME: Handle uuid input
                 # For type slice, error means no known slice. Else the slice exists.
-                if self.slices.has_key(urn):
-                    slice_cred = self.slices[urn]
+                # The slice may be deleted or expire at any time: look it up once
+                slice_cred = self.slices.get(urn)
+                if slice_cred is not None:
                     slice_cert = slice_cred.get_gid_object()
                     slice_uuid = ""
                     try:
@@ -979,24 +1013,7 @@ class PGClearinghouse(Clearinghouse):
         # cred is user cred, type must be Slice
         # returns slice cred
 
-        if THREADED:
-            client_certstr=SecureThreadedXMLRPCRequestHandler.get_pem_cert()
-        else:
-            client_certstr = self._server.pem_cert
-
-        user_certstr = addMACert(client_certstr, self.logger, self.macert)
-
-        try:
-            user_gid = gid.GID(string=user_certstr)
-        except Exception, exc:
-            self.logger.error("GetCredential failed to create user_gid from SSL client cert: %s", traceback.format_exc())
-            raise Exception("Failed to GetCredential. Cant get user GID from SSL client certificate." % exc)
-
-        try:
-            user_gid.verify_chain(self.trusted_roots)
-        except Exception, exc:
-            self.logger.error("GetCredential got unverifiable experimenter cert: %s", exc)
-            raise
+        user_certstr, user_gid = self.getVerifiedUserGID('Register')
 
         credential = None
         if args and args.has_key('credential'):
@@ -1145,23 +1162,7 @@ class PGClearinghouse(Clearinghouse):
         # cred is user cred
         # returns renewed slice credential
 
-        if THREADED:
-            client_certstr=SecureThreadedXMLRPCRequestHandler.get_pem_cert()
-        else:
-            client_certstr = self._server.pem_cert
-
-        user_certstr = addMACert(client_certstr, self.logger, self.macert)
-        try:
-            user_gid = gid.GID(string=user_certstr)
-        except Exception, exc:
-            self.logger.error("RenewSlice failed to create user_gid from SSL client cert: %s", traceback.format_exc())
-            raise Exception("Failed to RenewSlice. Cant get user GID from SSL client certificate." % exc)
-
-        try:
-            user_gid.verify_chain(self.trusted_roots)
-        except Exception, exc:
-            self.logger.error("RenewSlice got unverifiable experimenter cert: %s", exc)
-            raise
+        user_certstr, user_gid = self.getVerifiedUserGID('RenewSlice')
 
         expiration = None
         if args and args.has_key('expiration'):
@@ -1253,24 +1254,7 @@ class PGClearinghouse(Clearinghouse):
         # cred is user cred
         # return list( of dict(type='ssh', key=$key))
 
-        if THREADED:
-            client_certstr=SecureThreadedXMLRPCRequestHandler.get_pem_cert()
-        else:
-            client_certstr = self._server.pem_cert
-
-        user_certstr = addMACert(client_certstr, self.logger, self.macert)
-
-        try:
-            user_gid = gid.GID(string=user_certstr)
-        except Exception, exc:
-            self.logger.error("GetCredential failed to create user_gid from SSL client cert: %s", traceback.format_exc())
-            raise Exception("Failed to GetCredential. Cant get user GID from SSL client certificate." % exc)
-
-        try:
-            user_gid.verify_chain(self.trusted_roots)
-        except Exception, exc:
-            self.logger.error("GetCredential got unverifiable experimenter cert: %s", exc)
-            raise
+        user_certstr, user_gid = self.getVerifiedUserGID('GetKeys')
 
         if credential is None:
             raise Exception("Resolve missing credential")
@@ -1366,24 +1350,7 @@ class PGClearinghouse(Clearinghouse):
         # return list( of dict(gid=<cert>, hrn=<hrn>, url=<AM URL>))
         # Matt seems to say hrn is not critical, and can maybe even skip cert
 
-        if THREADED:
-            client_certstr=SecureThreadedXMLRPCRequestHandler.get_pem_cert()
-        else:
-            client_certstr = self._server.pem_cert
-
-        user_certstr = addMACert(client_certstr, self.logger, self.macert)
-
-        try:
-            user_gid = gid.GID(string=user_certstr)
-        except Exception, exc:
-            self.logger.error("GetCredential failed to create user_gid from SSL client cert: %s", traceback.format_exc())
-            raise Exception("Failed to GetCredential. Cant get user GID from SSL client certificate." % exc)
-
-        try:
-            user_gid.verify_chain(self.trusted_roots)
-        except Exception, exc:
-            self.logger.error("GetCredential got unverifiable experimenter cert: %s", exc)
-            raise
+        user_certstr, user_gid = self.getVerifiedUserGID('ListComponents')
 
         if credential is None:
             raise Exception("Resolve missing credential")
@@ -1405,6 +1372,10 @@ class PGClearinghouse(Clearinghouse):
                 ret.append(dict(gid='amcert', hrn=hrn, url=url, urn=urn))
             return ret
         else:
+            with self.cache_lock:
+                if self.sr_ams is not None and time.time() - self.sr_ams[0] < SR_AMS_TTL:
+                    self.logger.info("ListComponents returning %d cached entries", len(self.sr_ams[1]))
+                    return list(self.sr_ams[1])
             argsdict = dict(service_type=0)
             amstriple = None
             try:
@@ -1472,6 +1443,8 @@ class PGClearinghouse(Clearinghouse):
                     else:
                         # Invalid cert or SR entry. Suppress these for now
                         self.logger.error("AM with URL %s - invalid hrn (%s) or urn (%s) or gid or url", url, hrn, urn)
+            with self.cache_lock:
+                self.sr_ams = (time.time(), list(ret))
             self.logger.info("ListComponents returning %d entries", len(ret))
             return ret
 
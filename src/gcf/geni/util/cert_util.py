@@ -26,6 +26,7 @@ Certificate (GID in SFA terms) creation and verification utilities.
 
 from __future__ import absolute_import
 
+import multiprocessing
 import uuid
 
 from .urn_util import URN
@@ -33,7 +34,8 @@ from ...sfa.trust.gid import GID
 from ...sfa.trust.certificate import Keypair
 
 def create_cert(urn, issuer_key=None, issuer_cert=None, ca=False,
-                public_key=None, lifeDays=1825, email=None, uuidarg=None):
+                public_key=None, lifeDays=1825, email=None, uuidarg=None,
+                keys=None):
     '''Create a new certificate and return it and the associated keys.
     If issuer cert and key are given, they sign the certificate. Otherwise
     it is a self-signed certificate. 
@@ -44,6 +46,9 @@ def create_cert(urn, issuer_key=None, issuer_cert=None, ca=False,
 
     Certificate URN must be supplied.
     CN of the cert will be dotted notation authority.type.name from the URN.
+
+    If keys (a Keypair) is given, certify that key pair instead of
+    creating a new one (see create_keypairs).
     '''
     # Note the below throws a ValueError if it wasnt a valid URN
     c_urn = URN(urn=urn)
@@ -86,13 +91,14 @@ def create_cert(urn, issuer_key=None, issuer_cert=None, ca=False,
     if email:
         newgid.set_email(email)
     
-    if public_key is None:
-        # create a new key pair
-        keys = Keypair(create=True)
-    else:
-        # use the specified public key file
-        keys = Keypair()
-        keys.load_pubkey_from_file(public_key)
+    if keys is None:
+        if public_key is None:
+            # create a new key pair
+            keys = Keypair(create=True)
+        else:
+            # use the specified public key file
+            keys = Keypair()
+            keys.load_pubkey_from_file(public_key)
     newgid.set_pubkey(keys)
     newgid.set_is_ca(ca)
 
@@ -111,3 +117,47 @@ def create_cert(urn, issuer_key=None, issuer_cert=None, ca=False,
     newgid.encode()
     newgid.sign()
     return newgid, keys
+
+def _create_keypair_pem(i):
+    '''Create a new key pair and return it as PEM. Run in a worker process.'''
+    return Keypair(create=True).as_pem()
+
+def create_keypairs(count, processes=None):
+    '''Create count new key pairs and return them as a list of Keypairs.
+    Key generation is the slow part of creating a certificate, so the keys
+    are generated in a pool of processes (by default one per CPU).'''
+    if count < 1:
+        return []
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, count)
+    if processes <= 1:
+        return [Keypair(create=True) for i in range(count)]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        pems = pool.map(_create_keypair_pem, range(count))
+    finally:
+        pool.close()
+        pool.join()
+    return [Keypair(string=pem) for pem in pems]
+
+def create_certs(urns, issuer_key=None, issuer_cert=None, ca=False,
+                 lifeDays=1825, processes=None):
+    '''Create a new certificate and key pair for each of the given URNs,
+    all issued by the same issuer (or each self-signed if no issuer is given).
+    Return a list of (GID, Keypair) in the order of urns.
+
+    Like create_cert, but the issuer key and cert are only loaded once,
+    and the key pairs are generated in a pool of processes (see create_keypairs).
+    '''
+    if issuer_key and issuer_cert:
+        if isinstance(issuer_key,str):
+            issuer_key = Keypair(filename=issuer_key)
+        if isinstance(issuer_cert,str):
+            issuer_cert = GID(filename=issuer_cert)
+
+    keys = create_keypairs(len(urns), processes)
+    return [create_cert(urn, issuer_key, issuer_cert, ca=ca, lifeDays=lifeDays,
+                        keys=urn_keys)
+            for (urn, urn_keys) in zip(urns, keys)]
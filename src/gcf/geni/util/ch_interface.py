@@ -27,11 +27,17 @@
 # if code = 0, value is the result
 # if code is not 0, the output is additional info on the error
 
+import base64
+import errno
+import httplib
 import json
 import os
+import socket
 import tempfile
+import threading
 import traceback
-import urllib2
+import urllib
+import urlparse
 import M2Crypto
 
 # TODO: 
@@ -57,28 +63,32 @@ import M2Crypto
 
 # FIXME: The CH APIs have, I believe, evolved since this was written. Must update!
 
+# Helper function to get the member UUID from the subjectAltName
+# of the given SSL peer cert (from getpeercert). None if there is none.
+def get_member_id(peercert):
+    uuid = None
+    for (key, value) in peercert.get('subjectAltName', ()):
+        if(key == 'URI' and 'uuid' in value):
+            uuid_parts = value.split(':');
+            uuid = uuid_parts[2];
+    return uuid
+
 # Helper function to get the insert cert/key for a given connection
 # Based on the SSL cert on the given connection
+# Returns a dict with the names of temp files holding the 'key' and 'cert',
+# which the caller must delete. Empty if the lookup failed.
 def get_inside_cert_and_key(peercert, ma_url, logger):
 
 #   print(str(peercert))
-    san = peercert.get('subjectAltName');
-    uri = None
-    uuid = None
-    for e in san:
-        key = e[0];
-        value = e[1];
-        if(key == 'URI' and "IDN+" in value):
-            uri = value;
-        if(key == 'URI' and 'uuid' in value):
-            uuid_parts = value.split(':');
-            uuid = uuid_parts[2];
-#           print "URI = " + str(uri) +  " UUID = " + str(uuid)
-            args = dict(member_id = uuid)
-            row = invokeCH(ma_url, 'lookup_keys_and_certs', logger, args)
+    result = dict();
+    uuid = get_member_id(peercert)
+    if uuid is None:
+        logger.error("No member UUID in client certificate")
+        return result
+    args = dict(member_id = uuid)
+    row = invokeCH(ma_url, 'lookup_keys_and_certs', logger, args)
         
 #    logger.info("ROW = " + str(row))
-    result = dict();
     if(row['code'] == 0):
         row_raw = row['value'];
         private_key = row_raw['private_key']
@@ -152,10 +162,9 @@ def decodeCHResponse(msg, logger):
     result = json.loads(json_data, encoding='ascii', object_hook=_decode_dict)
     return result
 
-def sign_message(key, certs, msg):
-    """Signs 'msg' and returns the multipart S/MIME signed message.
-    More info can be found in the "howto.smime.html" file in the
-    M2Crypto source.
+def make_signer(key, certs):
+    """Return an M2Crypto SMIME object loaded with the given key and
+    cert chain (PEM strings), ready to sign messages.
     """
     # Create an SMIME signer
     smime = M2Crypto.SMIME.SMIME()
@@ -170,6 +179,17 @@ def sign_message(key, certs, msg):
             sk.push(M2Crypto.X509.load_cert_bio(M2Crypto.BIO.MemoryBuffer(c)))
         # Add the chain certs to the smime signer
         smime.set_x509_stack(sk)
+    return smime
+
+def sign_message(key, certs, msg, smime=None):
+    """Signs 'msg' and returns the multipart S/MIME signed message.
+    Uses the given signer from make_signer if supplied, else loads
+    the given key and certs.
+    More info can be found in the "howto.smime.html" file in the
+    M2Crypto source.
+    """
+    if smime is None:
+        smime = make_signer(key, certs)
     # Load the msg into a BIO
     msg_bio = M2Crypto.BIO.MemoryBuffer(msg)
     # get the signature
@@ -184,60 +204,216 @@ def sign_message(key, certs, msg):
     signed_message = tmp_bio.read()
     return signed_message
 
+# Errors from reading a response meaning the server sent nothing back:
+# it closed the kept-alive connection before reading the request
+_NOTHING_RECEIVED_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+def _nothing_received(e):
+    if isinstance(e, httplib.BadStatusLine):
+        return not e.line or e.line.startswith("No status line received")
+    if isinstance(e, socket.error):
+        return e.errno in _NOTHING_RECEIVED_ERRNOS
+    return False
+
+class CHClient(object):
+    """Client for the JSON over HTTP(S) PUT clearinghouse services.
+    Keeps the parsed key and certs of each signer, and a small pool of
+    idle keep-alive connections per service host, for re-use across calls.
+    Honors the http_proxy / https_proxy / no_proxy environment variables,
+    as urllib2 does.
+    Use invokeCH to make calls using a shared CHClient.
+    """
+
+    # Max number of signers to keep
+    MAX_SIGNERS = 100
+
+    # Max number of idle connections to keep per service host
+    MAX_IDLE_PER_HOST = 4
+
+    # Seconds to wait on connecting to or reading from a service
+    DEFAULT_TIMEOUT = 300
+
+    # Redirects to follow, sending the PUT again to the new location
+    REDIRECT_STATUSES = (301, 302, 307, 308)
+    MAX_REDIRECTS = 5
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        # (key, certs) => [lock, SMIME signer]
+        self._signers = dict()
+        # (scheme, host:port, proxy) => list of idle connections
+        self._idle = dict()
+        self._lock = threading.Lock()
+
+    def _get_signer(self, key, certs):
+        signerkey = (key, tuple(certs))
+        with self._lock:
+            entry = self._signers.get(signerkey)
+            if entry is None:
+                if len(self._signers) >= self.MAX_SIGNERS:
+                    self._signers.clear()
+                entry = [threading.Lock(), make_signer(key, certs)]
+                self._signers[signerkey] = entry
+        return entry
+
+    def sign(self, key, certs, msg):
+        """Sign msg as sign_message does, re-using the parsed key and certs."""
+        (lock, smime) = self._get_signer(key, certs)
+        # SMIME objects are not thread safe
+        with lock:
+            return sign_message(key, certs, msg, smime)
+
+    def _get_proxy(self, scheme, host):
+        """Return the proxy URL to use for the given URL scheme and host
+        from the environment, or None to connect directly."""
+        proxy = urllib.getproxies().get(scheme)
+        if not proxy or urllib.proxy_bypass(host):
+            return None
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        return proxy
+
+    def _new_connection(self, scheme, netloc, proxy):
+        if proxy is None:
+            if scheme == 'https':
+                return httplib.HTTPSConnection(netloc, timeout=self.timeout)
+            return httplib.HTTPConnection(netloc, timeout=self.timeout)
+        parsed = urlparse.urlsplit(proxy)
+        proxy_headers = dict()
+        if parsed.username is not None:
+            userpass = '%s:%s' % (urllib.unquote(parsed.username),
+                                  urllib.unquote(parsed.password or ''))
+            proxy_headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(userpass)
+        if scheme == 'https':
+            # Tunnel through the proxy with CONNECT
+            conn = httplib.HTTPSConnection(parsed.hostname, parsed.port, timeout=self.timeout)
+            conn.set_tunnel(netloc, headers=proxy_headers)
+        else:
+            conn = httplib.HTTPConnection(parsed.hostname, parsed.port, timeout=self.timeout)
+        conn.proxy_headers = proxy_headers
+        return conn
+
+    def _checkout(self, poolkey):
+        # Return an idle connection for poolkey, or None
+        with self._lock:
+            idle = self._idle.get(poolkey)
+            if idle:
+                return idle.pop()
+        return None
+
+    def _checkin(self, poolkey, conn):
+        # Keep conn for re-use if there is room, else close it
+        with self._lock:
+            idle = self._idle.setdefault(poolkey, [])
+            if len(idle) < self.MAX_IDLE_PER_HOST:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def put(self, url, body, redirects=MAX_REDIRECTS):
+        """HTTP PUT body as JSON to url, re-using an idle kept-alive
+        connection to that host if there is one. Follows up to
+        redirects redirects to another location.
+        Return the response body. Raises an exception on error."""
+        parsed = urlparse.urlsplit(url)
+        if parsed.scheme not in ('http', 'https'):
+            raise Exception("unsupported URL scheme: %s" % url)
+        proxy = self._get_proxy(parsed.scheme, parsed.hostname)
+        if proxy is not None and parsed.scheme == 'http':
+            # Plain HTTP proxies take the full URL
+            path = url
+        else:
+            path = parsed.path or '/'
+            if parsed.query:
+                path += '?' + parsed.query
+        poolkey = (parsed.scheme, parsed.netloc, proxy)
+        headers = {'Content-Type': 'application/json'}
+
+        conn = self._checkout(poolkey)
+        while True:
+            reused = conn is not None
+            if conn is None:
+                conn = self._new_connection(parsed.scheme, parsed.netloc, proxy)
+            if proxy is not None and parsed.scheme == 'http':
+                headers.update(conn.proxy_headers)
+            sent = False
+            try:
+                conn.request('PUT', path, body, headers)
+                sent = True
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                # A kept-alive connection the server has since closed fails
+                # on send, or gets no response at all. Only then is it safe
+                # to send the request again, on a fresh connection.
+                if reused and (not sent or _nothing_received(e)):
+                    conn = None
+                    continue
+                raise
+            try:
+                data = response.read()
+            except:
+                conn.close()
+                raise
+            break
+        if response.will_close:
+            conn.close()
+        else:
+            self._checkin(poolkey, conn)
+        if response.status in self.REDIRECT_STATUSES and response.getheader('Location'):
+            if redirects <= 0:
+                raise Exception("HTTP Error %d: too many redirects from %s" % (response.status, url))
+            return self.put(urlparse.urljoin(url, response.getheader('Location')), body,
+                            redirects - 1)
+        if response.status >= 300:
+            raise Exception("HTTP Error %d: %s" % (response.status, response.reason))
+        return data
+
+    def invoke(self, url, operation, logger, argsdict, mycerts=None, mykey=None):
+        """Invoke the given operation with the given arguments at the CH
+        service at url, signing the request with mykey and mycerts if given.
+        Return the decoded result (dict of code, value, output)."""
+        if not operation or operation.strip() == '':
+            raise Exception("missing operation")
+        if not url or url.strip() == '':
+            raise Exception("missing url")
+        if not argsdict:
+            raise Exception("missing argsdict")
+
+        # Put operation in front of argsdict
+        toencode = dict(operation=operation)
+        for (k,v) in argsdict.items():
+            toencode[k]=v
+        argstr = json.dumps(toencode)
+        if (mycerts and mykey):
+            argstr = self.sign(mykey, mycerts, argstr)
+        logger.debug("Will do put of %s", argstr)
+
+        try:
+            putres = self.put(url, argstr)
+        except Exception, e:
+            logger.error("invokeCH failed to open conn to %s: %s", url, e)
+            raise Exception("invokeCH failed to open conn to %s: %s" % (url, e))
+
+        resdict = None
+        if putres:
+            logger.debug("invokeCH Got result of %s" % putres)
+            resdict = decodeCHResponse(putres, logger)
+
+        # FIXME: Check for code, value, output keys?
+        return resdict
+
+# CHClient shared by calls to invokeCH
+_ch_client = CHClient()
+
 def invokeCH(url, operation, logger, argsdict, mycerts=None, mykey=None):
     # Invoke the real CH
     # for now, this should json encode the args and operation, do an http put
     # entry 1 in dict is named operation and is the operation, rest are args
     # json decode result, getting a dict
     # return the result
-    if not operation or operation.strip() == '':
-        raise Exception("missing operation")
-    if not url or url.strip() == '':
-        raise Exception("missing url")
-    if not argsdict:
-        raise Exception("missing argsdict")
-
-    # Put operation in front of argsdict
-    toencode = dict(operation=operation)
-    for (k,v) in argsdict.items():
-        toencode[k]=v
-    argstr = json.dumps(toencode)
-    if (mycerts and mykey):
-        argstr = sign_message(mykey, mycerts, argstr)
-    logger.debug("Will do put of %s", argstr)
-#    print ("Doing  put of %s" % argstr)
-
-    # now http put this, grab result into putres
-    # This is the most trivial put client. This appears to be harder to do / less common than you would expect.
-    # See httplib2 for an alternative approach using another library.
-    # This approach isn't very robust, may have other issues
-    opener = urllib2.build_opener(urllib2.HTTPSHandler)
-    req = urllib2.Request(url, data=argstr)
-    req.add_header('Content-Type', 'application/json')
-    req.get_method = lambda: 'PUT'
-
-    putres = None
-    putresHandle = None
-    try:
-        putresHandle = opener.open(req)
-    except Exception, e:
-        logger.error("invokeCH failed to open conn to %s: %s", url, e)
-        raise Exception("invokeCH failed to open conn to %s: %s" % (url, e))
-
-    if putresHandle:
-        try:
-            putres=putresHandle.read()
-        except Exception, e:
-            logger.error("invokeCH failed to read result of put to %s: %s", url, e)
-            raise Exception("invokeCH failed to read result of put to %s: %s" % (url, e))
-
-    resdict = None
-    if putres:
-        logger.debug("invokeCH Got result of %s" % putres)
-        resdict = decodeCHResponse(putres, logger)
-    
-    # FIXME: Check for code, value, output keys?
-    return resdict
+    # The shared client re-uses signers and connections across calls
+    return _ch_client.invoke(url, operation, logger, argsdict, mycerts, mykey)
 
 def getValueFromTriple(triple, logger, opname, unwrap=False):
     if not triple:
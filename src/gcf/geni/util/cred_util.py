@@ -40,6 +40,7 @@ from ...sfa.util.xrn import hrn_authfor_hrn
 from ...sfa.trust.credential_factory import CredentialFactory
 from ...sfa.trust.abac_credential import ABACCredential
 from ...sfa.trust.certificate import Certificate
+from ...omnilib.util.parallel import parallel_map
 
 from .speaksfor_util import determine_speaks_for
 
@@ -318,11 +319,12 @@ class CredentialVerifier(object):
 #            raise xmlrpclib.Fault(fault_code, fault_string)
             raise Exception(fault_string)
 
-def create_credential(caller_gid, object_gid, expiration, typename, issuer_keyfile, issuer_certfile, trusted_roots, delegatable=False):
+def create_credential(caller_gid, object_gid, expiration, typename, issuer_keyfile, issuer_certfile, trusted_roots, delegatable=False, issuer_gid=None):
     '''Create and Return a Credential object issued by given key/cert for the given caller
     and object GID objects, given life in seconds, and given type.
     Privileges are determined by type per sfa/trust/rights.py
-    Privileges are delegatable if requested.'''
+    Privileges are delegatable if requested.
+    issuer_gid is the GID in issuer_certfile, if the caller has already loaded it.'''
     # FIXME: Validate args: my gids, >0 life,
     # type of cred one I can issue
     # and readable key and cert files
@@ -352,7 +354,8 @@ def create_credential(caller_gid, object_gid, expiration, typename, issuer_keyfi
     if not os.path.isfile(issuer_certfile):
         raise ValueError("Cant read issuer cert file %s" % issuer_certfile)
 
-    issuer_gid = gid.GID(filename=issuer_certfile)
+    if issuer_gid is None:
+        issuer_gid = gid.GID(filename=issuer_certfile)
     
     if not (object_gid.get_urn() == issuer_gid.get_urn() or 
         (issuer_gid.get_type().find('authority') == 0 and
@@ -392,4 +395,19 @@ def create_credential(caller_gid, object_gid, expiration, typename, issuer_keyfi
 
     return ucred
 
-
+def create_credentials(gid_pairs, expiration, typename, issuer_keyfile, issuer_certfile, trusted_roots, delegatable=False, threads=1):
+    '''Create a Credential for each (caller GID, object GID) pair in gid_pairs,
+    all issued by the given key/cert with the given expiration, type and delegatability
+    as in create_credential. Return the Credentials in the order of gid_pairs.
+    The issuer cert is loaded once. Signing and verifying each credential runs xmlsec1,
+    so several threads can usefully create credentials at once.'''
+    issuer_gid = None
+    if issuer_certfile is not None and os.path.isfile(issuer_certfile):
+        issuer_gid = gid.GID(filename=issuer_certfile)
+
+    def createCredential(pair):
+        (caller_gid, object_gid) = pair
+        return create_credential(caller_gid, object_gid, expiration, typename,
+                                 issuer_keyfile, issuer_certfile, trusted_roots,
+                                 delegatable, issuer_gid=issuer_gid)
+    return parallel_map(createCredential, gid_pairs, threads)
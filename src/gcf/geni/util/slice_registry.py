@@ -0,0 +1,226 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''
+Registry of the slice credentials issued by the reference clearinghouse,
+indexed by slice URN, owner URN and expiration, optionally saved in
+an SQLite database so that slices survive a restart.
+'''
+
+from __future__ import absolute_import
+
+import calendar
+import datetime
+import heapq
+import logging
+import threading
+
+try:
+    import sqlite3
+except ImportError:
+    # Python built without SQLite: only in memory registries
+    sqlite3 = None
+
+from ...sfa.trust import credential as cred
+from .cred_util import naiveUTC
+
+def _to_secs(dt):
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1e6
+
+def _from_secs(secs):
+    return datetime.datetime.utcfromtimestamp(secs)
+
+class SliceRegistry(object):
+    '''Slice credentials by slice URN, like a dictionary, plus an
+    index of slices by owner (the credential caller) and a heap of
+    slice expirations, so that listing a user's slices and removing
+    expired slices do not look at every slice.
+
+    If a filename is given, slices are also saved in that SQLite
+    database, and loaded from it at startup. Credentials are only
+    parsed from the database when first asked for.
+
+    Safe to use from several threads.'''
+
+    def __init__(self, filename=None, logger=None):
+        self.logger = logger or logging.getLogger('gcf-ch')
+        self.filename = filename
+        self._lock = threading.RLock()
+        # slice URN => Credential, or None if not yet read from the database
+        self._creds = dict()
+        # slice URN => owner URN
+        self._owners = dict()
+        # owner URN => set of slice URNs
+        self._by_owner = dict()
+        # slice URN => naive UTC expiration
+        self._expirations = dict()
+        # (expiration, slice URN), including old entries for slices since renewed or deleted
+        self._expiry_heap = []
+        self._db = None
+        self._cleaner = None
+        if filename:
+            self._open_db(filename)
+
+    def _open_db(self, filename):
+        if sqlite3 is None:
+            raise Exception("Cannot save slices in %s: Python has no SQLite support" % filename)
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS slices '
+                         '(urn TEXT PRIMARY KEY, owner_urn TEXT, expiration REAL, credential TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS slices_owner ON slices (owner_urn)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS slices_expiration ON slices (expiration)')
+        self._db.commit()
+        for (urn, owner, expiration) in self._db.execute('SELECT urn, owner_urn, expiration FROM slices'):
+            self._add(str(urn), None, str(owner), _from_secs(expiration))
+        self.logger.info("Loaded %d slices from %s", len(self._creds), filename)
+
+    def _add(self, urn, slice_cred, owner, expiration):
+        self._remove(urn)
+        self._creds[urn] = slice_cred
+        self._owners[urn] = owner
+        self._by_owner.setdefault(owner, set()).add(urn)
+        self._expirations[urn] = expiration
+        heapq.heappush(self._expiry_heap, (expiration, urn))
+
+    def _remove(self, urn):
+        if urn not in self._creds:
+            return
+        del self._creds[urn]
+        del self._expirations[urn]
+        owner = self._owners.pop(urn)
+        owned = self._by_owner[owner]
+        owned.discard(urn)
+        if not owned:
+            del self._by_owner[owner]
+
+    def _load(self, urn):
+        # Get the credential for this slice, parsing it from the database if needed
+        slice_cred = self._creds[urn]
+        if slice_cred is None and self._db is not None:
+            row = self._db.execute('SELECT credential FROM slices WHERE urn = ?', (urn,)).fetchone()
+            slice_cred = cred.Credential(string=str(row[0]))
+            self._creds[urn] = slice_cred
+        return slice_cred
+
+    def __setitem__(self, urn, slice_cred):
+        owner = slice_cred.get_gid_caller().get_urn()
+        expiration = naiveUTC(slice_cred.expiration)
+        with self._lock:
+            self._add(urn, slice_cred, owner, expiration)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO slices VALUES (?, ?, ?, ?)',
+                                 (urn, owner, _to_secs(expiration), slice_cred.save_to_string()))
+                self._db.commit()
+
+    def __getitem__(self, urn):
+        with self._lock:
+            return self._load(urn)
+
+    def get(self, urn, default=None):
+        with self._lock:
+            if urn not in self._creds:
+                return default
+            return self._load(urn)
+
+    def pop(self, urn, *default):
+        with self._lock:
+            if urn not in self._creds:
+                if default:
+                    return default[0]
+                raise KeyError(urn)
+            slice_cred = self._load(urn)
+            self._remove(urn)
+            if self._db is not None:
+                self._db.execute('DELETE FROM slices WHERE urn = ?', (urn,))
+                self._db.commit()
+            return slice_cred
+
+    def __delitem__(self, urn):
+        self.pop(urn)
+
+    def __contains__(self, urn):
+        return urn in self._creds
+
+    def has_key(self, urn):
+        return urn in self._creds
+
+    def __len__(self):
+        return len(self._creds)
+
+    def keys(self):
+        with self._lock:
+            return self._creds.keys()
+
+    def values(self):
+        with self._lock:
+            return [self._load(urn) for urn in self._creds.keys()]
+
+    def owned_by(self, owner_urn):
+        '''Return a list of (slice URN, naive UTC expiration) of the slices owned by the given user URN'''
+        with self._lock:
+            return [(urn, self._expirations[urn]) for urn in self._by_owner.get(owner_urn, ())]
+
+    def expiration(self, urn):
+        '''Return the naive UTC expiration of the given slice'''
+        with self._lock:
+            return self._expirations[urn]
+
+    def remove_expired(self, now=None):
+        '''Remove the slices that expired by now (default utcnow). Return their URNs.'''
+        if now is None:
+            now = datetime.datetime.utcnow()
+        removed = []
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                (expiration, urn) = heapq.heappop(self._expiry_heap)
+                # Skip entries for slices since renewed or deleted
+                if self._expirations.get(urn) == expiration:
+                    self._remove(urn)
+                    removed.append(urn)
+            if removed and self._db is not None:
+                self._db.executemany('DELETE FROM slices WHERE urn = ?', [(urn,) for urn in removed])
+                self._db.commit()
+        return removed
+
+    def start_cleanup(self, interval):
+        '''Start a background thread that removes expired slices every interval seconds'''
+        if self._cleaner is not None:
+            return
+        self._stop_cleanup = threading.Event()
+        def clean():
+            while not self._stop_cleanup.wait(interval):
+                try:
+                    for urn in self.remove_expired():
+                        self.logger.info("Removing expired slice %s", urn)
+                except Exception, e:
+                    self.logger.error("Failed to remove expired slices: %s", e)
+        self._cleaner = threading.Thread(target=clean, name="slice-cleanup")
+        self._cleaner.daemon = True
+        self._cleaner.start()
+
+    def stop_cleanup(self):
+        '''Stop the background thread started by start_cleanup'''
+        if self._cleaner is None:
+            return
+        self._stop_cleanup.set()
+        self._cleaner.join()
+        self._cleaner = None
@@ -37,11 +37,13 @@ from __future__ import absolute_import
 
 import datetime
 from dateutil import parser as du_parser, tz as du_tz
+import hashlib
 import optparse
 import os
 import subprocess
 import sys
 import tempfile
+import threading
 from xml.dom.minidom import *
 from StringIO import StringIO
 
@@ -67,6 +69,21 @@ except:
 # Requires that openssl be installed and in the path
 # create_speaks_for requires that xmlsec1 be on the path
 
+# Successful speaks-for verifications are cached until the credential
+# expires (but at most this long), keyed by the credential, tool cert,
+# speaking-for URN, trusted roots and schema.
+SPEAKS_FOR_CACHE_MAX_AGE = datetime.timedelta(hours=1)
+# Max number of cached verifications
+SPEAKS_FOR_CACHE_SIZE = 1000
+
+# key => (cache entry expiration, user gid)
+_speaks_for_cache = dict()
+_speaks_for_cache_lock = threading.Lock()
+
+# schema filename => (file modification time, compiled lxml XMLSchema)
+_xmlschemas = dict()
+_xmlschemas_lock = threading.Lock()
+
 # Simple XML helper functions
 
 # Find the text associated with first child text node
@@ -116,6 +133,17 @@ def get_cert_keyid(gid):
     keyid = raw_key_id.replace(':', '').lower()
     return keyid
 
+# Return the compiled lxml XMLSchema for the given schema file,
+# parsing the file only when it has changed
+def get_xmlschema(schema):
+    from lxml import etree
+    mtime = os.path.getmtime(schema)
+    entry = _xmlschemas.get(schema)
+    if entry is None or entry[0] != mtime:
+        entry = (mtime, etree.XMLSchema(etree.parse(schema)))
+        _xmlschemas[schema] = entry
+    return entry[1]
+
 # Pull the cert out of a list of certs in a PEM formatted cert string
 def grab_toplevel_cert(cert):
     start_label = '-----BEGIN CERTIFICATE-----'
@@ -213,9 +241,11 @@ def verify_speaks_for(cred, tool_gid, speaking_for_urn, \
     if HAVELXML and schema and os.path.exists(schema):
         from lxml import etree
         tree = etree.parse(StringIO(cred.xml))
-        schema_doc = etree.parse(schema)
-        xmlschema = etree.XMLSchema(schema_doc)
-        if not xmlschema.validate(tree):
+        xmlschema = get_xmlschema(schema)
+        # lxml XMLSchema objects are not thread safe
+        with _xmlschemas_lock:
+            valid = xmlschema.validate(tree)
+        if not valid:
             error = xmlschema.error_log.last_error
             message = "%s: %s (line %s)" % (cred.get_summary_tostring(), error.message, error.line)
             return False, None, ("XML Credential schema invalid: %s" % message)
@@ -247,6 +277,51 @@ def verify_speaks_for(cred, tool_gid, speaking_for_urn, \
 
     return True, user_gid, ""
 
+# Return the key for the speaks-for verification cache, from the
+# credential (string or Credential), tool cert, speaking for URN,
+# trusted roots and schema
+def _speaks_for_cache_key(cred_value, tool_gid, speaking_for_urn, \
+                              trusted_roots, schema):
+    if isinstance(cred_value, Credential):
+        cred_value = cred_value.save_to_string()
+    roots = hashlib.sha1()
+    if trusted_roots:
+        for root in trusted_roots:
+            roots.update(root.save_to_string())
+    schema_mtime = None
+    if schema and os.path.exists(schema):
+        schema_mtime = os.path.getmtime(schema)
+    return (hashlib.sha1(cred_value).hexdigest(),
+            hashlib.sha1(tool_gid.save_to_string()).hexdigest(),
+            speaking_for_urn, roots.hexdigest(), schema, schema_mtime)
+
+# Return the user gid of the cached successful speaks-for verification
+# with the given key, or None
+def _get_cached_speaks_for(key):
+    with _speaks_for_cache_lock:
+        entry = _speaks_for_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < datetime.datetime.utcnow():
+            del _speaks_for_cache[key]
+            return None
+        return entry[1]
+
+# Cache a successful speaks-for verification with the given key
+def _cache_speaks_for(key, cred, user_gid):
+    now = datetime.datetime.utcnow()
+    expires = now + SPEAKS_FOR_CACHE_MAX_AGE
+    if cred.expiration and cred.expiration < expires:
+        expires = cred.expiration
+    with _speaks_for_cache_lock:
+        if len(_speaks_for_cache) >= SPEAKS_FOR_CACHE_SIZE:
+            for (k, entry) in _speaks_for_cache.items():
+                if entry[0] < now:
+                    del _speaks_for_cache[k]
+            if len(_speaks_for_cache) >= SPEAKS_FOR_CACHE_SIZE:
+                _speaks_for_cache.clear()
+        _speaks_for_cache[key] = (expires, user_gid)
+
 # Determine if this is a speaks-for context. If so, validate
 # And return either the tool_cert (not speaks-for or not validated)
 # or the user cert (validated speaks-for)
@@ -260,6 +335,7 @@ def verify_speaks_for(cred, tool_gid, speaking_for_urn, \
 # trusted_roots is a list of Certificate objects from the system
 #   trusted_root directory
 # Optionally, provide an XML schema against which to validate the credential
+# Successful verifications are cached (see SPEAKS_FOR_CACHE_MAX_AGE)
 def determine_speaks_for(logger, credentials, caller_gid, options, \
                              trusted_roots, schema=None):
     if options and 'geni_speaking_for' in options:
@@ -278,6 +354,14 @@ def determine_speaks_for(logger, credentials, caller_gid, options, \
                 if CredentialFactory.getType(cred) != ABACCredential.ABAC_CREDENTIAL_TYPE: continue
                 cred_value = cred
 
+            # Have we verified this one already?
+            cache_key = _speaks_for_cache_key(cred_value, caller_gid,
+                                              speaking_for_urn, trusted_roots,
+                                              schema)
+            user_gid = _get_cached_speaks_for(cache_key)
+            if user_gid is not None:
+                return user_gid # speaks-for
+
             # If the cred_value is xml, create the object
             if not isinstance(cred_value, ABACCredential):
                 cred = CredentialFactory.createCred(cred_value)
@@ -293,6 +377,7 @@ def determine_speaks_for(logger, credentials, caller_gid, options, \
                                       trusted_roots, schema, logger)
 
             if is_valid_speaks_for:
+                _cache_speaks_for(cache_key, cred, user_gid)
                 return user_gid # speaks-for
             else:
                 if logger:
@@ -39,6 +39,7 @@ import os
 import pprint
 import re
 import string
+import tempfile
 import zlib
 
 from .util import OmniError, NoSliceCredError, RefusedError, naiveUTC, AMAPIError
@@ -482,12 +483,27 @@ class AMCallHandler(object):
         if fdir and fdir != "":
             if not os.path.exists(fdir):
                 os.makedirs(fdir)
+        # Write a temp file and rename it into place, so Omni calls running
+        # at the same time (e.g. from stitcher) never read a partial file
+        tmpname = None
         try:
-            with open(self.opts.getversionCacheName, 'w') as f:
+            handle, tmpname = tempfile.mkstemp(dir=fdir or None)
+            with os.fdopen(handle, 'w') as f:
                 json.dump(self.GetVersionCache, f, cls=DateTimeAwareJSONEncoder)
+            if os.name == 'nt' and os.path.exists(self.opts.getversionCacheName):
+                # On Windows, rename doesn't replace an existing file
+                os.unlink(self.opts.getversionCacheName)
+            os.rename(tmpname, self.opts.getversionCacheName)
+            tmpname = None
             self.logger.debug("Wrote GetVersionCache to %s", self.opts.getversionCacheName)
         except Exception, e:
             self.logger.error("Failed to write GetVersion cache: %s", e)
+        finally:
+            if tmpname:
+                try:
+                    os.unlink(tmpname)
+                except:
+                    pass
 
     def _load_getversion_cache(self):
         '''Load GetVersion cache from JSON encoded file, if any'''
@@ -1860,7 +1876,7 @@ class AMCallHandler(object):
                 retVal += '\n   Saved createsliver results to %s. ' % (filename)
 
             manExpires = None
-            if result and "<rspec" in result and "expires" in result:
+            if result and "<rspec" in result:
                 # Try to parse the new sliver expiration from the rspec and print it in the result summary.
                 # Use a helper function in handler_utils that can be used elsewhere.
                 manExpires = expires_from_rspec(result, self.logger)
@@ -2838,7 +2854,7 @@ class AMCallHandler(object):
                             if len(exps) > 1:
                                 # More than 1 distinct sliver expiration found
                                 # FIXME: Sort and take first?
-                                exps = exps.sort()
+                                exps.sort()
                                 self.logger.debug("Found %d different expiration times. Using first", len(exps))
                                 outputstr = exps[0].isoformat()
                             elif len(exps) == 0:
@@ -3335,7 +3351,7 @@ class AMCallHandler(object):
                     if len(exps) > 1:
                         # More than 1 distinct sliver expiration found
                         # FIXME: Sort and take first?
-                        exps = exps.sort()
+                        exps.sort()
                         outputstr = exps[0].isoformat()
                         msg = "Resources in slice %s at AM %s expire at %d different times. First expiration is %s UTC" % (name, client.str, len(exps), outputstr)
                     elif len(exps) == 0:
@@ -5524,7 +5540,7 @@ class AMCallHandler(object):
                     if len(exps) > 1:
                         # More than 1 distinct sliver expiration found
                         # Sort and take first
-                        exps = exps.sort()
+                        exps.sort()
                         outputstr = exps[0].isoformat()
                         msg = "Resources in slice %s at AM %s expire at %d different times. First expiration is %s UTC" % (name, client.str, len(exps), outputstr)
                     elif len(exps) == 0:
@@ -5946,6 +5962,10 @@ class AMCallHandler(object):
             # FIXME: See _check_valid_return_struct
             if 'code' in result and isinstance(result['code'], dict) and 'geni_code' in result['code']:
                 # AM API v2+
+                # FORBIDDEN (3), EXPIRED (15): the AM may have rejected a cached
+                # credential, so do not use it again
+                if result['code']['geni_code'] in (3, 15) and framework is not None:
+                    framework.forget_cached_creds()
                 if result['code']['geni_code'] == 0:
                     value = result['value']
                     if value is None:
@@ -0,0 +1,235 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''
+Omni daemon: a long running Omni process that runs Omni commands sent
+to it over a Unix domain socket, using one OmniSession. Commands then
+re-use the loaded config, the control framework, the user credential
+and open clearinghouse connections, instead of starting from scratch.
+
+Start the daemon with 'omni.py --daemon', and send it commands with
+'omni.py --useDaemon <usual omni arguments>', or call_daemon from a script.
+
+The protocol is one JSON object per line:
+ request:  {"argv": [omni arguments], "cwd": client working directory}
+ response: {"text": result summary string, "result": result object,
+            "error": error message or null}
+
+The socket is only accessible to the user running the daemon, and
+(where supported) the daemon refuses connections from other users.
+Commands run with the daemon's logging configuration: their log
+output goes to the daemon's logs, not to the client.
+'''
+
+from __future__ import absolute_import
+
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import traceback
+
+from .util.json_encoding import ResultJSONEncoder, DateTimeAwareJSONDecoder
+
+# Max size of a request, in bytes
+MAX_REQUEST_SIZE = 1024*1024
+
+def _send(sock, obj, cls=None):
+    sock.sendall(json.dumps(obj, cls=cls) + "\n")
+
+def _receive(sock, maxsize=None):
+    '''Read one line from the socket and return it decoded, or None if no data'''
+    data = ""
+    while not data.endswith("\n"):
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+        if maxsize and len(data) > maxsize:
+            raise ValueError("Message too long")
+    if data.strip() == "":
+        return None
+    return json.loads(data, cls=DateTimeAwareJSONDecoder)
+
+def call_daemon(argv, socketName):
+    '''Send the given Omni command to the Omni daemon listening on socketName.
+    Return is a list of 2 items, as from gcf.oscript.call: a human readable
+    string summarizing the result, and the result object.
+    Raises OmniError if the daemon cannot be reached or the command failed.'''
+    from .util import OmniError
+    if not hasattr(socket, 'AF_UNIX'):
+        raise OmniError("The Omni daemon is not supported on this platform")
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socketName)
+        except socket.error, e:
+            raise OmniError("Cannot reach Omni daemon at %s (start one with --daemon): %s" % (socketName, e))
+        _send(sock, {'argv': argv, 'cwd': os.getcwd()})
+        reply = _receive(sock)
+    finally:
+        sock.close()
+    if reply is None:
+        raise OmniError("Omni daemon at %s closed the connection" % socketName)
+    if reply.get('error'):
+        raise OmniError(reply['error'])
+    return reply.get('text'), reply.get('result')
+
+class OmniDaemon(object):
+    '''Serve Omni commands on a Unix domain socket, using one OmniSession.'''
+
+    def __init__(self, socketName, idleTimeout, maxCalls, logger):
+        self.socketName = socketName
+        self.idleTimeout = idleTimeout
+        self.logger = logger
+        # Logging was configured by whoever started the daemon
+        from ..oscript import OmniSession
+        self.session = OmniSession(configureLogging=False)
+        self._callSlots = threading.BoundedSemaphore(max(1, maxCalls))
+        # The process working directory is shared by all commands. Commands for
+        # clients in other directories wait until no command is running.
+        self._cwdCondition = threading.Condition()
+        self._running = 0
+        self._lastActivity = time.time()
+
+    def _listen(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            from .util import OmniError
+            raise OmniError("The Omni daemon is not supported on this platform")
+        directory = os.path.dirname(self.socketName)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, 0700)
+        if os.path.exists(self.socketName):
+            # Is another daemon using it?
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socketName)
+                probe.close()
+                raise Exception("An Omni daemon is already listening on %s" % self.socketName)
+            except socket.error:
+                os.unlink(self.socketName)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        oldmask = os.umask(0077)
+        try:
+            sock.bind(self.socketName)
+        finally:
+            os.umask(oldmask)
+        os.chmod(self.socketName, 0600)
+        sock.listen(16)
+        return sock
+
+    def _peerAllowed(self, conn):
+        '''Is the connecting process run by our user? True if we cannot tell.'''
+        if not hasattr(socket, 'SO_PEERCRED'):
+            return True
+        try:
+            creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+            (pid, uid, gid) = struct.unpack('3i', creds)
+        except Exception, e:
+            self.logger.debug("Failed to get peer credentials: %s", e)
+            return True
+        return uid == os.getuid()
+
+    def _isIdle(self):
+        with self._cwdCondition:
+            return self._running == 0 and self.idleTimeout > 0 and \
+                time.time() - self._lastActivity > self.idleTimeout
+
+    def serve(self):
+        '''Serve commands until idle for idleTimeout seconds (or interrupted)'''
+        sock = self._listen()
+        self.logger.info("Omni daemon listening on %s", self.socketName)
+        # Wake up periodically to check for idleness
+        if self.idleTimeout > 0:
+            sock.settimeout(min(self.idleTimeout, 10))
+        try:
+            while True:
+                try:
+                    conn, addr = sock.accept()
+                except socket.timeout:
+                    if self._isIdle():
+                        self.logger.info("Omni daemon idle for %d seconds: exiting", self.idleTimeout)
+                        break
+                    continue
+                conn.settimeout(None)
+                with self._cwdCondition:
+                    self._lastActivity = time.time()
+                if not self._peerAllowed(conn):
+                    self.logger.warn("Refusing Omni daemon connection from another user")
+                    conn.close()
+                    continue
+                t = threading.Thread(target=self._handle, args=(conn,))
+                t.daemon = True
+                t.start()
+        except KeyboardInterrupt:
+            self.logger.info("Omni daemon interrupted: exiting")
+        finally:
+            sock.close()
+            try:
+                os.unlink(self.socketName)
+            except OSError:
+                pass
+
+    def _handle(self, conn):
+        try:
+            try:
+                request = _receive(conn, MAX_REQUEST_SIZE)
+                if not isinstance(request, dict) or not isinstance(request.get('argv'), list):
+                    raise ValueError("Malformed request")
+            except Exception, e:
+                self.logger.debug("Bad Omni daemon request: %s", e)
+                _send(conn, {'text': None, 'result': None, 'error': "Bad request: %s" % e})
+                return
+            argv = [str(arg) for arg in request['argv']]
+            reply = self._run(argv, request.get('cwd'))
+            _send(conn, reply, cls=ResultJSONEncoder)
+        except Exception, e:
+            self.logger.debug("Failed to answer Omni daemon request: %s", e)
+        finally:
+            conn.close()
+
+    def _run(self, argv, cwd):
+        '''Run the given command, returning the reply to send'''
+        with self._callSlots:
+            with self._cwdCondition:
+                if cwd and os.path.isdir(cwd):
+                    while self._running > 0 and os.getcwd() != cwd:
+                        self._cwdCondition.wait()
+                    if os.getcwd() != cwd:
+                        os.chdir(cwd)
+                self._running += 1
+            try:
+                self.logger.debug("Omni daemon running: %s", " ".join(argv))
+                text, result = self.session.call(argv, verbose=True)
+                return {'text': text, 'result': result, 'error': None}
+            except SystemExit, e:
+                return {'text': None, 'result': None, 'error': "Omni exited: %s" % e}
+            except Exception, e:
+                self.logger.debug(traceback.format_exc())
+                return {'text': None, 'result': None, 'error': "%s: %s" % (e.__class__.__name__, e)}
+            finally:
+                with self._cwdCondition:
+                    self._running -= 1
+                    self._lastActivity = time.time()
+                    self._cwdCondition.notifyAll()
@@ -349,6 +349,12 @@ class Framework_Base():
     def delete_sliver_info(self, sliver_urn):
         raise NotImplementedError('delete_sliver_info')
 
+    # An aggregate rejected a credential we gave it: forget any cached
+    # copies of the credentials in use. Frameworks that do not cache
+    # credentials have nothing to do.
+    def forget_cached_creds(self):
+        pass
+
     # Find all slivers the SA lists for the given slice
     # Return a struct by AM URN containing a struct: sliver_urn = sliver info struct
     # Compare with list_sliverinfo_urns which only returns the sliver URNs
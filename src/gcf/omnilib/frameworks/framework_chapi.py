@@ -32,8 +32,10 @@ from ..util import OmniError
 from ..util.dates import naiveUTC
 from ..util.dossl import _do_ssl
 from ..util import credparsing as credutils
+from ..util.credcache import CredentialCache
 #from ..util.handler_utils import _lookupAggURNFromURLInNicknames
 from ..util.handler_utils import _load_cred
+from ..util.parallel import key_is_encrypted, parallel_map
 
 from ...geni.util.tz_util import tzd
 from ...geni.util.urn_util import is_valid_urn, URN, string_to_urn_format,\
@@ -51,8 +53,13 @@ import os
 from pprint import pprint
 import string
 import sys
+import threading
+import traceback
 import uuid
 
+# Max number of threads used to record new slivers at the SA
+SLIVER_INFO_RECORDING_THREADS = 4
+
 class Framework(Framework_Base):
     def __init__(self, config, opts):
         Framework_Base.__init__(self,config)
@@ -95,6 +102,9 @@ class Framework(Framework_Base):
             self.logger.info("Member Authority is %s (from config)", self._ma_url)
 
         self._sa = None
+        self._credcache = None
+        # Targets of the credentials we got from the cache
+        self._used_cached_creds = set()
         self._sa_url = None
         if config.has_key('sa') and config['sa'].strip() != "":
             self._sa_url = config['sa']
@@ -323,6 +333,68 @@ class Framework(Framework_Base):
             self.logger.debug("%s]; new_options = %s" % (msg, new_options))
         return new_credentials, new_options
 
+    # Return the CredentialCache to use, or None if credentials should not be cached
+    def _cred_cache(self):
+        if self._credcache is not None:
+            return self._credcache
+        if getattr(self.opts, 'noCacheFiles', False) or getattr(self.opts, 'noCredCache', False):
+            return None
+        cachedir = getattr(self.opts, 'credCacheDir', None)
+        if cachedir is None or cachedir.strip() == "":
+            return None
+        self._credcache = CredentialCache(cachedir, self.logger)
+        return self._credcache
+
+    # The user whose credentials we cache: this user, possibly speaking for another
+    def _cred_cache_user(self):
+        if self.opts.speaksfor:
+            return "%s speaksfor %s" % (self.user_urn, self.opts.speaksfor)
+        return self.user_urn
+
+    # Get the cached credential struct for the given user or slice URN, if any.
+    # A corrupt cache entry is removed, so the credential is fetched from the CH.
+    def _get_cached_cred(self, target_urn):
+        cache = self._cred_cache()
+        if cache is None:
+            return None
+        try:
+            cred = cache.get(self.ch_url, self._cred_cache_user(), target_urn)
+        except Exception, e:
+            self.logger.debug("Ignoring unusable cached credential for %s: %s", target_urn, e)
+            self._uncache_cred(target_urn)
+            return None
+        if cred is not None:
+            self._used_cached_creds.add(target_urn)
+        return cred
+
+    # Cache the given credential struct for the given user or slice URN
+    def _cache_cred(self, target_urn, credstruct):
+        cache = self._cred_cache()
+        if cache is None:
+            return
+        try:
+            cache.put(self.ch_url, self._cred_cache_user(), target_urn, credstruct)
+        except Exception, e:
+            self.logger.debug("Failed to cache credential for %s: %s", target_urn, e)
+
+    # Remove any cached credential for the given user or slice URN,
+    # as when the slice expiration or membership changes
+    def _uncache_cred(self, target_urn):
+        cache = self._cred_cache()
+        if cache is not None:
+            cache.invalidate(self.ch_url, self._cred_cache_user(), target_urn)
+
+    def forget_cached_creds(self):
+        # An AM rejected a credential: remove the cached credentials used
+        # so far, so the next call gets fresh ones from the CH
+        for target_urn in self._used_cached_creds:
+            self.logger.debug("Forgetting cached credential for %s", target_urn)
+            self._uncache_cred(target_urn)
+            if target_urn == self.user_urn:
+                self.user_cred = None
+                self.user_cred_struct = None
+        self._used_cached_creds = set()
+
     def get_user_cred(self, struct=False):
         message = ""
         msg = None
@@ -332,6 +404,12 @@ class Framework(Framework_Base):
         if struct==True and self.user_cred_struct is not None:
             return self.user_cred_struct, msg
 
+        if self.user_cred == None:
+            cred = self._get_cached_cred(self.user_urn)
+            if cred is not None:
+                self.user_cred_struct = cred
+                self.user_cred = cred['geni_value']
+
         if self.user_cred == None:
             creds, options = self._add_credentials_and_speaksfor(creds, options)
             self.logger.debug("Getting user credential from %s MA %s",
@@ -356,6 +434,7 @@ class Framework(Framework_Base):
                                     self.logger.debug("Got non string geni_version on user cred. %s is type %s",
                                                       self.user_cred_struct['geni_version'], type(self.user_cred_struct['geni_version']))
                                     self.user_cred_struct['geni_version'] = str(self.user_cred_struct['geni_version'])
+                            self._cache_cred(self.user_urn, self.user_cred_struct)
                     if self.user_cred is None:
                         self.logger.error("No SFA-type user credential returned!")
                         self.logger.debug("Got: %s", res['value'])
@@ -382,6 +461,12 @@ class Framework(Framework_Base):
             return self.user_cred, msg
 
     def get_slice_cred(self, slice_urn, struct=False):
+        credstruct = self._get_cached_cred(slice_urn)
+        if credstruct is not None:
+            if struct==False:
+                return credstruct['geni_value']
+            return credstruct
+
         scred = []
         options = {'match':
                    {'SLICE_URN': slice_urn,
@@ -421,6 +506,7 @@ class Framework(Framework_Base):
                     if cred is None:
                         self.logger.debug("Malformed list of creds: Got: %s", d)
                         raise OmniError("No slice credential returned for slice %s" % slice_urn)
+                    self._cache_cred(slice_urn, credstruct)
                 else:
                     self.logger.debug("Malformed slice cred return. Got: %s", res)
                     raise OmniError("Malformed return getting slice credential")
@@ -1185,6 +1271,8 @@ class Framework(Framework_Base):
         if res is not None:
             if res['code'] == 0:
                 b = True
+                # The slice credential expiration changed
+                self._uncache_cred(urn)
             else:
                 message = res['output']
                 if res.has_key('protogeni_error_url'):
@@ -1496,6 +1584,7 @@ class Framework(Framework_Base):
         logr = self._log_results((res, mess), 'Add member %s to %s slice %s' % (member_urn, self.fwtype, slice_urn))
         if logr == True:
             success = logr
+            self._uncache_cred(slice_urn)
         else:
             success = False
             mess = logr
@@ -1525,6 +1614,7 @@ class Framework(Framework_Base):
         logr = self._log_results((res, mess), 'Remove member %s from %s slice %s' % (member_urn, self.fwtype, slice_urn))
         if logr == True:
             success = logr
+            self._uncache_cred(slice_urn)
         else:
             success = False
             mess = logr
@@ -1599,9 +1689,8 @@ class Framework(Framework_Base):
         auth = sliver_urn[0 : idx1]
         return auth + '+authority+am'
 
-    # Helper for actually recording a new sliver with the given expiration
-    def _record_one_new_sliver(self, sliver_urn, slice_urn, agg_urn,
-                               creator_urn, expiration):
+    # Get the credentials to pass when recording new slivers in the given slice
+    def _sliver_info_creds(self, slice_urn):
         creds = []
         if self.needcred:
             # FIXME: At PG should this be user or slice cred?
@@ -1612,6 +1701,20 @@ class Framework(Framework_Base):
             sc = self.get_slice_cred_struct(slice_urn)
             if sc is not None:
                 creds.append(sc)
+        return creds
+
+    # Helper for actually recording a new sliver with the given expiration
+    # creds are the credentials to use, as from _sliver_info_creds (fetched if not supplied)
+    # sa is the SA client to use (defaults to self.sa())
+    def _record_one_new_sliver(self, sliver_urn, slice_urn, agg_urn,
+                               creator_urn, expiration, creds=None, sa=None):
+        if creds is None:
+            creds = self._sliver_info_creds(slice_urn)
+        else:
+            # _add_credentials_and_speaksfor adds to the list
+            creds = list(creds)
+        if sa is None:
+            sa = self.sa()
 
         if not is_valid_urn(agg_urn):
             self.logger.debug("Not a valid AM URN: %s", agg_urn)
@@ -1664,12 +1767,79 @@ class Framework(Framework_Base):
         creds, options = self._add_credentials_and_speaksfor(creds, options)
         if not self.speakV2:
             res = _do_ssl(self, None, "Recording sliver '%s' creation at %s %s" % (sliver_urn, self.fwtype, self.sa_url()),
-                          self.sa().create_sliver_info, creds, options)
+                          sa.create_sliver_info, creds, options)
         else:
             res = _do_ssl(self, None, "Recording sliver '%s' creation at %s %s" % (sliver_urn, self.fwtype, self.sa_url()),
-                          self.sa().create, "SLIVER_INFO", creds, options)
+                          sa.create, "SLIVER_INFO", creds, options)
         return self._log_results(res, "Record sliver '%s' creation at %s" % (sliver_urn, self.fwtype))
 
+    # Record the given list of (sliver_urn, expiration) as new slivers in the given slice.
+    # The slice credential is fetched once for all slivers.
+    # Multiple slivers are recorded in parallel over separate
+    # SA connections, unless our key needs a pass phrase.
+    # Return the concatenated results of _record_one_new_sliver
+    def _record_new_slivers(self, slivers, slice_urn, agg_urn, creator_urn):
+        if len(slivers) == 0:
+            return ""
+        creds = self._sliver_info_creds(slice_urn)
+        # Load any extra credentials and the SA URL once, before starting threads
+        creds, _ = self._add_credentials_and_speaksfor(creds, None)
+        sa_url = self.sa_url()
+
+        nthreads = min(SLIVER_INFO_RECORDING_THREADS, len(slivers))
+        if nthreads > 1 and key_is_encrypted(self.key, self.logger):
+            self.logger.debug("Private key is encrypted: recording slivers serially")
+            nthreads = 1
+        if nthreads <= 1:
+            msg = ""
+            for (sliver_urn, expiration) in slivers:
+                msg = msg + str(self._record_one_new_sliver(sliver_urn,
+                                                        slice_urn, agg_urn, creator_urn, expiration, creds))
+            return msg
+
+        self.logger.debug("Recording %d slivers using %d threads", len(slivers), nthreads)
+        # xmlrpclib clients are not thread safe: each thread gets its own
+        clients = threading.local()
+
+        def recordSliver(sliver):
+            (sliver_urn, expiration) = sliver
+            try:
+                if getattr(clients, 'sa', None) is None:
+                    clients.sa = self.make_client(sa_url, self.key, self.cert,
+                                                  verbose=self.config['verbose'], timeout=self.opts.ssltimeout)
+                return self._record_one_new_sliver(sliver_urn, slice_urn,
+                                                   agg_urn, creator_urn, expiration, creds, clients.sa)
+            except Exception, e:
+                self.logger.debug(traceback.format_exc())
+                msg = "Failed to record sliver '%s': %s" % (sliver_urn, e)
+                self.logger.warn(msg)
+                return msg
+
+        results = parallel_map(recordSliver, slivers, nthreads)
+        return "".join([str(r) for r in results])
+
+    # Return the list of sliver URNs in the given manifest RSpec string,
+    # in order, from its sliver_id attributes
+    def _find_manifest_sliver_urns(self, manifest):
+        urns = []
+        idx = 0
+        while True:
+            idx1 = manifest.find('sliver_id=', idx) # Start of 'sliver_id='
+            if idx1 < 0: break # No more slivers
+            idx2 = manifest.find('"', idx1) + 1 # Start of URN
+            if idx2 == 0:
+                # didn't find start of sliver id?
+                self.logger.debug("Malformed sliver_id in rspec? %s", manifest[idx1:idx1+30])
+                break
+            idx3 = manifest.find('"', idx2) # End of URN
+            if idx3 < 0:
+                # didn't find end of sliver id?
+                self.logger.debug("Malformed sliver_id in rspec? %s", manifest[idx2-15:idx2+80])
+                break
+            urns.append(manifest[idx2 : idx3])
+            idx = idx3 + 1
+        return urns
+
     # write new sliver_info to the database using chapi
     # Manifest is the XML when using APIv1&2 and none otherwise
     # expiration is the slice expiration
@@ -1704,35 +1874,15 @@ class Framework(Framework_Base):
         if not is_valid_urn(slice_urn):
             self.logger.warn("Invalid slice URN '%s' for recording new slivers", slice_urn)
             return
-        creds = []
-        msg = ""
+        # List of (sliver_urn, expiration) to record
+        toRecord = []
 
         if manifest and manifest.strip() != "" and (slivers is None or len(slivers) == 0):
             # APIv1/2: find slivers in manifest
             self.logger.debug("Finding new slivers to record in manifest")
-            # Loop through manifest finding all slivers to record
-            foundSlivers = False
-            while True:
-                idx1 = manifest.find('sliver_id=') # Start of 'sliver_id='
-                if idx1 < 0: break # No more slivers
-                idx2 = manifest.find('"', idx1) + 1 # Start of URN
-                if idx2 == 0:
-                    # didn't find start of sliver id?
-                    self.logger.debug("Malformed sliver_id in rspec? %s", manifest[:30])
-                    manifest = manifest[9:]
-                    continue
-                idx3 = manifest.find('"', idx2) # End of URN
-                if idx3 == 0:
-                    # didn't find end of sliver id?
-                    self.logger.debug("Malformed sliver_id in rspec? %s", manifest[idx2-15:idx2+80])
-                    manifest = manifest[idx2:]
-                    continue
-                sliver_urn = manifest[idx2 : idx3]
-                manifest = manifest[idx3+1:]
-                foundSlivers = True
-                msg = msg + str(self._record_one_new_sliver(sliver_urn,
-                                                        slice_urn, agg_urn, creator_urn, expiration))
-            # End of while loop over slivers in manifest
+            for sliver_urn in self._find_manifest_sliver_urns(manifest):
+                toRecord.append((sliver_urn, expiration))
+            foundSlivers = len(toRecord) > 0
 
             # Ticket #574
             # If we have an am_urn and have a manifest and this is a FOAM manifest/AM, then we have no sliver_urns yet probably.
@@ -1750,8 +1900,7 @@ class Framework(Framework_Base):
                 sliver_urn = URN(authority=auth, type="sliver", name=str(sliver_uuid)).urn_string()
                 self.logger.debug("Recording sliver_info had manifest with no sliver_ids (FOAM?). Created a single sliver urn to record: %s", sliver_urn)
                 # Record one new sliver with that
-                msg = msg + str(self._record_one_new_sliver(sliver_urn,
-                                                        slice_urn, agg_urn, creator_urn, expiration))
+                toRecord.append((sliver_urn, expiration))
 
         elif slivers and len(slivers) > 0:
             # APIv3 style sliver to record
@@ -1767,13 +1916,12 @@ class Framework(Framework_Base):
                 exp = expiration
                 if sliver.has_key('geni_expires'):
                     exp = sliver['geni_expires']
-                msg = msg + str(self._record_one_new_sliver(sliver_urn,
-                                                        slice_urn, agg_urn, creator_urn, exp))
+                toRecord.append((sliver_urn, exp))
             # End of loop over slivers
         else:
             self.logger.debug("Got no manifest AND no slivers to record")
         # End of if/else block for API Version
-        return msg
+        return self._record_new_slivers(toRecord, slice_urn, agg_urn, creator_urn)
 
     # use the database to convert an aggregate url to the corresponding urn
     # FIXME: other CHs do similar things - implement this elsewhere
@@ -1913,7 +2061,7 @@ class Framework(Framework_Base):
 
             msg = str(msg)
             nm = self._record_one_new_sliver(sliver_urn,
-                                               slice_urn, agg_urn, self.user_urn, expiration)
+                                               slice_urn, agg_urn, self.user_urn, expiration, creds)
             if nm != True:
                 msg += str(msg)
             else:
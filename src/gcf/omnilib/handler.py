@@ -31,8 +31,6 @@ Calls generally go to the ch-handler or the am-handler as appropriate.
 """ 
 
 from .util import OmniError
-from .amhandler import AMCallHandler
-from .chhandler import CHCallHandler
 
 class CallHandler(object):
     """Handle calls on the framework. Valid calls are all
@@ -57,9 +55,24 @@ class CallHandler(object):
                 self.opts.abac= False
                 self.abac_dir = None
                 self.abac_log = None
-        self.amhandler = AMCallHandler(framework, config, opts);
-        self.chhandler = CHCallHandler(framework, config, opts);
+        # The AM and CH handlers are created (and their modules imported)
+        # on first use, so a command loads only the handler it needs
+        self._amhandler = None
+        self._chhandler = None
 
+    @property
+    def amhandler(self):
+        if self._amhandler is None:
+            from .amhandler import AMCallHandler
+            self._amhandler = AMCallHandler(self.framework, self.config, self.opts)
+        return self._amhandler
+
+    @property
+    def chhandler(self):
+        if self._chhandler is None:
+            from .chhandler import CHCallHandler
+            self._chhandler = CHCallHandler(self.framework, self.config, self.opts)
+        return self._chhandler
         
     def _raise_omni_error( self, msg, err=OmniError ):
         self.logger.error( msg )
@@ -113,9 +113,7 @@ class ManifestRSpecCombiner:
 
         for am in ams_list:
             if self.useReqs and not am.manifestDom:
-                if not am.requestDom:
-                    am.requestDom = am.getEditedRSpecDom(dom_template)
-                am_manifest_dom = am.requestDom
+                am_manifest_dom = getRequestDom(am, dom_template)
             else:
                 am_manifest_dom = am.manifestDom
             if am_manifest_dom == dom_template:
@@ -194,9 +192,7 @@ class ManifestRSpecCombiner:
             return
         for am in ams_list:
             if self.useReqs and not am.manifestDom:
-                if not am.requestDom:
-                    am.requestDom = am.getEditedRSpecDom(dom_template)
-                am_manifest_dom = am.requestDom
+                am_manifest_dom = getRequestDom(am, dom_template)
             else:
                 am_manifest_dom = am.manifestDom
             if am_manifest_dom == dom_template:
@@ -298,9 +294,7 @@ class ManifestRSpecCombiner:
         # component_manager_id attribute on that node and the client_ids match
         for am in ams_list:
             if self.useReqs and not am.manifestDom:
-                if not am.requestDom:
-                    am.requestDom = am.getEditedRSpecDom(dom_template)
-                am_manifest_dom = am.requestDom
+                am_manifest_dom = getRequestDom(am, dom_template)
             else:
                 am_manifest_dom = am.manifestDom
 
@@ -408,9 +402,7 @@ class ManifestRSpecCombiner:
         # and the link has that AM as a component_manager, then append this link to the template
         for agg in ams_list:
             if self.useReqs and not agg.manifestDom:
-                if not agg.requestDom:
-                    agg.requestDom = agg.getEditedRSpecDom(dom_template)
-                man = agg.requestDom
+                man = getRequestDom(agg, dom_template)
             else:
                 man = agg.manifestDom
             if man is None:
@@ -526,9 +518,7 @@ class ManifestRSpecCombiner:
 #                        self.logger.debug("Looking at AM %s for link %s", agg.urn, client_id)
 
                     if self.useReqs and not agg.manifestDom:
-                        if not agg.requestDom:
-                            agg.requestDom = agg.getEditedRSpecDom(dom_template)
-                        man = agg.requestDom
+                        man = getRequestDom(agg, dom_template)
                     else:
                         man = agg.manifestDom
                     if man is None:
@@ -860,9 +850,7 @@ class ManifestRSpecCombiner:
                 if len(am.hops) > 0:
                     self.logger.debug("Template DOM had no stitching node. Using stitching node from %s", am)
                     if self.useReqs and not am.manifestDom:
-                        if not am.requestDom:
-                            am.requestDom = am.getEditedRSpecDom(dom_template)
-                        am_manifest_dom = am.requestDom
+                        am_manifest_dom = getRequestDom(am, dom_template)
                     else:
                         am_manifest_dom = am.manifestDom
                     newStitch = self.getStitchingElement(am_manifest_dom)
@@ -895,9 +883,7 @@ class ManifestRSpecCombiner:
                 self.logger.debug("Pulling hops from a DCN AM: %s", am)
 
             if self.useReqs and not am.manifestDom:
-                if not am.requestDom:
-                    am.requestDom = am.getEditedRSpecDom(dom_template)
-                am_manifest_dom = am.requestDom
+                am_manifest_dom = getRequestDom(am, dom_template)
             else:
                 am_manifest_dom = am.manifestDom
             if am_manifest_dom == dom_template:
@@ -1267,6 +1253,15 @@ class ManifestRSpecCombiner:
             self.logger.debug("Failed to find rspec node from manifest_dom")
         return None
 
+def getRequestDom(am, dom_template):
+    '''Return the request DOM for the given Aggregate, constructing it from
+    dom_template if the AM has none yet.'''
+    if not am.requestDom:
+        # The combiner edits dom_template in place, and getEditedRSpecDom
+        # shares unedited elements with the DOM it is given: start from a full copy
+        am.requestDom = am.getEditedRSpecDom(dom_template.cloneNode(True))
+    return am.requestDom
+
 def combineManifestRSpecs(ams_list, dom_template, useReqs=False):
     '''Combine the manifests from the given Aggregate objects into the given DOM template (a manifest). Return a DOM'''
     mrc = ManifestRSpecCombiner(useReqs)
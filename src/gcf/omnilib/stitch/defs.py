@@ -189,3 +189,9 @@ STITCH_V2_NS = "http://www.geni.net/resources/rspec/ext/stitch/2"
 
 # Minutes since last VLAN availability check before bothing to check again
 CHECK_AVAIL_INTERVAL_MINS=60
+
+# Max number of aggregates to query at once (e.g. for current VLAN availability)
+MAX_AM_QUERY_THREADS=5
+
+# Seconds to reuse an aggregate's GetVersion result in add_am_info, across SCS retries and stitcher calls
+AM_VERSION_CACHE_SECS=600
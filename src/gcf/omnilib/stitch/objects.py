@@ -1396,8 +1396,11 @@ class Aggregate(object):
         # newExpires is a datetime value for the expires attribute in the request
 
         # For each path on this AM, get that Path to write whatever it thinks necessary into a
-        # deep clone of the incoming RSpec Dom
-        requestRSpecDom = originalRSpec.cloneNode(True)
+        # copy of the incoming RSpec Dom.
+        # Only the rspec element, the stitching extension and the main body links are copied
+        # (we edit the first 2; the manifest combiner edits links in place). Everything else
+        # is shared with the incoming Dom, so we do not deep clone the whole request per AM per try.
+        requestRSpecDom = cloneRSpecDomForEdit(originalRSpec, (defs.STITCHING_TAG, defs.LINK_TAG))
 
         # This block no longer necessary. If stitchhandler sets the
         # expires attribute, then this is true. Otherwise, don't do
@@ -1974,7 +1977,9 @@ class Aggregate(object):
         except KeyboardInterrupt:
             # The AM may think we have a reservation. So mark the manifestDom as non-empty so when we clean up, we try to delete here
             if not self.manifestDom:
-                self.manifestDom = self.requestDom
+                # A full copy: the request shares elements with the expanded request,
+                # and manifests are edited when combined
+                self.manifestDom = self.requestDom.cloneNode(True)
                 self.logger.debug("Allocation interrupted. Faking that %s has a reservation, in case the AM got far enough that it thinks we do.", self)
             raise
         except AMAPIError, ae:
@@ -4159,6 +4164,13 @@ class Aggregate(object):
     def updateWithAvail(self, opts):
         # Update our hops availRange based on what is currently avail
         # Return True if updated some avail Ranges
+        return self.applyAvail(self.fetchAvail(opts))
+
+    def fetchAvail(self, opts):
+        # Get the currently available VLAN tags at this AM: list the
+        # available resources and parse the stitching hop links from the advertisement.
+        # Does not change our hops, so this may be done for several AMs at once.
+        # Return the list of HopLinks, or None if we could not get them
 
         self.logger.info("Gathering currently available VLAN tags at %s...", self)
         rspec = None
@@ -4167,62 +4179,70 @@ class Aggregate(object):
         except StitchingError, se:
             self.logger.debug("Failed to list avail resources: %s", se)
         if rspec is None:
-            return False
+            return None
         try:
             from xml.dom.minidom import parseString
             dom = parseString(rspec)
         except Exception, e:
             self.logger.debug("Failed to parse rspec: %s", e)
-            return False
+            return None
         self.lastAvailCheck = datetime.datetime.utcnow()
         ports = dom.getElementsByTagName(defs.PORT_TAG)
         if not ports or len(ports) == 0:
             self.logger.debug("No stitching ports found")
-            return False
+            return None
         hops = []
-        failToSCS = False
-        didUpdates = False
         for port in ports:
             for child in port.childNodes:
                 if child.localName == defs.LINK_TAG:
-                    hLink = HopLink.fromDOM(child)
-                    hops.append(hLink)
-                    foundHop = False
-                    for myHop in self._hops:
-                        if myHop._hop_link.urn == hLink.urn:
-                            foundHop = True
-                            self.logger.debug("Found current available tags for %s", myHop)
-                            newAvail = hLink.vlan_range_request
-                            oldAvail = myHop._hop_link.vlan_range_request
-                            if newAvail == oldAvail:
-                                self.logger.debug("Availability is unchanged")
-                                continue
+                    hops.append(HopLink.fromDOM(child))
+        return hops
 
-                            revisedAvail = newAvail.intersection(oldAvail)
-                            if len(revisedAvail) > 0:
-                                self.logger.debug("Revised available range: '%s' from intersection of old '%s' and new '%s'", revisedAvail, oldAvail, newAvail)
-                                if revisedAvail != oldAvail:
-                                    myHop._hop_link.vlan_range_request = revisedAvail
-                                    didUpdates = True
-#                                else:
-#                                    self.logger.debug("No change: All calculated request range tags still available: %s", revisedAvail)
-                            else:
-                                self.logger.debug("New available range is disjoint from old! Intersection is empty! New: %s; Old: %s", newAvail, oldAvail)
-                                # Back to the SCS
-                                failToSCS = True
-
-                            markUnavail = oldAvail - newAvail
-                            if len(markUnavail) > 0:
-                                # Each of these tags is locally unavailable. Add them to the unavail list
-                                self.logger.debug("Noting unavailable tags: '%s'", markUnavail)
-                                myHop.vlans_unavailable = myHop.vlans_unavailable.union(markUnavail)
-                            else:
-                                self.logger.debug("All calculated available tags still available: %s", revisedAvail)
-                            # Cannot break here; If same hop is used by 2 paths, we need to update the range for both
-                        # End of block to check if this hop is the one from the Ad
-                    # End of loop over hops on this AM
-                    if not foundHop:
-                        self.logger.debug("Ignoring avail for unused hop %s", hLink.urn)
+    def applyAvail(self, hops):
+        # Update our hops availRange based on the given list of currently available HopLinks
+        # (from fetchAvail)
+        # Return True if updated some avail Ranges
+        if hops is None:
+            return False
+        failToSCS = False
+        didUpdates = False
+        for hLink in hops:
+            foundHop = False
+            for myHop in self._hops:
+                if myHop._hop_link.urn == hLink.urn:
+                    foundHop = True
+                    self.logger.debug("Found current available tags for %s", myHop)
+                    newAvail = hLink.vlan_range_request
+                    oldAvail = myHop._hop_link.vlan_range_request
+                    if newAvail == oldAvail:
+                        self.logger.debug("Availability is unchanged")
+                        continue
+
+                    revisedAvail = newAvail.intersection(oldAvail)
+                    if len(revisedAvail) > 0:
+                        self.logger.debug("Revised available range: '%s' from intersection of old '%s' and new '%s'", revisedAvail, oldAvail, newAvail)
+                        if revisedAvail != oldAvail:
+                            myHop._hop_link.vlan_range_request = revisedAvail
+                            didUpdates = True
+#                        else:
+#                            self.logger.debug("No change: All calculated request range tags still available: %s", revisedAvail)
+                    else:
+                        self.logger.debug("New available range is disjoint from old! Intersection is empty! New: %s; Old: %s", newAvail, oldAvail)
+                        # Back to the SCS
+                        failToSCS = True
+
+                    markUnavail = oldAvail - newAvail
+                    if len(markUnavail) > 0:
+                        # Each of these tags is locally unavailable. Add them to the unavail list
+                        self.logger.debug("Noting unavailable tags: '%s'", markUnavail)
+                        myHop.vlans_unavailable = myHop.vlans_unavailable.union(markUnavail)
+                    else:
+                        self.logger.debug("All calculated available tags still available: %s", revisedAvail)
+                    # Cannot break here; If same hop is used by 2 paths, we need to update the range for both
+                # End of block to check if this hop is the one from the Ad
+            # End of loop over hops on this AM
+            if not foundHop:
+                self.logger.debug("Ignoring avail for unused hop %s", hLink.urn)
         for myHop in self._hops:
             foundHop = False
             for hopLink in hops:
@@ -4580,7 +4600,8 @@ class RSpec(GENIObject):
     # Get a DOM version of this RSpec that includes any edits to link -> property elements
     def getLinkEditedDom(self):
         # find all link nodes in dom
-        dom = self.dom.cloneNode(True)
+        # Only links (edited here) and the stitching extension are copied; other elements are shared with self.dom
+        dom = cloneRSpecDomForEdit(self.dom, (defs.LINK_TAG, defs.STITCHING_TAG))
         rspecs = dom.getElementsByTagName(defs.RSPEC_TAG)
         # Gather the link nodes
         linkNodes = []
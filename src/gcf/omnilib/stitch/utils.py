@@ -27,7 +27,7 @@ from ..util import OmniError
 from . import defs
 
 import os.path
-from xml.dom.minidom import Node as XMLNode
+from xml.dom.minidom import Document, Node as XMLNode
 
 class StitchingError(OmniError):
     '''Errors due to stitching problems'''
@@ -118,3 +118,39 @@ def prependFilePrefix(filePrefix, filePath):
         return os.path.normpath(os.path.expanduser(os.path.join(fDir, cFile)))
     # Otherwise, drop any directory portion of the filePath path and stuff it all together and return
     return os.path.normpath(os.path.expanduser(os.path.join(preDir, cFile)))
+
+def cloneRSpecDomForEdit(dom, editTags):
+    '''Return a copy of the given RSpec DOM suitable for making edits, without
+    deep copying the whole document.
+    The document, the top level rspec element (with its attributes) and any
+    children of the rspec element whose local name is in editTags are copied.
+    All other children of the rspec element (nodes, typically the bulk of a
+    large request) are shared with the given DOM, and must be treated as read only:
+    neither DOM may be edited outside those copied elements, including adding,
+    replacing or removing children of the rspec element. Code that does (like
+    the manifest combiner) must work on a full copy (cloneNode(True)).'''
+    rspecNode = None
+    for child in dom.childNodes:
+        if child.nodeType == XMLNode.ELEMENT_NODE and \
+                child.localName == defs.RSPEC_TAG:
+            rspecNode = child
+            break
+    if rspecNode is None:
+        return dom.cloneNode(True)
+
+    newDom = Document()
+    for child in dom.childNodes:
+        if child is not rspecNode:
+            newDom.appendChild(child.cloneNode(True))
+            continue
+        newRoot = rspecNode.cloneNode(False)
+        # Fill the child list directly: appendChild would take shared
+        # children away from the original DOM and relink their siblings
+        for rchild in rspecNode.childNodes:
+            if rchild.nodeType == XMLNode.ELEMENT_NODE and \
+                    rchild.localName in editTags:
+                rchild = rchild.cloneNode(True)
+                rchild.parentNode = newRoot
+            newRoot.childNodes.append(rchild)
+        newDom.appendChild(newRoot)
+    return newDom
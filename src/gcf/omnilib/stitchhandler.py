@@ -33,7 +33,9 @@ import logging
 import os
 import string
 import sys
+import threading
 import time
+import traceback
 
 from .. import oscript as omni
 from .util import OmniError, naiveUTC
@@ -41,6 +43,7 @@ from .util import credparsing as credutils
 from .util.files import readFile
 from .util import handler_utils
 from .util.json_encoding import DateTimeAwareJSONEncoder
+from .util.parallel import key_is_encrypted, parallel_map
 
 from . import stitch
 from .stitch import defs
@@ -78,6 +81,19 @@ def urn_to_clean_hrn( urn ):
     hrn = handler_utils.remove_bad_characters( hrn )
     return hrn, type
 
+# Aggregate GetVersion results by AM URL: (time.time() when fetched, result).
+# Shared by all StitchingHandlers in this process. See StitchingHandler.getAMVersion
+_amVersionCache = dict()
+_amVersionCacheLock = threading.Lock()
+
+def opts_with(opts, **overrides):
+    '''Return a copy of the given optparse.Values with the given options replaced.
+    The copy is shallow: do not modify mutable option values of the copy in place.'''
+    opts_copy = copy.copy(opts)
+    for (name, value) in overrides.items():
+        setattr(opts_copy, name, value)
+    return opts_copy
+
 # The main stitching class. Holds all the state about our attempt at doing stitching.
 class StitchingHandler(object):
     '''Workhorse class to do stitching. See doStitching().'''
@@ -350,7 +366,7 @@ class StitchingHandler(object):
 #        self.checkSCSAMs()
 
         # Call SCS and then do reservations at AMs, deleting or retrying SCS as needed
-        # Note that it does this with mainStitchingLoop which recurses if needed.
+        # Note that it does this with mainStitchingLoop which retries if needed.
         # Catch Ctrl-C, deleting partial reservations.
         lvl = None
         try:
@@ -548,16 +564,35 @@ class StitchingHandler(object):
         workflow_parser = WorkflowParser(self.logger)
         retStruct = dict()
 
-        # Now actually get the manifest for each AM
-        for am in self.ams_to_process:
-            opts_copy = copy.deepcopy(self.opts)
-            opts_copy.aggregate = [(am.nick if am.nick else am.url)]
+        # Get the manifest for each AM, several at once
+        def getManifest(am):
+            # Return the manifest RSpec, its sliver expirations, and its DOM
+            # (or the exception from parsing it)
             self.logger.info("Gathering current reservations at %s...", am)
             rspec = None
             try:
-                rspec = am.listResources(opts_copy, self.slicename)
+                rspec = am.listResources(opts_with(self.opts, aggregate=[(am.nick if am.nick else am.url)]),
+                                         self.slicename)
             except StitchingError, se:
                 self.logger.debug("Failed to list current reservation: %s", se)
+            if rspec is None:
+                return (None, None, None)
+            expires = handler_utils.expires_from_rspec(rspec, self.logger)
+            try:
+                from xml.dom.minidom import parseString
+                dom = parseString(rspec)
+            except Exception, e:
+                dom = e
+            return (rspec, expires, dom)
+        manifests = self.queryAMs(self.ams_to_process, getManifest)
+
+        # Now process the manifests, in order
+        for am in self.ams_to_process:
+            (result, exc, tb) = manifests[am]
+            if exc is not None:
+                self.logger.debug(tb)
+                raise exc
+            (rspec, expires, dom) = result
             if am.api_version == 2:
                 retStruct[(am.urn,am.url)] = rspec
             else:
@@ -575,8 +610,8 @@ class StitchingHandler(object):
             if rspec is None:
                 continue
 
-            # Look for and save any sliver expiration
-            am.setSliverExpirations(handler_utils.expires_from_rspec(rspec, self.logger))
+            # Save any sliver expiration
+            am.setSliverExpirations(expires)
 
             # Fill in more data structures using this RSpec to the extent it helps
             parsedMan = self.rspecParser.parse(rspec)
@@ -629,8 +664,9 @@ class StitchingHandler(object):
 
             # Parse the manifest and fill in the manifest suggested/range values
             try:
-                from xml.dom.minidom import parseString
-                am.manifestDom = parseString(rspec)
+                if isinstance(dom, Exception):
+                    raise dom
+                am.manifestDom = dom
                 am.requestDom = am.manifestDom
 
                 # Fill in the manifest values on hops
@@ -1241,7 +1277,7 @@ class StitchingHandler(object):
                     os.unlink(statusfilename)
 
     # The main loop that does the work of getting all aggregates objects to make reservations.
-    # This method recurses on itself when an attempt fails.
+    # This method loops, doing a new attempt (stitchingAttempt) when an attempt fails.
     # - Handle timeout
     # - Call the SCS as needed
     # - pause to let AMs free resources from earlier attempts
@@ -1253,9 +1289,25 @@ class StitchingHandler(object):
     # - handle rrequests to exit early
     # - update the available range in the request based on current availability where appropriate
     # - spawn the Launcher to loop over aggregates until all aggregates have a reservation, or raise an error
-    #  - On error, delete partial reservations, and recurse for recoverable errors
+    #  - On error, delete partial reservations, and retry for recoverable errors
     def mainStitchingLoop(self, sliceurn, requestDOM, existingAggs=None):
-        # existingAggs are Aggregate objects
+        # Call the SCS and do the reservations at the AMs, calling the SCS again and
+        # retrying after each recoverable circuit failure (up to maxSCSCalls times).
+        # existingAggs are Aggregate objects from a previous attempt
+        # Return the last AM reserved at
+        while True:
+            startCPU = time.clock()
+            (lastAM, existingAggs) = self.stitchingAttempt(sliceurn, requestDOM, existingAggs)
+            self.logger.debug("Stitching attempt %d used %.2f seconds of CPU", self.scsCalls, time.clock() - startCPU)
+            if existingAggs is None:
+                return lastAM
+            # Else retry, with state saved from the Aggregates of this attempt
+
+    def stitchingAttempt(self, sliceurn, requestDOM, existingAggs=None):
+        # One attempt at stitching: call the SCS and do the reservations at the AMs.
+        # existingAggs are Aggregate objects from a previous attempt
+        # Return is a tuple: the last AM reserved at, and the Aggregate objects to
+        # retry with (None if not retrying)
 
         # Time out stitcher call if needed
         if datetime.datetime.utcnow() >= self.config['timeoutTime']:
@@ -1492,9 +1544,9 @@ class StitchingHandler(object):
         self.handleNoReservation()
 
         # Check current VLAN tag availability before doing allocations
-        ret = self.updateAvailRanges(sliceurn, requestDOM)
-        if ret is not None:
-            return ret
+        retryAggs = self.updateAvailRanges(sliceurn, requestDOM)
+        if retryAggs is not None:
+            return (None, retryAggs)
 
         # Exit if user specified --genRequest, saving more fully expanded request RSpec
         self.handleGenRequest()
@@ -1503,7 +1555,7 @@ class StitchingHandler(object):
         # Create a launcher and run it. That in turn calls the Aggregates to do the allocations,
         # where all the work happens.
         # A StitchingCircuitFailedError is a transient or recoverable error. On such errors,
-        # recurse and call this main method again, re-calling the SCS and retrying reservations at AMs.
+        # return the AMs to retry with, so the main loop re-calls the SCS and retries reservations at AMs.
         # A StitchingError is a permanent failure.
         # On any error, delete any partial reservations.
         launcher = stitch.Launcher(self.opts, self.slicename, self.ams_to_process, self.config['timeoutTime'])
@@ -1515,9 +1567,9 @@ class StitchingHandler(object):
 
         except StitchingCircuitFailedError, se:
             # A StitchingCircuitFailedError is a transient or recoverable error. On such errors,
-            # recurse and call this main method again, re-calling the SCS and retrying reservations at AMs.
+            # return the AMs to retry with, so the main loop re-calls the SCS and retries reservations at AMs.
             # On any error, delete any partial reservations.
-            # Do not recurse if we've hit the maxSCSCalls or if there's an error deleting
+            # Do not retry if we've hit the maxSCSCalls or if there's an error deleting
             # previous reservations.
             self.lastException = se
             if self.opts.noDeleteAtEnd:
@@ -1587,7 +1639,7 @@ class StitchingHandler(object):
             # FIXME: aggs.hops have loose tag: mark the hops in the request as explicitly loose
             # FIXME: Here we pass in the request to give to the SCS. I'd like this
             # to be modified (different VLAN range? Some hops marked loose?) in future
-            lastAM = self.mainStitchingLoop(sliceurn, requestDOM, aggs)
+            return (None, aggs)
         except StitchingError, se:
             # A StitchingError is a permanent failure.
             # On any error, delete any partial reservations.
@@ -1617,7 +1669,7 @@ class StitchingHandler(object):
                             self.logger.warn("You have a reservation at %s", am)
                     #raise
                 raise se
-        return lastAM
+        return (lastAM, None)
 
     def writeExpandedRequest(self, ams, requestDom):
         # Write the fully expanded/updated request RSpec to a file
@@ -1682,16 +1734,18 @@ class StitchingHandler(object):
 
     def handleGenRequest(self):
         # Exit if user specified --genRequest, saving more fully expanded request RSpec
-        # Used in mainStitchingLoop
+        # Used in stitchingAttempt
         if self.opts.genRequest:
-            msg = self.writeExpandedRequest(self.ams_to_process, self.parsedSCSRSpec.dom)
+            # The combiner edits the template in place, and request DOMs share
+            # unedited elements with the SCS expanded request, so use a full copy
+            msg = self.writeExpandedRequest(self.ams_to_process, self.parsedSCSRSpec.dom.cloneNode(True))
             self.logger.info(msg)
             raise StitchingError("Requested to only generate and save the expanded request")
         # End of block to save the expanded request and exit
 
     def handleNoReservation(self):
         # Exit if user specified --noReservation, saving expanded request RSpec
-        # Used in mainStitchingLoop
+        # Used in stitchingAttempt
         if self.opts.noReservation:
             self.logger.info("Not reserving resources")
 
@@ -1841,19 +1895,46 @@ class StitchingHandler(object):
 
         # Done adding user requested non linked AMs to list of AMs to process
 
+    def queryAMs(self, ams, query):
+        # Call query(am) for each of the given AMs, several at once.
+        # Return a dictionary by AM of (result, exception, traceback), with
+        # exception None if the query did not raise an error.
+        # Queries are done one at a time if our key needs a pass phrase.
+        def runQuery(am):
+            try:
+                return (query(am), None, None)
+            except Exception, e:
+                return (None, e, traceback.format_exc())
+
+        nthreads = min(defs.MAX_AM_QUERY_THREADS, len(ams))
+        if nthreads > 1 and key_is_encrypted(self.framework.key, self.logger):
+            self.logger.debug("Private key is encrypted: querying aggregates one at a time")
+            nthreads = 1
+        return dict(zip(ams, parallel_map(runQuery, ams, nthreads)))
+
     def updateAvailRanges(self, sliceurn, requestDOM):
         # Check current VLAN tag availability before doing allocations
-        # Loop over AMs. If I update an AM, then go to AMs that depend on it and intersect there (but don't redo avail query), and recurse.
+        # Return the Aggregates to retry with if we must call the SCS again, else None
+        # Query all AMs where it would help at once. Then loop over those AMs in order:
+        # If I update an AM, then go to AMs that depend on it and intersect there (but don't redo avail query), and on up the chain.
+        availAMs = []
         for am in self.ams_to_process:
             # If doing the avail query at this AM doesn't work or wouldn't help or we did it recently, move on
             if not am.doAvail(self.opts):
                 self.logger.debug("Not checking VLAN availability at %s", am)
                 continue
+            availAMs.append(am)
+        avails = self.queryAMs(availAMs, lambda am: am.fetchAvail(self.opts))
 
+        for am in availAMs:
             self.logger.debug("Checking current availabilty at %s", am)
             madeChange = False
             try:
-                madeChange = am.updateWithAvail(self.opts)
+                (hops, exc, tb) = avails[am]
+                if exc is not None:
+                    self.logger.debug(tb)
+                    raise exc
+                madeChange = am.applyAvail(hops)
 
                 if madeChange:
                     # Must intersect the new ranges with others in the chain
@@ -1905,10 +1986,10 @@ class StitchingHandler(object):
 
                 # construct new SCS args
                 # redo SCS call et al
-                return self.mainStitchingLoop(sliceurn, requestDOM, aggs)
+                return aggs
             # End of exception handling block
         # End of loop over AMs getting current availability
-        return None # Not an AM return so don't return it in the main block
+        return None # No need to retry
 
     def changeRequestsToAny(self):
         # Change requested VLAN tags to 'any' where appropriate
@@ -3065,94 +3146,27 @@ class StitchingHandler(object):
 
     def add_am_info(self, aggs):
         '''Add extra information about the AMs to the Aggregate objects, like the API version'''
-        options_copy = copy.deepcopy(self.opts)
-        options_copy.debug = False
-        options_copy.info = False
-        options_copy.aggregate = []
-
-        aggsc = copy.copy(aggs)
+        options_copy = opts_with(self.opts, debug=False, info=False, aggregate=[])
 
-        for agg in aggsc:
+        # First settle the URL to use at each AM
+        aggsc = []
+        urns = set(self.amURNsAddedInfo)
+        for agg in aggs:
             # Don't do an aggregate twice
-            if agg.urn in self.amURNsAddedInfo:
+            if agg.urn in urns:
                 continue
+            urns.add(agg.urn)
 #            self.logger.debug("add_am_info looking at %s", agg)
+            self.add_am_url_info(agg)
+            aggsc.append(agg)
 
-            # Note which AMs were user requested
-            if self.parsedUserRequest and agg.urn in self.parsedUserRequest.amURNs:
-                agg.userRequested = True
-            elif self.parsedUserRequest:
-                for urn2 in agg.urn_syns:
-                    if urn2 in self.parsedUserRequest.amURNs:
-                        agg.userRequested = True
-
-            # FIXME: Better way to detect this?
-            if handler_utils._extractURL(self.logger, agg.url) in defs.EXOSM_URL:
-                agg.isExoSM = True
-#                self.logger.debug("%s is the ExoSM cause URL is %s", agg, agg.url)
-
-            # EG AMs in particular have 2 URLs in some sense - ExoSM and local
-            # So note the other one, since VMs are split between the 2
-            for (amURN, amURL) in self.config['aggregate_nicknames'].values():
-                if amURN.strip() in agg.urn_syns:
-                    hadURL = handler_utils._extractURL(self.logger, agg.url)
-                    newURL = handler_utils._extractURL(self.logger, amURL)
-                    if hadURL != newURL and not hadURL in newURL and not newURL in hadURL and not newURL.strip == '':
-                        agg.alt_url = amURL.strip()
-                        break
-#                    else:
-#                        self.logger.debug("Not setting alt_url for %s. URL is %s, alt candidate was %s with URN %s", agg, hadURL, newURL, amURN)
-#                elif "exogeni" in amURN and "exogeni" in agg.urn:
-#                    self.logger.debug("Config had URN %s URL %s, but that URN didn't match our URN synonyms for %s", amURN, newURL, agg)
-
-            if "exogeni" in agg.urn and not agg.alt_url:
-#                self.logger.debug("No alt url for Orca AM %s (URL %s) with URN synonyms:", agg, agg.url)
-#                for urn in agg.urn_syns:
-#                    self.logger.debug("\t%s", urn)
-                if not agg.isExoSM:
-                    agg.alt_url = defs.EXOSM_URL
-
-            # Try to get a URL from the CH? Do we want/need this
-            # expense? This is a call to the CH....
-            # Comment this out - takes too long, not clear
-            # it is needed.
-#            if not agg.alt_url:
-#                fw_ams = dict()
-#                try:
-#                    fw_ams = self.framework.list_aggregates()
-#                    for fw_am_urn in fw_ams.keys():
-#                        if fw_am_urn and fw_am_urn.strip() in am.urn_syns and fw_ams[fw_am_urn].strip() != '':
-#                            cand_url = fw_ams[fw_am_urn]
-#                            if cand_url != am.url and not am.url in cand_url and not cand_url in am.url:
-#                                am.alt_url = cand_url
-#                                self.logger.debug("Found AM %s alternate URL from CH ListAggs: %s", am.urn, am.alt_url)
-#                                break
-#                except:
-#                    pass
-
-            # If --noExoSM then ensure this is not the ExoSM
-            if agg.isExoSM and agg.alt_url and self.opts.noExoSM:
-                self.logger.warn("%s used ExoSM URL. Changing to %s", agg, agg.alt_url)
-                amURL = agg.url
-                agg.url = agg.alt_url
-                agg.alt_url = amURL
-                agg.isExoSM = False
-
-# For using the test ION AM
-#            if 'alpha.dragon' in agg.url:
-#                agg.url =  'http://alpha.dragon.maxgigapop.net:12346/'
-
-            # Use GetVersion to determine AM type, AM API versions spoken, etc
-            # Hack: Here we hard-code using APIv2 always to call getversion, assuming that v2 is the AM default
-            # and so the URLs are v2 URLs.
-            if options_copy.warn:
-                omniargs = ['--ForceUseGetVersionCache', '-V2', '-a', agg.url, 'getversion']
-            else:
-                omniargs = ['--ForceUseGetVersionCache', '-o', '--warn', '-V2', '-a', agg.url, 'getversion']
+        # Use GetVersion to determine AM type, AM API versions spoken, etc
+        # Ask all the AMs at once
+        versions = self.queryAMs(aggsc, lambda agg: (agg.url, self.getAMVersion(agg.url, options_copy)))
 
+        for agg in aggsc:
             try:
-                self.logger.debug("Getting extra AM info from Omni for AM %s", agg)
-                (text, version) = omni.call(omniargs, options_copy)
+                version = self._getQueriedAMVersion(agg, versions, options_copy)
                 aggurl = agg.url
                 if isinstance (version, dict) and version.has_key(aggurl) and isinstance(version[aggurl], dict) \
                         and version[aggurl].has_key('value') and isinstance(version[aggurl]['value'], dict):
@@ -3345,6 +3359,7 @@ class StitchingHandler(object):
                 agg.url = agg.alt_url
                 agg.alt_url = amURL
                 agg.isExoSM = True
+                self.add_am_url_info(agg)
                 aggsc.append(agg)
                 continue
 #            else:
@@ -3363,6 +3378,102 @@ class StitchingHandler(object):
         # Done loop over aggs
     # End add_am_info
 
+    def add_am_url_info(self, agg):
+        '''Note whether the user requested this AM, whether it is the ExoSM, and any alternate URL for it'''
+        # Note which AMs were user requested
+        if self.parsedUserRequest and agg.urn in self.parsedUserRequest.amURNs:
+            agg.userRequested = True
+        elif self.parsedUserRequest:
+            for urn2 in agg.urn_syns:
+                if urn2 in self.parsedUserRequest.amURNs:
+                    agg.userRequested = True
+
+        # FIXME: Better way to detect this?
+        if handler_utils._extractURL(self.logger, agg.url) in defs.EXOSM_URL:
+            agg.isExoSM = True
+#            self.logger.debug("%s is the ExoSM cause URL is %s", agg, agg.url)
+
+        # EG AMs in particular have 2 URLs in some sense - ExoSM and local
+        # So note the other one, since VMs are split between the 2
+        altURL = handler_utils._lookupAggAltURLInNicknames(self.logger, self.config, agg.url, agg.urn_syns)
+        if altURL:
+            agg.alt_url = altURL
+#        else:
+#            self.logger.debug("Not setting alt_url for %s with URL %s: no other configured URL for its URN synonyms", agg, agg.url)
+
+        if "exogeni" in agg.urn and not agg.alt_url:
+#            self.logger.debug("No alt url for Orca AM %s (URL %s) with URN synonyms:", agg, agg.url)
+#            for urn in agg.urn_syns:
+#                self.logger.debug("\t%s", urn)
+            if not agg.isExoSM:
+                agg.alt_url = defs.EXOSM_URL
+
+        # Try to get a URL from the CH? Do we want/need this
+        # expense? This is a call to the CH....
+        # Comment this out - takes too long, not clear
+        # it is needed.
+#        if not agg.alt_url:
+#            fw_ams = dict()
+#            try:
+#                fw_ams = self.framework.list_aggregates()
+#                for fw_am_urn in fw_ams.keys():
+#                    if fw_am_urn and fw_am_urn.strip() in am.urn_syns and fw_ams[fw_am_urn].strip() != '':
+#                        cand_url = fw_ams[fw_am_urn]
+#                        if cand_url != am.url and not am.url in cand_url and not cand_url in am.url:
+#                            am.alt_url = cand_url
+#                            self.logger.debug("Found AM %s alternate URL from CH ListAggs: %s", am.urn, am.alt_url)
+#                            break
+#            except:
+#                pass
+
+        # If --noExoSM then ensure this is not the ExoSM
+        if agg.isExoSM and agg.alt_url and self.opts.noExoSM:
+            self.logger.warn("%s used ExoSM URL. Changing to %s", agg, agg.alt_url)
+            amURL = agg.url
+            agg.url = agg.alt_url
+            agg.alt_url = amURL
+            agg.isExoSM = False
+
+# For using the test ION AM
+#        if 'alpha.dragon' in agg.url:
+#            agg.url =  'http://alpha.dragon.maxgigapop.net:12346/'
+
+    def getAMVersion(self, url, options):
+        '''Return the Omni GetVersion result for the AM at the given URL.
+        Re-use a result from the last defs.AM_VERSION_CACHE_SECS seconds if we have one.'''
+        with _amVersionCacheLock:
+            cached = _amVersionCache.get(url)
+        if cached is not None and time.time() - cached[0] < defs.AM_VERSION_CACHE_SECS:
+            self.logger.debug("Using saved extra AM info for AM %s", url)
+            return cached[1]
+
+        # Hack: Here we hard-code using APIv2 always to call getversion, assuming that v2 is the AM default
+        # and so the URLs are v2 URLs.
+        if options.warn:
+            omniargs = ['--ForceUseGetVersionCache', '-V2', '-a', url, 'getversion']
+        else:
+            omniargs = ['--ForceUseGetVersionCache', '-o', '--warn', '-V2', '-a', url, 'getversion']
+
+        self.logger.debug("Getting extra AM info from Omni for AM %s", url)
+        (text, version) = omni.call(omniargs, options)
+        # Only save good results
+        if isinstance(version, dict) and isinstance(version.get(url), dict):
+            with _amVersionCacheLock:
+                _amVersionCache[url] = (time.time(), version)
+        return version
+
+    def _getQueriedAMVersion(self, agg, versions, options):
+        # Get the GetVersion result for this AM from the queryAMs results.
+        # Each result is used once: if we come back to an AM (say we switched it
+        # to the ExoSM), or its URL changed since, get the version again.
+        (result, e, tb) = versions.pop(agg, (None, None, None))
+        if e is not None:
+            self.logger.debug(tb)
+            raise e
+        if result is None or result[0] != agg.url:
+            return self.getAMVersion(agg.url, options)
+        return result[1]
+
     def dump_objects(self, rspec, aggs):
         '''Print out the hops, aggregates, and dependencies'''
         if rspec and rspec.stitching:
@@ -3477,7 +3588,9 @@ class StitchingHandler(object):
         lastDom = None
         if lastAM is None or lastAM.manifestDom is None:
             self.logger.debug("Combined manifest will start from expanded request RSpec")
-            lastDom = self.parsedSCSRSpec.dom
+            # The combiner edits the template in place, and request DOMs share
+            # unedited elements with the SCS expanded request, so use a full copy
+            lastDom = self.parsedSCSRSpec.dom.cloneNode(True)
             # Change that dom to be a manifest RSpec
             # for each attribute on the dom root node, change "request" to "manifest"
             doc_root = lastDom.documentElement
@@ -3742,47 +3855,57 @@ class StitchingHandler(object):
 
     def saveAggregateState(self, oldAggs, newAggs):
         '''Save state from old aggregates for use with new aggregates from later SCS call'''
-        for agg in newAggs:
-            for oldAgg in oldAggs:
-                # Is this oldAgg the same as the new 'agg' by URN? If so, copy from old to new
-                # FIXME: Correct to compare urn_syns too?
-                if not (agg.urn == oldAgg.urn or agg.urn in oldAgg.urn_syns or oldAgg.urn in agg.urn_syns):
-                    # Not a match
-                    continue
+        # Index the old aggregates (by position, to use the first match) by URN, and by URN and URN synonyms
+        oldByURN = dict()
+        oldByAnyURN = dict()
+        for (i, oldAgg) in enumerate(oldAggs):
+            oldByURN.setdefault(oldAgg.urn, i)
+            oldByAnyURN.setdefault(oldAgg.urn, i)
+            for urn in oldAgg.urn_syns:
+                oldByAnyURN.setdefault(urn, i)
 
-                for hop in agg.hops:
-                    for oldHop in oldAgg.hops:
-                        if hop.urn == oldHop.urn:
-                            if oldHop.excludeFromSCS:
-                                self.logger.warn("%s had been marked to exclude from SCS, but we got it again", oldHop)
-                            hop.vlans_unavailable = hop.vlans_unavailable.union(oldHop.vlans_unavailable)
-                            break
-                # End of loop over hops
+        for agg in newAggs:
+            # Find the first oldAgg that is the same as the new 'agg' by URN. If any, copy from old to new
+            # FIXME: Correct to compare urn_syns too?
+            matches = [oldByAnyURN.get(agg.urn)] + [oldByURN.get(urn) for urn in agg.urn_syns]
+            matches = [i for i in matches if i is not None]
+            if not matches:
+                continue
+            oldAgg = oldAggs[min(matches)]
+
+            oldHops = dict()
+            for oldHop in oldAgg.hops:
+                oldHops.setdefault(oldHop.urn, oldHop)
+            for hop in agg.hops:
+                oldHop = oldHops.get(hop.urn)
+                if oldHop is not None:
+                    if oldHop.excludeFromSCS:
+                        self.logger.warn("%s had been marked to exclude from SCS, but we got it again", oldHop)
+                    hop.vlans_unavailable = hop.vlans_unavailable.union(oldHop.vlans_unavailable)
+            # End of loop over hops
 
-                # FIXME: agg.allocateTries?
-                agg.dcn = oldAgg.dcn
-                agg.isOESS = oldAgg.isOESS
-                agg.isFOAM = oldAgg.isFOAM
-                agg.isGRAM = oldAgg.isGRAM
-                agg.isPG = oldAgg.isPG
-                agg.isEG = oldAgg.isEG
-                agg.isExoSM = oldAgg.isExoSM
-                agg.userRequested = oldAgg.userRequested
-                agg.alt_url = oldAgg.alt_url
-                agg.api_version = oldAgg.api_version
-                agg.nick = oldAgg.nick
-                agg.doesSchemaV1 = oldAgg.doesSchemaV1
-                agg.doesSchemaV2 = oldAgg.doesSchemaV2
-                agg.slicecred = oldAgg.slicecred
-
-                # Since we're restarting, clear out any old error, so don't do this copy
-                # agg.lastError = oldAgg.lastError
-
-                # FIXME: correct?
-                agg.url = oldAgg.url
-                agg.urn_syns = copy.deepcopy(oldAgg.urn_syns)
-                break # out of loop over oldAggs, cause we found the new 'agg'
-            # Loop over oldAggs
+            # FIXME: agg.allocateTries?
+            agg.dcn = oldAgg.dcn
+            agg.isOESS = oldAgg.isOESS
+            agg.isFOAM = oldAgg.isFOAM
+            agg.isGRAM = oldAgg.isGRAM
+            agg.isPG = oldAgg.isPG
+            agg.isEG = oldAgg.isEG
+            agg.isExoSM = oldAgg.isExoSM
+            agg.userRequested = oldAgg.userRequested
+            agg.alt_url = oldAgg.alt_url
+            agg.api_version = oldAgg.api_version
+            agg.nick = oldAgg.nick
+            agg.doesSchemaV1 = oldAgg.doesSchemaV1
+            agg.doesSchemaV2 = oldAgg.doesSchemaV2
+            agg.slicecred = oldAgg.slicecred
+
+            # Since we're restarting, clear out any old error, so don't do this copy
+            # agg.lastError = oldAgg.lastError
+
+            # FIXME: correct?
+            agg.url = oldAgg.url
+            agg.urn_syns = copy.deepcopy(oldAgg.urn_syns)
         # Loop over newAggs
     # End of saveAggregateState
 
@@ -3976,12 +4099,18 @@ class StitchingHandler(object):
                 retMsg += msg
 
         if len(aggsNoRes) > 0:
-            # For the DOM to start from, start with one I've edited if it exists
-            dom = self.parsedSCSRSpec.dom
+            # For the DOM to start from, start with one I've edited if it exists.
+            # The combiner edits the template in place, and request DOMs share
+            # unedited elements with the SCS expanded request, so use a full copy
+            # (giving the AM that copy as its request, so the combiner skips it)
+            dom = None
             for am in aggsNoRes:
                 if am.requestDom:
+                    am.requestDom = am.requestDom.cloneNode(True)
                     dom = am.requestDom
                     break
+            if dom is None:
+                dom = self.parsedSCSRSpec.dom.cloneNode(True)
             # Generate / save the expanded request using the full list of AMs. Note this means
             # we'll include things that are technically for manifests only.
             # To avoid that, call with aggsNoRes instead.
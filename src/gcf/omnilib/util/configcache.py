@@ -0,0 +1,150 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''
+Compiled snapshots of parsed Omni configuration files (the omni_config
+and the agg_nick_cache).
+
+Omni parses these files on every invocation. For scripts that call
+Omni many times, read_config_file instead loads the items of every
+section of a file from a snapshot saved in a single (marshalled) cache
+file, re-parsing the file only if its modification time or size changed.
+'''
+
+from __future__ import absolute_import
+
+import ConfigParser
+import marshal
+import os
+import sys
+import tempfile
+
+# Bump this if the snapshot format changes
+SNAPSHOT_VERSION = 1
+
+# Contents of cache files already read, by cache file name
+_loaded_caches = dict()
+
+class ConfigSnapshot(object):
+    '''Read-only stand in for a ConfigParser.RawConfigParser that has read a file.
+    Supports the query methods Omni uses: sections, has_section, items.'''
+
+    def __init__(self, sections):
+        # sections is a sequence of (section name, sequence of (key, value)),
+        # with the items as returned by RawConfigParser.items
+        self._sectionNames = [name for (name, items) in sections]
+        self._sections = dict(sections)
+
+    def sections(self):
+        return list(self._sectionNames)
+
+    def has_section(self, section):
+        return self._sections.has_key(section)
+
+    def items(self, section):
+        if not self._sections.has_key(section):
+            raise ConfigParser.NoSectionError(section)
+        return list(self._sections[section])
+
+def _file_key(filename):
+    '''Return the (modification time, size) of the given file'''
+    st = os.stat(filename)
+    return (st.st_mtime, st.st_size)
+
+def _load_cache(cachefile):
+    '''Return the dict of snapshots by file name saved in cachefile, or an empty dict'''
+    if _loaded_caches.has_key(cachefile):
+        return _loaded_caches[cachefile]
+    snapshots = dict()
+    try:
+        with open(cachefile, 'rb') as f:
+            cache = marshal.load(f)
+        # Marshal format varies by Python version
+        if cache.get('version') == (SNAPSHOT_VERSION, tuple(sys.version_info[:2])):
+            snapshots = cache['files']
+    except Exception:
+        # Missing or unreadable cache: start over
+        pass
+    _loaded_caches[cachefile] = snapshots
+    return snapshots
+
+def _save_cache(cachefile, snapshots, logger):
+    '''Save the given snapshots to cachefile, replacing the file atomically'''
+    tmpname = None
+    try:
+        directory = os.path.dirname(cachefile)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        # mkstemp creates the file readable only by this user
+        handle, tmpname = tempfile.mkstemp(dir=directory or None)
+        with os.fdopen(handle, 'wb') as f:
+            marshal.dump({'version': (SNAPSHOT_VERSION, tuple(sys.version_info[:2])),
+                          'files': snapshots}, f)
+        if os.name == 'nt' and os.path.exists(cachefile):
+            # On Windows, rename doesn't replace an existing file
+            os.unlink(cachefile)
+        os.rename(tmpname, cachefile)
+        tmpname = None
+    except Exception, e:
+        logger.debug("Failed to save config cache '%s': %s", cachefile, e)
+    finally:
+        if tmpname:
+            try:
+                os.unlink(tmpname)
+            except:
+                pass
+
+def read_config_file(filename, cachefile, logger):
+    '''Return a parsed version of the given config file: a
+    ConfigSnapshot if cachefile has a snapshot of the current contents
+    of the file, else a ConfigParser.RawConfigParser (and save a
+    snapshot in cachefile for next time). If cachefile is None, just
+    parse the file.
+    Raises ConfigParser.Error if the file cannot be parsed.'''
+    if cachefile is None:
+        confparser = ConfigParser.RawConfigParser()
+        confparser.read(filename)
+        return confparser
+
+    filename = os.path.abspath(filename)
+    try:
+        (mtime, size) = _file_key(filename)
+    except OSError:
+        mtime = None
+        size = None
+    snapshots = _load_cache(cachefile)
+    snapshot = snapshots.get(filename)
+    if mtime is not None and snapshot is not None and \
+            snapshot['mtime'] == mtime and snapshot['size'] == size:
+        logger.debug("Using cached parse of config file '%s'", filename)
+        return ConfigSnapshot(snapshot['sections'])
+
+    confparser = ConfigParser.RawConfigParser()
+    confparser.read(filename)
+
+    if mtime is not None:
+        sections = []
+        for section in confparser.sections():
+            sections.append((section, tuple(confparser.items(section))))
+        snapshots[filename] = {'mtime': mtime, 'size': size, 'sections': sections}
+        _save_cache(cachefile, snapshots, logger)
+    return confparser
@@ -0,0 +1,189 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''
+On-disk cache of user and slice credentials retrieved from a
+clearinghouse.
+
+Each credential is saved (as its AM API v3 style struct) in its own
+file, named by a hash of the clearinghouse URL, the user URN, and the
+credential target (user or slice) URN. The credential expiration is
+parsed once when saving, and a cached credential is only returned
+while it has some time left. Files are readable only by the user, and
+a lock file serializes access from concurrent Omni processes.
+'''
+
+from __future__ import absolute_import
+
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+
+import dateutil.parser
+
+from . import credparsing as credutils
+from .dates import naiveUTC
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no locking
+    fcntl = None
+
+# Bump this if the format of the cache files changes
+CRED_CACHE_VERSION = 1
+
+# Do not use cached credentials that expire within this time
+MIN_REMAINING_LIFETIME = datetime.timedelta(minutes=10)
+
+# Do not use cached credentials older than this:
+# slice membership may have changed elsewhere
+MAX_AGE = datetime.timedelta(hours=12)
+
+class CredentialCache(object):
+    '''Cache of credentials in files in a directory, keyed by
+    (clearinghouse URL, user URN, target URN).'''
+
+    def __init__(self, cachedir, logger):
+        self.cachedir = cachedir
+        self.logger = logger
+
+    def _filename(self, framework_url, user_urn, target_urn):
+        key = "\n".join([str(framework_url), str(user_urn), str(target_urn)])
+        return os.path.join(self.cachedir, hashlib.sha1(key).hexdigest() + ".json")
+
+    def _lock(self):
+        '''Return an open file holding an exclusive lock on the cache, or None'''
+        if fcntl is None:
+            return None
+        try:
+            if not os.path.exists(self.cachedir):
+                os.makedirs(self.cachedir, 0700)
+            fd = os.open(os.path.join(self.cachedir, ".lock"), os.O_RDWR | os.O_CREAT, 0600)
+            lockf = os.fdopen(fd, 'r+')
+            fcntl.flock(lockf, fcntl.LOCK_EX)
+            return lockf
+        except Exception, e:
+            self.logger.debug("Failed to lock credential cache %s: %s", self.cachedir, e)
+            return None
+
+    def _unlock(self, lockf):
+        if lockf is not None:
+            # Closing the file releases the lock
+            lockf.close()
+
+    def get(self, framework_url, user_urn, target_urn):
+        '''Return the cached credential struct for the given target, or None
+        if there is none or it is expired or too old.
+        May raise an exception on a corrupt entry.'''
+        fname = self._filename(framework_url, user_urn, target_urn)
+        if not os.path.exists(fname):
+            return None
+        lockf = self._lock()
+        try:
+            try:
+                with open(fname, 'r') as f:
+                    entry = json.load(f)
+            except Exception, e:
+                self.logger.debug("Failed to read cached credential %s: %s", fname, e)
+                return None
+        finally:
+            self._unlock(lockf)
+
+        if not isinstance(entry, dict) or entry.get('version') != CRED_CACHE_VERSION or \
+                entry.get('framework_url') != framework_url or entry.get('user_urn') != user_urn or \
+                entry.get('target_urn') != target_urn:
+            return None
+        try:
+            expires = dateutil.parser.parse(entry['expires'])
+            fetched = dateutil.parser.parse(entry['fetched'])
+        except Exception, e:
+            self.logger.debug("Malformed cached credential %s: %s", fname, e)
+            return None
+        now = datetime.datetime.utcnow()
+        if now - fetched > MAX_AGE:
+            self.logger.debug("Cached credential for %s is from %s UTC: not using it", target_urn, fetched)
+            return None
+        # JSON gives us unicode strings; credentials are expected to be str
+        cred = dict([(str(k), str(v)) for (k, v) in entry['cred'].items()])
+        # Never use the credential past its own expiration, whatever the entry says
+        expires = min(expires, naiveUTC(credutils.get_cred_exp(self.logger, cred.get('geni_value'))))
+        if expires - now < MIN_REMAINING_LIFETIME:
+            self.logger.debug("Cached credential for %s expires %s UTC: not using it", target_urn, expires)
+            return None
+        self.logger.debug("Using cached credential for %s (expires %s UTC)", target_urn, expires)
+        return cred
+
+    def put(self, framework_url, user_urn, target_urn, cred):
+        '''Save the given credential struct for the given target'''
+        if not isinstance(cred, dict) or not cred.has_key('geni_value'):
+            return
+        expires = naiveUTC(credutils.get_cred_exp(self.logger, cred['geni_value']))
+        if expires - datetime.datetime.utcnow() < MIN_REMAINING_LIFETIME:
+            return
+        entry = {'version': CRED_CACHE_VERSION,
+                 'framework_url': framework_url,
+                 'user_urn': user_urn,
+                 'target_urn': target_urn,
+                 'expires': expires.isoformat(),
+                 'fetched': datetime.datetime.utcnow().isoformat(),
+                 'cred': cred}
+        fname = self._filename(framework_url, user_urn, target_urn)
+        tmpname = None
+        lockf = self._lock()
+        try:
+            if not os.path.exists(self.cachedir):
+                os.makedirs(self.cachedir, 0700)
+            # mkstemp creates the file readable only by this user
+            handle, tmpname = tempfile.mkstemp(dir=self.cachedir)
+            with os.fdopen(handle, 'w') as f:
+                json.dump(entry, f)
+            if os.name == 'nt' and os.path.exists(fname):
+                # On Windows, rename doesn't replace an existing file
+                os.unlink(fname)
+            os.rename(tmpname, fname)
+            tmpname = None
+        except Exception, e:
+            self.logger.debug("Failed to cache credential for %s in %s: %s", target_urn, self.cachedir, e)
+        finally:
+            if tmpname:
+                try:
+                    os.unlink(tmpname)
+                except:
+                    pass
+            self._unlock(lockf)
+
+    def invalidate(self, framework_url, user_urn, target_urn):
+        '''Remove any cached credential for the given target'''
+        fname = self._filename(framework_url, user_urn, target_urn)
+        if not os.path.exists(fname):
+            return
+        lockf = self._lock()
+        try:
+            os.unlink(fname)
+            self.logger.debug("Removed cached credential for %s", target_urn)
+        except OSError, e:
+            self.logger.debug("Failed to remove cached credential %s: %s", fname, e)
+        finally:
+            self._unlock(lockf)
@@ -31,14 +31,108 @@ from __future__ import absolute_import
 import datetime
 import dateutil.parser
 import logging
+import threading
 import traceback
-import xml.dom.minidom as md
+import xml.parsers.expat
 
 from ...sfa.trust.credential import Credential
 from ...sfa.trust.abac_credential import ABACCredential
 from ...sfa.trust.credential_factory import CredentialFactory
 from ...geni.util.tz_util import tzd
 
+# Max number of credentials whose parsed fields to remember
+CRED_FIELDS_CACHE_SIZE = 100
+
+# credential XML string => dict from _parse_cred_fields
+_cred_fields = dict()
+_cred_fields_lock = threading.Lock()
+
+def _parse_cred_fields(credString):
+    '''Parse the given credential XML in one streaming pass. See get_cred_fields.'''
+    # Element names whose text to get from the credential
+    textFields = ('owner_urn', 'target_urn', 'expires')
+    fields = dict(signed=False, owner_urn=None, target_urn=None, expires=None,
+                  has_target_gid=False, privileges=[], types=[])
+    # Stack of [element name, text so far, saw a child element]
+    stack = []
+    # Depth in the stack of the credential we are reading, or None
+    state = dict(credDepth=None, done=False)
+    # Text fields whose first element we have seen
+    seen = set()
+
+    def start(name, attrs):
+        if stack:
+            stack[-1][2] = True
+        stack.append([name, [], False])
+        if name == 'signed-credential':
+            fields['signed'] = True
+        elif name == 'credential' and state['credDepth'] is None and not state['done']:
+            # The first credential, which is the one in the signed-credential
+            # (any others are parent credentials within it)
+            state['credDepth'] = len(stack)
+        elif name == 'target_gid' and state['credDepth'] is not None:
+            fields['has_target_gid'] = True
+
+    def chars(data):
+        # Only the text before any child element, as minidom childNodes[0]
+        if stack and not stack[-1][2]:
+            stack[-1][1].append(data)
+
+    def end(name):
+        (ignore, textParts, ignore2) = stack.pop()
+        text = "".join(textParts)
+        if text == "":
+            text = None
+        if name == 'type':
+            fields['types'].append(text)
+        credDepth = state['credDepth']
+        if credDepth is None:
+            return
+        if len(stack) + 1 == credDepth:
+            # End of the credential
+            state['credDepth'] = None
+            state['done'] = True
+        elif name in textFields and name not in seen:
+            seen.add(name)
+            fields[name] = text
+        elif name == 'name' and len(stack) == credDepth + 2 and \
+                stack[-1][0] == 'privilege' and stack[-2][0] == 'privileges' and \
+                text is not None:
+            # A privilege of this credential, not of a parent credential
+            fields['privileges'].append(text.strip())
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = chars
+    parser.Parse(credString, True)
+    return fields
+
+def get_cred_fields(credString):
+    '''Return the fields of the given credential XML string, parsing it
+    in one streaming pass (without building a DOM) the first time.
+    Return is a dict (do not modify it) of fields of the first credential
+    (in the first signed-credential if any):
+     signed: True if there is a signed-credential element
+     owner_urn, target_urn, expires: the text of those elements, or None
+     has_target_gid: True if the credential has a target_gid element
+     privileges: list of the credential's privilege names
+     types: list of the text of all type elements in the document,
+       including those of any parent credentials
+    Raises an exception if the XML cannot be parsed.'''
+    if isinstance(credString, unicode):
+        credString = credString.encode('utf-8')
+    with _cred_fields_lock:
+        fields = _cred_fields.get(credString)
+    if fields is not None:
+        return fields
+    fields = _parse_cred_fields(credString)
+    with _cred_fields_lock:
+        if len(_cred_fields) >= CRED_FIELDS_CACHE_SIZE:
+            _cred_fields.clear()
+        _cred_fields[credString] = fields
+    return fields
+
 # FIXME: Doesn't distinguish v2 vs v3 yet
 def is_valid_v3(logger, credString):
     '''Is the given credential a valid geni_sfa style v3 credential?'''
@@ -80,21 +174,14 @@ def is_valid_v3(logger, credString):
         return False
 
     try:
-        # Note this is relatively memory intensive
-        doc = md.parseString(credString)
-        signed_cred = doc.getElementsByTagName("signed-credential")
+        fields = get_cred_fields(credString)
 
         # Is this a signed-cred or just a cred?
-        if len(signed_cred) > 0:
-            cred = signed_cred[0].getElementsByTagName("credential")[0]
-        else:
+        if not fields['signed']:
             logger.warn("No signed-credential element found")
             return False
 
-        targetnode = cred.getElementsByTagName("target_urn")[0]
-        if len(targetnode.childNodes) > 0:
-            urn = str(targetnode.childNodes[0].nodeValue)
-        else:
+        if fields['target_urn'] is None:
             logger.warn("No target_urn found")
             return False
     except Exception, exc:
@@ -110,11 +197,10 @@ def get_cred_type(cred):
     is_abac = False
     is_sfa = False
     try:
-        doc = md.parseString(cred)
-        type_elts = doc.getElementsByTagName('type')
-        if len(type_elts) == 1 and type_elts[0].childNodes[0].nodeValue.strip() == 'abac':
+        types = get_cred_fields(cred)['types']
+        if len(types) == 1 and types[0].strip() == 'abac':
             is_abac = True
-        elif len(type_elts) == 1 and type_elts[0].childNodes[0].nodeValue.strip() == 'privilege':
+        elif len(types) == 1 and types[0].strip() == 'privilege':
             is_sfa = True
     except Exception, e:
         level = logging.INFO
@@ -174,18 +260,9 @@ def get_cred_target_urn(logger, cred):
         return urn
 
     try:
-        doc = md.parseString(credString)
-        signed_cred = doc.getElementsByTagName("signed-credential")
-
-        # Is this a signed-cred or just a cred?
-        if len(signed_cred) > 0:
-            cred = signed_cred[0].getElementsByTagName("credential")[0]
-        else:
-            cred = doc.getElementsByTagName("credential")[0]
-
-        targetnode = cred.getElementsByTagName("target_urn")[0]
-        if len(targetnode.childNodes) > 0:
-            urn = str(targetnode.childNodes[0].nodeValue)
+        target_urn = get_cred_fields(credString)['target_urn']
+        if target_urn is not None:
+            urn = str(target_urn)
         else:
             if logger is None:
                 level = logging.INFO
@@ -227,18 +304,9 @@ def get_cred_owner_urn(logger, cred):
         return urn
 
     try:
-        doc = md.parseString(credString)
-        signed_cred = doc.getElementsByTagName("signed-credential")
-
-        # Is this a signed-cred or just a cred?
-        if len(signed_cred) > 0:
-            cred = signed_cred[0].getElementsByTagName("credential")[0]
-        else:
-            cred = doc.getElementsByTagName("credential")[0]
-
-        ownernode = cred.getElementsByTagName("owner_urn")[0]
-        if len(ownernode.childNodes) > 0:
-            urn = str(ownernode.childNodes[0].nodeValue)
+        owner_urn = get_cred_fields(credString)['owner_urn']
+        if owner_urn is not None:
+            urn = str(owner_urn)
         else:
             if logger is None:
                 level = logging.INFO
@@ -284,17 +352,9 @@ def get_cred_exp(logger, cred):
         return credexp
 
     try:
-        doc = md.parseString(credString)
-        signed_cred = doc.getElementsByTagName("signed-credential")
-
-        # Is this a signed-cred or just a cred?
-        if len(signed_cred) > 0:
-            cred = signed_cred[0].getElementsByTagName("credential")[0]
-        else:
-            cred = doc.getElementsByTagName("credential")[0]
-        expirnode = cred.getElementsByTagName("expires")[0]
-        if len(expirnode.childNodes) > 0:
-            credexp = dateutil.parser.parse(expirnode.childNodes[0].nodeValue, tzinfos=tzd)
+        expires = get_cred_fields(credString)['expires']
+        if expires is not None:
+            credexp = dateutil.parser.parse(expires, tzinfos=tzd)
     except Exception, exc:
         if logger is None:
             level = logging.INFO
@@ -323,17 +383,13 @@ def is_cred_xml(cred):
         return False
 
     try:
-        doc = md.parseString(cred)
-        signed_cred = doc.getElementsByTagName("signed-credential")
+        fields = get_cred_fields(cred)
 
         # Is this a signed-cred or just a cred?
-        if len(signed_cred) > 0:
-            credEle = signed_cred[0].getElementsByTagName("credential")[0]
-        else:
+        if not fields['signed']:
             return False
 
-        targetnode = credEle.getElementsByTagName("target_gid")[0]
-        if not targetnode:
+        if not fields['has_target_gid']:
             return False
     except Exception, exc:
         return False
@@ -24,23 +24,23 @@
 
 from __future__ import absolute_import
 
+import bisect
 import datetime
-import dateutil
 import json
 import logging
 import os
 import re
 import string
+import xml.parsers.expat
 
 from . import json_encoding
-from . import credparsing as credutils
-from .dossl import _do_ssl
 from .dates import naiveUTC
 from .files import *
-from ...geni.util import rspec_util
-from ...geni.util.tz_util import tzd
-from ...sfa.trust.gid import GID
-from ...sfa.trust.credential import Credential
+
+# The credential, SSL and RSpec modules (and M2Crypto, lxml and the rest
+# of gcf.geni that they bring in) are imported by the functions that use
+# them, so that commands like nicknames that only need the nickname
+# lookups here start quickly.
 
 def _derefAggNick(handler, aggregateNickname):
     """Check if the given aggregate string is a nickname defined
@@ -120,118 +120,153 @@ def _isBetterNick(retNick, nick, logger=None):
     return False
 
 # Lookup aggregate nickname by aggregate_urn or aggregate_url
-def _lookupAggNick(handler, aggregate_urn_or_url):
-    retNick = None
-    for nick, (urn, url) in handler.config['aggregate_nicknames'].items():
-        # Case 1
-        if aggregate_urn_or_url == urn or aggregate_urn_or_url == url:
-#            handler.logger.debug("For urn/url %s found match: %s=%s,%s", aggregate_urn_or_url, nick, urn, url)
-            if _isBetterNick(retNick, nick, handler.logger):
-                retNick = nick
-    if retNick is not None:
-        return retNick
-    for nick, (urn, url) in handler.config['aggregate_nicknames'].items():
-        # Case 2
-        if aggregate_urn_or_url.startswith(url):
-#            handler.logger.debug("Queried %s startswith url for nick %s", aggregate_urn_or_url, nick)
-            if _isBetterNick(retNick, nick, handler.logger):
+class _AggNickIndex(object):
+    """Index over config['aggregate_nicknames'] for the lookups below.
+    Each table maps a key to positions in the nicknames iteration order,
+    so folding _isBetterNick over the matches in that order gives the
+    same answer as scanning every nickname. Built by _indexAggNicks
+    when the nicknames are loaded; get one with _getAggNickIndex."""
+
+    def __init__(self, nicknames):
+        self.nicknames = nicknames
+        # (nick, urn, url) in iteration order
+        self.entries = []
+        self.hasURN = []
+        self.byURN = {}
+        self.byStrippedURN = {}
+        self.byURL = {}
+        self.byStrippedURL = {}
+        self.byExtractedURL = {}
+        self.extractedURLs = []
+        extracted = []
+        for pos, (nick, (urn, url)) in enumerate(nicknames.items()):
+            self.entries.append((nick, urn, url))
+            self.hasURN.append(urn.strip() != '')
+            self.byURN.setdefault(urn, []).append(pos)
+            self.byStrippedURN.setdefault(urn.strip(), []).append(pos)
+            self.byURL.setdefault(url, []).append(pos)
+            self.byStrippedURL.setdefault(url.strip(), []).append(pos)
+            eurl = _extractURL(None, url)
+            self.byExtractedURL.setdefault(eurl, []).append(pos)
+            self.extractedURLs.append(eurl)
+            extracted.append((eurl, pos))
+        # Distinct key lengths, to find the keys that are a prefix of a query
+        self.urlLengths = sorted(set([len(url) for url in self.byURL.keys()]))
+        self.strippedURLLengths = sorted(set([len(url) for url in self.byStrippedURL.keys()]))
+        # Sorted extracted URLs, to find those that start with a query
+        extracted.sort()
+        self.sortedExtractedURLs = [eurl for (eurl, pos) in extracted]
+        self.sortedExtractedPositions = [pos for (eurl, pos) in extracted]
+
+    def _prefixesOf(self, table, lengths, value):
+        positions = []
+        for length in lengths:
+            if length > len(value):
+                break
+            positions.extend(table.get(value[:length], []))
+        return positions
+
+    def urlPrefixesOf(self, value):
+        """Positions of nicknames whose URL is a prefix of value"""
+        return self._prefixesOf(self.byURL, self.urlLengths, value)
+
+    def strippedURLPrefixesOf(self, value):
+        """Positions of nicknames whose stripped URL is a prefix of value"""
+        return self._prefixesOf(self.byStrippedURL, self.strippedURLLengths, value)
+
+    def extractedURLsStartingWith(self, value):
+        """Positions of nicknames whose extracted URL starts with value"""
+        positions = []
+        i = bisect.bisect_left(self.sortedExtractedURLs, value)
+        while i < len(self.sortedExtractedURLs) and self.sortedExtractedURLs[i].startswith(value):
+            positions.append(self.sortedExtractedPositions[i])
+            i += 1
+        return positions
+
+    def urnsContaining(self, value):
+        """Positions of nicknames whose URN contains value"""
+        return [pos for pos, (nick, urn, url) in enumerate(self.entries) if value in urn]
+
+    def urlsContaining(self, value):
+        """Positions of nicknames whose URL contains value"""
+        return [pos for pos, (nick, urn, url) in enumerate(self.entries) if value in url]
+
+    def bestMatch(self, positions, logger=None, needURN=False):
+        """Return the position of the best nickname (per _isBetterNick)
+        among the given positions, or None."""
+        retNick = None
+        retPos = None
+        for pos in sorted(set(positions)):
+            if needURN and not self.hasURN[pos]:
+                continue
+            nick = self.entries[pos][0]
+            if _isBetterNick(retNick, nick, logger):
                 retNick = nick
-    if retNick is not None:
-        return retNick
+                retPos = pos
+        return retPos
+
+def _indexAggNicks(config):
+    """(Re)build the _AggNickIndex for config['aggregate_nicknames'].
+    Call this whenever the nicknames are loaded or changed."""
+    index = _AggNickIndex(config['aggregate_nicknames'])
+    config['aggregate_nicknames_index'] = index
+    return index
+
+def _getAggNickIndex(config):
+    """Get the _AggNickIndex for config['aggregate_nicknames'],
+    building it if the config was not loaded by load_aggregate_nicknames
+    or its nicknames dictionary has since been replaced."""
+    index = config.get('aggregate_nicknames_index')
+    if index is None or index.nicknames is not config['aggregate_nicknames']:
+        index = _indexAggNicks(config)
+    return index
+
+def _lookupAggNick(handler, aggregate_urn_or_url):
+    index = _getAggNickIndex(handler.config)
+    # Case 1
+    pos = index.bestMatch(index.byURN.get(aggregate_urn_or_url, []) +
+                          index.byURL.get(aggregate_urn_or_url, []), handler.logger)
+    if pos is not None:
+        return index.entries[pos][0]
+    # Case 2: given URN/URL starts with the nickname URL
+    pos = index.bestMatch(index.urlPrefixesOf(aggregate_urn_or_url), handler.logger)
+    if pos is not None:
+        return index.entries[pos][0]
     aggregate_urn_or_url = _extractURL(handler.logger, aggregate_urn_or_url)
-    for nick, (urn, url) in handler.config['aggregate_nicknames'].items():
-        # Case 3
-        if _extractURL(handler.logger,url) == aggregate_urn_or_url:
-#            handler.logger.debug("Queried & trimmed %s is end of url %s for nick %s", aggregate_urn_or_url, url, nick)
-            if _isBetterNick(retNick, nick, handler.logger):
-                retNick = nick
-    if retNick is not None:
-        return retNick
-    for nick, (urn, url) in handler.config['aggregate_nicknames'].items():
-        # Case 4
-        if aggregate_urn_or_url in urn:
-#            handler.logger.debug("Trimmed %s is in urn for %s=%s,%s", aggregate_urn_or_url, nick, urn, url)
-            if _isBetterNick(retNick, nick, handler.logger):
-                retNick = nick
-        elif _extractURL(handler.logger, url).startswith(aggregate_urn_or_url):
-            # Case 5
-#            handler.logger.debug("Trimmed %s is in url for %s=%s,%s", aggregate_urn_or_url, nick, urn, url)
-            if _isBetterNick(retNick, nick, handler.logger):
-                retNick = nick
-#    if retNick is None:
-#        handler.logger.debug("Found no match for %s", aggregate_urn_or_url)
-#    else:
-#        handler.logger.debug("Returning %s", retNick)
-    return retNick
+    # Case 3: trimmed URLs match
+    pos = index.bestMatch(index.byExtractedURL.get(aggregate_urn_or_url, []), handler.logger)
+    if pos is not None:
+        return index.entries[pos][0]
+    # Case 4: trimmed value is in the URN, or
+    # Case 5: trimmed nickname URL starts with trimmed value
+    pos = index.bestMatch(index.urnsContaining(aggregate_urn_or_url) +
+                          index.extractedURLsStartingWith(aggregate_urn_or_url), handler.logger)
+    if pos is not None:
+        return index.entries[pos][0]
+#    handler.logger.debug("Found no match for %s", aggregate_urn_or_url)
+    return None
 
 def _lookupAggURNFromURLInNicknames(logger, config, agg_url):
     urn = ""
-    retNick = None
     # Take exact match else take row where agg_url startswith url in cache else
     # take row where extractURL exact match extractURL in cache
     nagg_url = _extractURL(logger, agg_url)
     if agg_url:
-        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
-            if agg_url.strip() == amURL.strip() and amURN.strip() != '':
-                if _isBetterNick(retNick, nick, logger):
-                    urn = amURN.strip()
-#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches URL %s, nick %s T1)", agg_url, urn, amURL, nick)
-                    retNick = nick
-        if retNick is not None:
-            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T1)", agg_url, urn, retNick)
-            return urn
-
-        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
-            if agg_url.strip().startswith(amURL.strip()) and amURN.strip() != '':
-                if _isBetterNick(retNick, nick, logger):
-                    urn = amURN.strip()
-#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches %s T2)", agg_url, urn, amURL)
-                    retNick = nick
-        if retNick is not None:
-            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T2)", agg_url, urn, retNick)
-            return urn
-
-        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
-            if nagg_url == amURL.strip() and amURN.strip() != '':
-                if _isBetterNick(retNick, nick, logger):
-                    urn = amURN.strip()
-#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches %s T3)", agg_url, urn, amURL)
-                    retNick = nick
-        if retNick is not None:
-            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T3)", agg_url, urn, retNick)
-            return urn
-
-        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
-            extr_nick_url = _extractURL(logger, amURL)
-            if nagg_url == extr_nick_url and amURN.strip() != '':
-                if _isBetterNick(retNick, nick, logger):
-                    urn = amURN.strip()
-#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches %s T4)", agg_url, urn, amURL)
-                    retNick = nick
-        if retNick is not None:
-            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T4)", agg_url, urn, retNick)
-            return urn
-
-        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
-            extr_nick_url = _extractURL(logger, amURL)
-            if extr_nick_url.startswith(nagg_url) and amURN.strip() != '':
-                if _isBetterNick(retNick, nick, logger):
-                    urn = amURN.strip()
-#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches %s T5)", agg_url, urn, amURL)
-                    retNick = nick
-        if retNick is not None:
-            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T5)", agg_url, urn, retNick)
-            return urn
-
-        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
-            if nagg_url in amURL and amURN.strip() != '':
-                if _isBetterNick(retNick, nick, logger):
-                    urn = amURN.strip()
-#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches %s T6)", agg_url, urn, amURL)
-                    retNick = nick
-        if retNick is not None:
-            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T6)", agg_url, urn, retNick)
-            return urn
+        index = _getAggNickIndex(config)
+        sagg_url = agg_url.strip()
+        tests = (('T1', index.byStrippedURL.get(sagg_url, [])),
+                 ('T2', index.strippedURLPrefixesOf(sagg_url)),
+                 ('T3', index.byStrippedURL.get(nagg_url, [])),
+                 ('T4', index.byExtractedURL.get(nagg_url, [])),
+                 ('T5', index.extractedURLsStartingWith(nagg_url)),
+                 ('T6', index.urlsContaining(nagg_url)))
+        for (test, positions) in tests:
+            pos = index.bestMatch(positions, logger, needURN=True)
+            if pos is not None:
+                (nick, amURN, amURL) = index.entries[pos]
+                urn = amURN.strip()
+                logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s %s)", agg_url, urn, nick, test)
+                return urn
     return urn
 
 def _lookupAggNickURLFromURNInNicknames(logger, config, agg_urn):
@@ -242,10 +277,11 @@ def _lookupAggNickURLFromURNInNicknames(logger, config, agg_urn):
         if agg_urn.endswith('+cm') or agg_urn.endswith('+am'):
             agg_urn = agg_urn[:-3]
             logger.debug("Trimmed URN for lookup to %s", agg_urn)
-        for amNick in config['aggregate_nicknames'].keys():
-            (amURN, amURL) = config['aggregate_nicknames'][amNick]
+        index = _getAggNickIndex(config)
+        for pos in index.urnsContaining(agg_urn):
+            (amNick, amURN, amURL) = index.entries[pos]
             # Pick the shortest URL / nickname for this URN - stripping of any version diff for the URL
-            if agg_urn in amURN and amURL.strip() != '':
+            if amURL.strip() != '':
                 if (url == "" or nick == "") or \
                         (len(amURL) < len(url)) or \
                         (len(amNick) < len(nick)) or \
@@ -260,6 +296,23 @@ def _lookupAggNickURLFromURNInNicknames(logger, config, agg_urn):
                     logger.debug("Supplied AM URN %s is nickname %s, URL %s according to configured aggregate nicknames (matches %s)", agg_urn, nick, url, amURN)
     return nick, url
 
+# Lookup a different URL for the aggregate with the given URL and URN synonyms.
+# EG AMs in particular have 2 URLs (ExoSM and local).
+# Return the first configured URL for one of the URNs that is not a variant of
+# the given URL, or None.
+def _lookupAggAltURLInNicknames(logger, config, agg_url, urn_syns):
+    index = _getAggNickIndex(config)
+    positions = []
+    for urn in set(urn_syns):
+        positions.extend(index.byStrippedURN.get(urn, []))
+    hadURL = _extractURL(logger, agg_url)
+    for pos in sorted(set(positions)):
+        (amNick, amURN, amURL) = index.entries[pos]
+        newURL = index.extractedURLs[pos]
+        if hadURL != newURL and not hadURL in newURL and not newURL in hadURL and newURL.strip() != '':
+            return amURL.strip()
+    return None
+
 def _derefRSpecNick( handler, rspecNickname ):
     contentstr = None
     try:
@@ -394,6 +447,7 @@ def _listaggregates(handler):
                     aggs[url] = url
         return (aggs, "")
     elif not handler.opts.noExtraCHCalls:
+        from .dossl import _do_ssl
         handler.logger.debug("Querying clearinghouse for all aggregates")
         (aggs, message) =  _do_ssl(handler.framework, None, "List Aggregates from control framework", handler.framework.list_aggregates)
         if aggs is None:
@@ -432,6 +486,7 @@ def _load_cred(handler, filename):
         #handler.logger.debug(e)
 
     if not handler.opts.devmode:
+        from . import credparsing as credutils
         if handler.opts.api_version >= 3 and credutils.is_cred_xml(cred) and not isStruct:
             handler.logger.debug("Using APIv3+ and got XML cred. Wrapping it.")
             cred = handler.framework.wrap_cred(cred)
@@ -449,6 +504,9 @@ def _get_slice_cred(handler, urn):
     Return the slice credential, and a string message of any error.
     Returned credential will be a struct in AM API v3+.
     """
+    from . import credparsing as credutils
+    from .dossl import _do_ssl
+    from ...sfa.trust.credential import Credential
 
     cred = _load_cred(handler, handler.opts.slicecredfile)
     if cred is not None:
@@ -527,6 +585,7 @@ def _print_slice_expiration(handler, urn, sliceCred=None):
         # failed to get a slice string. Can't check
         return ""
 
+    from . import credparsing as credutils
     sliceexp = credutils.get_cred_exp(handler.logger, sliceCred)
     sliceexp = naiveUTC(sliceexp)
     now = datetime.datetime.utcnow()
@@ -720,6 +779,7 @@ def _getRSpecOutput(logger, rspec, slicename, urn, url, message, slivers=None):
     server = _get_server_name(url, urn)
 
     # Create BODY
+    from ...geni.util import rspec_util
     if rspec and rspec_util.is_rspec_string( rspec, None, None, logger=logger ):
         # This line seems to insert extra \ns - GCF ticket #202
 #        content = rspec_util.getPrettyRSpec(rspec)
@@ -878,6 +938,7 @@ def _maybe_save_slicecred(handler, name, slicecred):
     --slicecredfile if supplied
     else [<--p value>-]-<slicename>-cred.[xml or json, depending on credential format]
     """
+    from . import credparsing as credutils
     if name is None or name.strip() == "" or slicecred is None or (credutils.is_cred_xml(slicecred) and slicecred.strip() is None):
         return None
 
@@ -902,6 +963,7 @@ def _save_cred(handler, name, cred):
     Infer an appropriate file extension from the file type.
     If we are using APIv3+ and the credential is not a struct, wrap it before saving.
     '''
+    from . import credparsing as credutils
     ftype = ".xml"
     # FIXME: Do this?
     if credutils.is_cred_xml(cred) and handler.opts.api_version >= 3:
@@ -933,6 +995,7 @@ def _save_cred(handler, name, cred):
     return filename
 
 def _is_user_cert_expired(handler):
+    from ...sfa.trust.gid import GID
     # create a gid
     usergid = None
     try:
@@ -945,6 +1008,7 @@ def _is_user_cert_expired(handler):
     return False
 
 def _get_user_urn(logger, config):
+    from ...sfa.trust.gid import GID
     # create a gid
     usergid = None
     try:
@@ -1021,28 +1085,132 @@ def printNicknames(config, opts):
 
     return result_string, retStruct
 
-def expires_from_rspec(result, logger=None):
+# Attributes in an RSpec that give an expiration time
+RSPEC_EXPIRATION_ATTRIBUTES = ('expires', 'valid_until', 'geni_expires', 'expiration_time')
+
+# Size of the pieces of an RSpec to feed the parser at a time
+_RSPEC_PARSE_CHUNK = 64*1024
+
+def expirations_from_rspec(rspec, logger=None):
+    '''Find all the expiration times in the given RSpec string, in one streaming pass.
+    Return is a dict:
+     rspec: True if the root element is an un-prefixed rspec element
+     expires, generated: the attributes of that rspec element (strings) or None
+     slivers: list of dicts, one per expiration attribute of another element, in document order:
+      element: the element name (without any namespace prefix)
+      client_id, component_id, sliver_id: of the element, or else of the enclosing
+        node or link, or None
+      attribute: the attribute name (one of RSPEC_EXPIRATION_ATTRIBUTES)
+      value: the attribute value string
+      in_node: True if the element is within a node element
+      after_node: True if an un-prefixed node element started before this element
+     error: None, or the parse error if the RSpec is not well formed XML.
+      Then the rest of the dict is what was found before the error.'''
+    result = dict(rspec=False, expires=None, generated=None, slivers=[], error=None)
+    if rspec is None:
+        return result
+    rspec = str(rspec).lstrip()
+    # Stack of (element name, ids dict) for open node and link elements
+    resources = []
+    # Stack of element names
+    names = []
+    # Seen an un-prefixed node element yet?
+    seen = dict(node=False)
+
+    def start(qname, attrs):
+        name = qname.split(':')[-1]
+        names.append(name)
+        if len(names) == 1:
+            if qname == 'rspec':
+                result['rspec'] = True
+                result['expires'] = attrs.get('expires')
+                result['generated'] = attrs.get('generated')
+            return
+        ids = None
+        if name in ('node', 'link'):
+            ids = dict([(idname, attrs.get(idname)) for idname in ('client_id', 'component_id', 'sliver_id')])
+            resources.append((name, ids))
+        for attr in RSPEC_EXPIRATION_ATTRIBUTES:
+            if not attrs.has_key(attr):
+                continue
+            if ids is None:
+                ids = dict([(idname, attrs.get(idname)) for idname in ('client_id', 'component_id', 'sliver_id')])
+                if resources and not any(ids.values()):
+                    # Use the IDs of the enclosing node or link
+                    ids = resources[-1][1]
+            exp = dict(element=name, attribute=attr, value=attrs[attr],
+                       in_node=any(r[0] == 'node' for r in resources),
+                       after_node=seen['node'])
+            exp.update(ids)
+            result['slivers'].append(exp)
+        if qname == 'node':
+            seen['node'] = True
+
+    def end(name):
+        names.pop()
+        if name.split(':')[-1] in ('node', 'link') and resources:
+            resources.pop()
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    try:
+        for i in range(0, len(rspec), _RSPEC_PARSE_CHUNK):
+            parser.Parse(rspec[i:i+_RSPEC_PARSE_CHUNK], False)
+        parser.Parse("", True)
+    except xml.parsers.expat.ExpatError, e:
+        if logger:
+            logger.debug("Failed to parse RSpec for expirations: %s", e)
+        result['error'] = str(e)
+    return result
+
+def _expiration_strings_from_rspec_text(rspec):
+    # For RSpecs that are not well formed XML: find the rspec expires and generated
+    # attributes, and the last EG geni_sliver_info expiration_time, with regular expressions.
+    # Return the same kind of dict as expirations_from_rspec
+    result = dict(rspec=False, expires=None, generated=None, slivers=[], error=None)
+    if re.search("<rspec\s", rspec):
+        result['rspec'] = True
+    match = re.search("<rspec [^>]*expires\s*=\s*[\'\"]([^\'\"]+)[\'\"]", rspec)
+    if match:
+        result['expires'] = match.group(1)
+    match = re.search("<rspec [^>]*generated\s*=\s*[\'\"]([^\'\"]+)[\'\"]", rspec)
+    if match:
+        result['generated'] = match.group(1)
+    match = re.search("<rspec\s+.+\s+<node\s+.+\s+<.*geni_sliver_info\s+[^>]*expiration_time\s*=\s*[\'\"]([^\'\"]+)[\'\"]", rspec, re.DOTALL)
+    if match:
+        result['slivers'].append(dict(element='geni_sliver_info', attribute='expiration_time',
+                                      value=match.group(1), in_node=True, after_node=True,
+                                      client_id=None, component_id=None, sliver_id=None))
+    return result
+
+def expires_from_rspec(result, logger=None, expirations=None):
     '''Parse the expires attribute off the given rspec and return it as a naive UTC datetime 
     (if found and different from any 'generated' timestamp).
     If that fails, try to parse the ExoGENI sliver info extension.
-    If those fail, return None.'''
+    If those fail, return None.
+    Supply expirations (from expirations_from_rspec) if already parsed.'''
     # SFA and PG use the expires attribute. MAX too. ION soon, but for now it is wrong.
     # FOAM (and AL2S) and EG and GRAM do not. EG however has a sliver_info extension.
     if result is None or str(result).strip() == "":
         return None
-    rspec = str(result)
-    match = re.search("<rspec [^>]*expires\s*=\s*[\'\"]([^\'\"]+)[\'\"]", rspec)
-    if match:
-        expStr = match.group(1).strip()
+    if expirations is None:
+        expirations = expirations_from_rspec(result, logger)
+    if expirations['error']:
+        # Not well formed XML: look for the attributes in the text
+        expirations = _expiration_strings_from_rspec_text(str(result))
+    expStr = expirations['expires']
+    if expStr:
+        expStr = expStr.strip()
         if logger:
             logger.debug("Found rspec expires attribute: '%s'", expStr)
         try:
             expObj = _naiveUTCFromString(expStr)
 
             # Now look for a generated attribute. If there and same, expires is no good
-            match2 = re.search("<rspec [^>]*generated\s*=\s*[\'\"]([^\'\"]+)[\'\"]", rspec)
-            if match2:
-                genStr = match2.group(1).strip()
+            genStr = expirations['generated']
+            if genStr:
+                genStr = genStr.strip()
                 #if logger:
                 #    logger.debug("Found generated %s", genStr)
                 try:
@@ -1071,10 +1239,13 @@ def expires_from_rspec(result, logger=None):
             logger.debug("RSpec had no expires attribute")
 
     # Got no good expires so far. Look for the EG geni_sliver_info attribute
-    # FIXME: This is really per node, and here we're returning just one.
-    match = re.search("<rspec\s+.+\s+<node\s+.+\s+<.*geni_sliver_info\s+[^>]*expiration_time\s*=\s*[\'\"]([^\'\"]+)[\'\"]", rspec, re.DOTALL)
-    if match:
-        expStr = match.group(1).strip()
+    # FIXME: This is really per node, and here we're returning just one: the last one in the RSpec.
+    expStr = None
+    if expirations['rspec']:
+        for exp in expirations['slivers']:
+            if exp['element'] == 'geni_sliver_info' and exp['attribute'] == 'expiration_time' and exp['after_node']:
+                expStr = exp['value'].strip()
+    if expStr:
         if logger:
             logger.debug("Found EG style geni_sliver_info %s", expStr)
         try:
@@ -1093,6 +1264,8 @@ def expires_from_rspec(result, logger=None):
 def _naiveUTCFromString(timeStr):
     if not timeStr:
         return None
+    import dateutil.parser
+    from ...geni.util.tz_util import tzd
     try:
         timeO = dateutil.parser.parse(timeStr, tzinfos=tzd)
         return naiveUTC(timeO)
@@ -89,6 +89,17 @@ class DateTimeAwareJSONEncoder(json.JSONEncoder):
         else:
             return json.JSONEncoder.default(self, obj)
 
+class ResultJSONEncoder(DateTimeAwareJSONEncoder):
+    """
+    Like DateTimeAwareJSONEncoder, but encodes any other object that JSON
+    does not support as its string form. For reporting Omni call results.
+    """
+    def default(self, obj):
+        try:
+            return DateTimeAwareJSONEncoder.default(self, obj)
+        except TypeError:
+            return str(obj)
+
 class DateTimeAwareJSONDecoder(json.JSONDecoder):
     """
     Converts a json string, where datetime and timedelta objects were converted
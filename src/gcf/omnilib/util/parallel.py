@@ -0,0 +1,122 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+'''
+Run a function over a list of items in a bounded number of threads,
+and check whether a private key would prompt for a pass phrase
+(in which case calls that each open an SSL connection should not run
+in parallel).
+'''
+
+from __future__ import absolute_import
+
+import logging
+import Queue
+import sys
+import threading
+
+# Seconds between checks while waiting for calls to finish. In Python 2,
+# waits without a timeout cannot be interrupted by Ctrl-C.
+WAIT_INTERVAL_SECS = 0.5
+
+def key_is_encrypted(keyfile, logger=None):
+    '''Is the given private key file protected by a pass phrase?
+    Returns True if the file cannot be read, to be safe.'''
+    try:
+        with open(keyfile, 'r') as f:
+            return 'ENCRYPTED' in f.read()
+    except Exception, e:
+        if logger is None:
+            logger = logging.getLogger('omni')
+        logger.debug("Failed to read key file %s: %s", keyfile, e)
+        return True
+
+def parallel_imap(func, items, threads=1):
+    '''Generate func(item) for each of the items, in order, calling func
+    from up to threads threads at once. Each result is generated as soon
+    as it and all earlier results are ready.
+    If a call raises an exception (including SystemExit), no more items
+    are started, and the exception is raised here in place of that result
+    once the calls already running have finished.
+    On KeyboardInterrupt, no more items are started and the calls
+    already running are not waited for.
+    With threads <= 1, items are done one at a time in this thread.'''
+    items = list(items)
+    nthreads = min(threads, len(items))
+    if nthreads <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    work = Queue.Queue()
+    for i, item in enumerate(items):
+        work.put((i, item))
+    # index => (True, result) or (False, exc_info)
+    results = dict()
+    done = threading.Condition()
+    stop = threading.Event()
+
+    def runCalls():
+        while not stop.is_set():
+            try:
+                (i, item) = work.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                result = (True, func(item))
+            except BaseException:
+                result = (False, sys.exc_info())
+                stop.set()
+            with done:
+                results[i] = result
+                done.notifyAll()
+
+    threadlist = [threading.Thread(target=runCalls) for i in range(nthreads)]
+    for t in threadlist:
+        t.daemon = True
+        t.start()
+    interrupted = False
+    try:
+        for i in range(len(items)):
+            with done:
+                while i not in results:
+                    done.wait(WAIT_INTERVAL_SECS)
+                (ok, result) = results.pop(i)
+            if not ok:
+                raise result[0], result[1], result[2]
+            yield result
+    except KeyboardInterrupt:
+        interrupted = True
+        raise
+    finally:
+        # Don't start any more calls if the caller stopped early
+        stop.set()
+        if not interrupted:
+            for t in threadlist:
+                while t.is_alive():
+                    t.join(WAIT_INTERVAL_SECS)
+
+def parallel_map(func, items, threads=1):
+    '''Return the list of func(item) for each of the items, in order,
+    calling func from up to threads threads at once.
+    See parallel_imap.'''
+    return list(parallel_imap(func, items, threads))
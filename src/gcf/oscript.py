@@ -110,30 +110,31 @@ import ConfigParser
 from copy import deepcopy
 import datetime
 import inspect
+import json
 import logging.config
 import optparse
 import os
-import shutil
+import shlex
 import sys
+import threading
+import time
+import traceback
 import urllib2
 
 from .omnilib.util import OmniError, AMAPIError
-from .omnilib.handler import CallHandler
-from .omnilib.util.handler_utils import validate_url, printNicknames
-
-# Explicitly import framework files so py2exe is happy
-from .omnilib.frameworks import framework_apg
-from .omnilib.frameworks import framework_base
-from .omnilib.frameworks import framework_gcf
-from .omnilib.frameworks import framework_gch
-from .omnilib.frameworks import framework_gib
-from .omnilib.frameworks import framework_of
-from .omnilib.frameworks import framework_pg
-from .omnilib.frameworks import framework_pgch
-from .omnilib.frameworks import framework_sfa
-from .omnilib.frameworks import framework_chapi
+from .omnilib.util.handler_utils import validate_url, printNicknames, _indexAggNicks
+from .omnilib.util.configcache import read_config_file
+from .omnilib.util.parallel import parallel_imap
 from .gcf_version import GCF_VERSION
 
+# Note that the command handlers and the control framework modules are
+# imported only when needed, so each command loads only the code it uses:
+# see load_framework and API_call. Packagers (py2exe) must list the
+# framework modules explicitly.
+
+# Commands that do not use the control framework
+NO_FRAMEWORK_COMMANDS = ('nicknames',)
+
 #DEFAULT_RSPEC_LOCATION = "http://www.gpolab.bbn.com/experiment-support"
 #DEFAULT_RSPEC_EXTENSION = "xml"
 
@@ -187,8 +188,12 @@ def load_agg_nick_config(opts, logger):
         aggNickCacheTimestamp = None
 
     # update the file if necessary
-    if opts.noAggNickCache or (not aggNickCacheTimestamp and not opts.useAggNickCache) or (aggNickCacheTimestamp and aggNickCacheTimestamp < opts.AggNickCacheOldestDate and not opts.useAggNickCache):
+    # If we have a cache that is merely old, use it for now and refresh it in the background
+    refreshInBackground = False
+    if opts.noAggNickCache or (not aggNickCacheTimestamp and not opts.useAggNickCache):
         update_agg_nick_cache( opts, logger )
+    elif aggNickCacheTimestamp and aggNickCacheTimestamp < opts.AggNickCacheOldestDate and not opts.useAggNickCache:
+        refreshInBackground = True
 
     # aggNickCacheName may now exist. If so, add it to the front of the list.
     if not aggNickCacheExists and os.path.exists( opts.aggNickCacheName ):
@@ -210,13 +215,16 @@ def load_agg_nick_config(opts, logger):
 
             logger.info("Loading agg_nick_cache file '%s'", filename)
 
-            confparser = ConfigParser.RawConfigParser()
             try:
-                confparser.read(filename)
+                confparser = read_config_file(filename, _config_cache_name(opts), logger)
                 readConfigFile = True
                 break
             except ConfigParser.Error as exc:
                 logger.error("agg_nick_cache file %s could not be parsed: %s"% (filename, str(exc)))
+    # Only start the refresh once we are done reading the old cache
+    if refreshInBackground:
+        update_agg_nick_cache_in_background( opts, logger )
+
     if not readConfigFile:
         logger.error("Failed to read any possible agg_nick_cache file; Check your network connection and/or permissions to read/write '%s'.", opts.aggNickCacheName)
         return {}
@@ -225,6 +233,13 @@ def load_agg_nick_config(opts, logger):
     config = load_omni_defaults( config, confparser, filename, logger, opts )
     return config
 
+def _config_cache_name(opts):
+    """Return the file in which to cache parsed config files, or None
+    if config files should not be cached."""
+    if getattr(opts, 'noCacheFiles', False):
+        return None
+    return getattr(opts, 'configCacheName', None)
+
 def locate_config( opts, logger, config={}):
     """Locate the omni config file.
     Search path:
@@ -276,9 +291,8 @@ def load_config(opts, logger, config={}, filename=None):
 
     logger.info("Loading config file '%s'", filename)
 
-    confparser = ConfigParser.RawConfigParser()
     try:
-        confparser.read(filename)
+        confparser = read_config_file(filename, _config_cache_name(opts), logger)
     except ConfigParser.Error as exc:
         logger.error("Config file '%s' could not be parsed: %s"% (filename, str(exc)))
         raise OmniError, "Config file '%s' could not be parsed: %s"% (filename, str(exc))
@@ -427,6 +441,8 @@ def load_aggregate_nicknames( config, confparser, filename, logger, opts ):
 #            else:
 #                logger.debug("Loaded aggregate nickname '%s' from file '%s'." % (key, filename))
             config['aggregate_nicknames'][key] = temp
+    # Index the nicknames for the lookups in handler_utils
+    _indexAggNicks(config)
     return config
 
 def load_omni_defaults( config, confparser, filename, logger, opts ):
@@ -474,18 +490,22 @@ def load_framework(config, opts):
 
 def update_agg_nick_cache( opts, logger ):
     """Try to download the definitive version of `agg_nick_cache` and
-    store in the specified place."""
+    store in the specified place.
+    The download goes to a temporary file next to the cache, which then
+    replaces the cache in one rename, so readers of the cache never see
+    a partly written file."""
     tmpcache = None
     try:
         import tempfile
-        handle, tmpcache = tempfile.mkstemp()
-        os.close(handle)
         # make sure the directory containing --aggNickCacheName exists
         # wget `agg_nick_cache`
         # cp `agg_nick_cache` opts.aggNickCacheName
         directory = os.path.dirname(opts.aggNickCacheName)
         if not os.path.exists( directory ):
             os.makedirs( directory )
+        # In the same directory, so the rename below is atomic
+        handle, tmpcache = tempfile.mkstemp(dir=directory, prefix=".agg_nick_cache")
+        os.close(handle)
         logger.debug("Attempting to refresh agg_nick_cache from %s...", opts.aggNickDefinitiveLocation)
         # Do not use urllib here, because urllib interacts badly with M2Crypto
         # which overrites the URLopener.open_https method in a way that makes opening https
@@ -516,13 +536,12 @@ def update_agg_nick_cache( opts, logger ):
             logger.info("Download of latest `agg_nick_cache` from '%s' seems broken (no or empty file). Keeping old cache.", opts.aggNickDefinitiveLocation)
             logger.debug("Temp file: '%s'. Exists? %s", tmpcache, os.path.exists(tmpcache))
         if good:
-            # On Windows, rename doesn't delete any existing file, so explicitly delete the old one first
-            # And shutil.move also wants the destination to be gone
             try:
+                os.rename(tmpcache, opts.aggNickCacheName)
+            except OSError:
+                # On Windows, rename doesn't delete any existing file, so explicitly delete the old one first
                 os.unlink(opts.aggNickCacheName)
-            except:
-                pass
-            shutil.move(tmpcache, opts.aggNickCacheName)
+                os.rename(tmpcache, opts.aggNickCacheName)
             logger.info("Downloaded latest `agg_nick_cache` from '%s' and copied to '%s'." % (opts.aggNickDefinitiveLocation, opts.aggNickCacheName))
     except Exception, e:
         logger.info("Attempted to download latest `agg_nick_cache` from '%s' but could not." % opts.aggNickDefinitiveLocation )
@@ -533,6 +552,24 @@ def update_agg_nick_cache( opts, logger ):
         except:
             pass
 
+# Thread refreshing the agg_nick_cache in the background, if any
+_aggNickCacheUpdater = None
+
+def update_agg_nick_cache_in_background( opts, logger ):
+    """Refresh the `agg_nick_cache` in a separate thread, so this Omni
+    invocation can proceed using the existing (old) cache. Only one
+    refresh runs at a time. Omni does not wait for the refresh to finish
+    before exiting: an unfinished refresh leaves the old cache in place."""
+    global _aggNickCacheUpdater
+    if _aggNickCacheUpdater is not None and _aggNickCacheUpdater.isAlive():
+        logger.debug("agg_nick_cache refresh already in progress")
+        return
+    logger.debug("agg_nick_cache is old: refreshing in the background")
+    _aggNickCacheUpdater = threading.Thread(target=update_agg_nick_cache, args=(opts, logger),
+                                            name="AggNickCacheUpdater")
+    _aggNickCacheUpdater.daemon = True
+    _aggNickCacheUpdater.start()
+
 # Check if there is a newer version of Omni available.
 # Look for an entry "latest_omni_version" under "omni_defaults" in the omni_config (or really, agg_nick_cache).
 # Expected format is "#,Message" EG: "2.8,Omni 2.8 was release 2/1/2015". No commas in the message.
@@ -583,6 +620,10 @@ def initialize(argv, options=None, dictLoggingConfig=None ):
     # which also sets omni_defaults
     config = load_config(opts, logger, config)
     checkForUpdates(config, logger)
+    if len(args) > 0 and args[0].lower() in NO_FRAMEWORK_COMMANDS:
+        # Skip loading the framework (and reading the user's cert) when not needed
+        logger.debug("Not loading framework for command %s", args[0])
+        return None, config, args, opts
     framework = load_framework(config, opts)
     logger.debug('User Cert File: %s', framework.cert)
     return framework, config, args, opts
@@ -774,6 +815,147 @@ if __name__ == "__main__":
     # process the user's call
     return API_call( framework, config, args, opts, verbose=verbose )
 
+class OmniSession(object):
+    """Run many Omni calls in one process, re-using the control
+    framework (and so the user credential and open clearinghouse
+    connections) across calls that use the same framework configuration.
+
+    Use this instead of repeated calls to call() from long running
+    scripts or servers:
+      session = OmniSession()
+      text, result = session.call(['-a', 'myam', 'describe', 'myslice'])
+
+    Calls may be made from multiple threads: each concurrent call uses
+    its own framework instance.
+    Logging is configured on the first call only (if configureLogging).
+    """
+
+    # Create a new framework instance if the one we have is older than this (seconds)
+    FRAMEWORK_MAX_AGE = 3600
+
+    def __init__(self, dictLoggingConfig=None, configureLogging=True):
+        self.dictLoggingConfig = dictLoggingConfig
+        self._configureLogging = configureLogging
+        self._lock = threading.Lock()
+        # Framework instances not in use, by _framework_key: lists of (creation time, framework)
+        self._frameworks = dict()
+
+    def _framework_key(self, config, opts):
+        # Options frameworks use when constructed or cache internally
+        sf = config['selected_framework']
+        items = tuple(sorted([(k, str(v)) for (k, v) in sf.items() if k != 'logger']))
+        return (items, opts.ssltimeout, opts.verbosessl, opts.speaksfor,
+                tuple(opts.cred or ()), opts.usercredfile)
+
+    def _get_framework(self, config, opts):
+        """Return (key, creation time, framework) for an unused framework
+        for the given config and options, loading one if needed."""
+        key = self._framework_key(config, opts)
+        now = time.time()
+        with self._lock:
+            free = self._frameworks.get(key, [])
+            while free:
+                (created, framework) = free.pop()
+                if now - created < self.FRAMEWORK_MAX_AGE:
+                    if hasattr(framework, 'opts'):
+                        framework.opts = opts
+                    config['logger'].debug('Re-using framework type %s', config['selected_framework']['type'])
+                    return key, created, framework
+        return key, now, load_framework(config, opts)
+
+    def _release_framework(self, key, created, framework):
+        with self._lock:
+            self._frameworks.setdefault(key, []).append((created, framework))
+
+    def initialize(self, argv, options=None):
+        """Parse argv, configure logging if this is the first call, and
+        load the omni_config. Return the config, args list and optparse.Values struct."""
+        opts, args = parse_args(argv, options)
+        with self._lock:
+            if self._configureLogging:
+                logger = configure_logging(opts, self.dictLoggingConfig)
+                self._configureLogging = False
+            else:
+                logger = logging.getLogger("omni")
+        config = load_agg_nick_config(opts, logger)
+        config = load_config(opts, logger, config)
+        return config, args, opts
+
+    def call(self, argv, options=None, verbose=False):
+        """Run the Omni command in argv, as call() does.
+        Return is a list of 2 items: a human readable string summarizing the result
+        (possibly an error message), and the result object (may be None on error)."""
+        if options is not None and not options.__class__==optparse.Values:
+            raise OmniError("Invalid options argument to call: must be an optparse.Values object")
+        if argv is None or not type(argv) == list:
+            raise OmniError("Invalid argv argument to call: must be a list")
+
+        config, args, opts = self.initialize(argv, options)
+        if len(args) > 0 and args[0].lower() in NO_FRAMEWORK_COMMANDS:
+            return API_call( None, config, args, opts, verbose=verbose )
+        (key, created, framework) = self._get_framework(config, opts)
+        try:
+            return API_call( framework, config, args, opts, verbose=verbose )
+        finally:
+            self._release_framework(key, created, framework)
+
+    def _batch_call(self, argv, options, verbose):
+        """Run one command of a batch, returning its result dictionary."""
+        try:
+            text, result = self.call(argv, options, verbose)
+            return {'argv': argv, 'text': text, 'result': result, 'error': None}
+        except SystemExit, e:
+            # Omni exits on some errors, like bad arguments
+            return {'argv': argv, 'text': None, 'result': None, 'error': "Omni exited: %s" % e}
+        except Exception, e:
+            logging.getLogger("omni").debug(traceback.format_exc())
+            return {'argv': argv, 'text': None, 'result': None, 'error': "%s: %s" % (e.__class__.__name__, e)}
+
+    def call_batch(self, argvs, options=None, threads=1, verbose=False):
+        """Run each of the Omni commands in the list argvs (each an argv list).
+        options is an optional optparse.Values structure of options used for every command.
+        With threads > 1, run up to that many commands at once: only do this
+        if the commands do not depend on each other.
+        Generates a dictionary per command, in order, with keys
+        'argv', 'text' and 'result' (as from call()), and 'error'
+        (a message if the command raised an error, else None)."""
+        # Return results in order, as they finish
+        for result in parallel_imap(lambda argv: self._batch_call(argv, options, verbose),
+                                    argvs, threads):
+            yield result
+
+def read_batch_file(filename):
+    """Read Omni commands from the given file, one per line, split into
+    arguments as a shell would. Blank lines and lines starting with '#' are skipped.
+    Return a list of argv lists."""
+    argvs = []
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line == "" or line.startswith('#'):
+                continue
+            argvs.append(shlex.split(line))
+    return argvs
+
+def run_batch(opts):
+    """Run the Omni commands in the file opts.batch in one OmniSession, printing
+    one JSON document per command on stdout. The other options in opts
+    apply to every command. Return 0 if all commands succeeded, else 1."""
+    try:
+        argvs = read_batch_file(opts.batch)
+    except Exception, e:
+        raise OmniError("Failed to read batch file %s: %s" % (opts.batch, e))
+    from .omnilib.util.json_encoding import ResultJSONEncoder
+    # Logging is already configured
+    session = OmniSession(configureLogging=False)
+    retcode = 0
+    for result in session.call_batch(argvs, opts, threads=opts.batchThreads, verbose=opts.verbose):
+        if result['error'] is not None:
+            retcode = 1
+        print json.dumps(result, cls=ResultJSONEncoder)
+        sys.stdout.flush()
+    return retcode
+
 def getOptsUsed(parser, opts, logger=None):
     '''Get string to print out the options supplied'''
     #sys.argv when called as a library is
@@ -843,6 +1025,7 @@ def API_call( framework, config, args, opts, verbose=False ):
     if len(args) > 0 and args[0].lower() == "nicknames":
         result = printNicknames(config, opts)
     else:
+        from .omnilib.handler import CallHandler
         # Process the user's call
         handler = CallHandler(framework, config, opts)
     #    Returns string, item
@@ -1175,7 +1358,7 @@ def getParser():
                       default="~/.gcf/get_version_cache.json",
                       help="File where GetVersion info will be cached, default is %default")
     gvgroup.add_option("--noCacheFiles", default=False, action="store_true",
-                       help="Disable both GetVersion and Aggregate Nickname cache functionality completely; no files are downloaded, saved, or loaded.")
+                       help="Disable GetVersion, Aggregate Nickname, config file and credential cache functionality completely; no files are downloaded, saved, or loaded.")
     parser.add_option_group( gvgroup )
 
     # AggNick
@@ -1197,8 +1380,22 @@ def getParser():
     angroup.add_option("--AggNickDefinitiveLocation", dest='aggNickDefinitiveLocation',
                       default="https://raw.githubusercontent.com/GENI-NSF/geni-tools/master/agg_nick_cache.base",
                       help="Website with latest agg_nick_cache, default is %default. To force Omni to read this cache, delete your local AggNickCache or use --NoAggNickCache.")
+    angroup.add_option("--ConfigCacheName", dest='configCacheName',
+                      default="~/.gcf/omni_config_cache",
+                      help="File where parsed copies of the omni_config and agg_nick_cache are cached, default is %default")
     parser.add_option_group( angroup )
 
+    # Credentials
+    credgroup = optparse.OptionGroup( parser, "Credential Cache",
+                          "Control caching of user and slice credentials from the clearinghouse" )
+    credgroup.add_option("--NoCredCache", dest='noCredCache',
+                      default=False, action="store_true",
+                      help="Disable using and saving cached user and slice credentials (default is %default)")
+    credgroup.add_option("--CredCacheDir", dest='credCacheDir',
+                      default="~/.gcf/credcache",
+                      help="Directory where unexpired user and slice credentials are cached, default is %default")
+    parser.add_option_group( credgroup )
+
     # Development / Advanced
     devgroup = optparse.OptionGroup( parser, "For Developers / Advanced Users",
                           "Features only needed by developers or advanced users" )
@@ -1236,6 +1433,30 @@ def getParser():
     devgroup.add_option("--orca-slice-id", dest="orca_slice_id",
                       help="Use the given Orca slice id")
     parser.add_option_group( devgroup )
+
+    # Daemon
+    daemongroup = optparse.OptionGroup( parser, "Omni Daemon",
+                          "Run Omni as a long running server, or send commands to one" )
+    daemongroup.add_option("--daemon", default=False, action="store_true",
+                      help="Run as an Omni daemon, serving Omni commands sent with --useDaemon until idle for --daemonIdleTimeout seconds. The daemon re-uses the control framework, credentials and clearinghouse connections across commands.")
+    daemongroup.add_option("--useDaemon", default=False, action="store_true",
+                      help="Send this command to a running Omni daemon (started with --daemon) instead of running it here")
+    daemongroup.add_option("--daemonSocket", default="~/.gcf/omni_daemon.sock",
+                      help="Unix domain socket where the Omni daemon listens, default is %default")
+    daemongroup.add_option("--daemonIdleTimeout", default=1800, action="store", type="int",
+                      help="Seconds without commands after which the Omni daemon exits (0 means never), default is %default")
+    daemongroup.add_option("--daemonMaxCalls", default=4, action="store", type="int",
+                      help="Max number of commands the Omni daemon runs at once, default is %default")
+    parser.add_option_group( daemongroup )
+
+    # Batch
+    batchgroup = optparse.OptionGroup( parser, "Batch Commands",
+                          "Run many Omni commands from a file in one Omni process" )
+    batchgroup.add_option("--batch", default=None, metavar="BATCH_FILENAME",
+                      help="Run the Omni commands in this file (one per line, with arguments as on the command line) re-using the control framework, credentials and clearinghouse connections. Other options given here apply to every command. Prints one JSON result per command.")
+    batchgroup.add_option("--batchThreads", default=1, action="store", type="int",
+                      help="Number of batch commands to run at once. Only use with independent commands. Default is %default")
+    parser.add_option_group( batchgroup )
     return parser
 
 def parse_args(argv, options=None, parser=None):
@@ -1304,6 +1525,14 @@ def parse_args(argv, options=None, parser=None):
     options.AggNickCacheOldestDate = datetime.datetime.utcnow() - datetime.timedelta(days=indays)
 
     options.aggNickCacheName = os.path.normcase(os.path.expanduser(options.aggNickCacheName))
+    options.configCacheName = os.path.normcase(os.path.expanduser(options.configCacheName))
+    options.credCacheDir = os.path.normcase(os.path.expanduser(options.credCacheDir))
+    options.daemonSocket = os.path.normcase(os.path.expanduser(options.daemonSocket))
+
+    if options.daemon and options.useDaemon:
+        parser.error("Cannot both run as the Omni daemon and send commands to it.")
+    if options.batch:
+        options.batch = os.path.normcase(os.path.expanduser(options.batch))
 
     if options.noAggNickCache and options.useAggNickCache:
         parser.error("Cannot both force not using the AggNick cache and force TO use it.")
@@ -1328,6 +1557,22 @@ def main(argv=None):
     if argv is None:
         argv = sys.argv[1:]
     try:
+        if [arg for arg in argv if arg.split('=')[0] in ('--daemon', '--useDaemon', '--batch')]:
+            opts, args = parse_args(argv)
+            if opts.batch:
+                configure_logging(opts)
+                return run_batch(opts)
+            if opts.daemon:
+                from .omnilib.daemon import OmniDaemon
+                logger = configure_logging(opts)
+                OmniDaemon(opts.daemonSocket, opts.daemonIdleTimeout,
+                           opts.daemonMaxCalls, logger).serve()
+                return
+            elif opts.useDaemon:
+                from .omnilib.daemon import call_daemon
+                text, result = call_daemon(argv, opts.daemonSocket)
+                print text
+                return
         framework, config, args, opts = initialize(argv)
         API_call(framework, config, args, opts, verbose=opts.verbose)
     except AMAPIError, ae:
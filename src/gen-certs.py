@@ -31,6 +31,8 @@ a clearinghouse and an aggregate manager.
 Finally, a user cert and
 key is created for a user (named Alice by default). Options allow
 controlling which certs are created.
+With --bulk-users, also create many experimenter certs and keys, with user
+and slice credentials, for example to load test an aggregate.
 This file shows how to constructe GAPI compliant certificates.
 See sfa.trust.certificate for the class definition and
 geni.util.cert_util for the utility create_cert function.
@@ -44,16 +46,20 @@ if sys.version_info < (2, 6):
 elif sys.version_info >= (3,):
     raise Exception('Not python 3 ready')
 
+import datetime
 import logging
+import multiprocessing
 import optparse
 import os.path
 import string
+import time
 import uuid
 
 import gcf.geni as geni
 import gcf.sfa.trust.gid as gid
 import gcf.sfa.trust.certificate as cert
-from gcf.geni.util.cert_util import create_cert
+from gcf.geni.util.cert_util import create_cert, create_certs
+from gcf.geni.util.cred_util import create_credentials
 from gcf.geni.util.urn_util import is_valid_urn_bytype
 from gcf.geni.config import read_config
 
@@ -183,6 +189,68 @@ def make_user_cert(dir, username, ch_keys, ch_gid, public_key=None, email=None,
     if public_key is None:
         print "Created Experimenter %s key in %s" % (username, os.path.join(dir, USER_KEY_FILE))
 
+def make_bulk_certs(dir, count, prefix, slices_per_user, ch_keys, ch_gid, processes=None):
+    '''Make count experimenter GIDs/keys named prefix1..prefixN signed by
+    given CH GID/keys, each with a user credential and slices_per_user
+    slice credentials, saved in given directory. Not returned.
+    The CH key and cert are loaded once and the keys are made in
+    a pool of processes.'''
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger("gen-certs")
+    width = len(str(count))
+    usernames = ["%s%0*d" % (prefix, width, i) for i in range(1, count+1)]
+    user_urns = [geni.URN(CERT_AUTHORITY, USER_CERT_TYPE, username).urn_string() for username in usernames]
+    for urn in user_urns:
+        if not is_valid_urn_bytype(urn, 'user', logger):
+            sys.exit("Username %s invalid: use a shorter --bulk-prefix" % urn)
+    slicenames = ["%s-%d" % (username, j) for username in usernames for j in range(1, slices_per_user+1)]
+    slice_urns = [geni.URN(CERT_AUTHORITY, 'slice', slicename).urn_string() for slicename in slicenames]
+    for urn in slice_urns[:1]:
+        if not is_valid_urn_bytype(urn, 'slice', logger):
+            sys.exit("Slice name %s invalid" % urn)
+
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+
+    # Credential lifetimes as given to the CH
+    user_life = int(config['clearinghouse'].get('user_cred_duration', geni.ch.USER_CRED_LIFE))
+    slice_life = int(config['clearinghouse'].get('slice_duration', geni.ch.SLICE_CRED_LIFE))
+    ch_certfile = CH_CERT_FILE
+    ch_keyfile = CH_KEY_FILE
+    trusted_roots = [ch_certfile]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    start = time.time()
+    certs = create_certs(user_urns + slice_urns, ch_keys, ch_gid, processes=processes)
+    user_certs = certs[:len(user_urns)]
+    slice_certs = certs[len(user_urns):]
+    cert_secs = time.time() - start
+    for (username, (user_gid, user_keys)) in zip(usernames, user_certs):
+        user_gid.save_to_file(os.path.join(dir, "%s-cert.pem" % username))
+        user_keys.save_to_file(os.path.join(dir, "%s-key.pem" % username))
+    print "Created %d experimenter and %d slice certificates in %.1f seconds (%.1f/sec)" % \
+        (len(user_certs), len(slice_certs), cert_secs, len(certs) / max(cert_secs, 0.001))
+
+    start = time.time()
+    expiration = datetime.datetime.utcnow() + datetime.timedelta(seconds=user_life)
+    user_creds = create_credentials([(user_gid, user_gid) for (user_gid, _) in user_certs],
+                                    expiration, 'user', ch_keyfile, ch_certfile,
+                                    trusted_roots, threads=processes)
+    expiration = datetime.datetime.utcnow() + datetime.timedelta(seconds=slice_life)
+    slice_owners = [user_gid for (user_gid, _) in user_certs for j in range(slices_per_user)]
+    slice_creds = create_credentials([(owner_gid, slice_gid) for (owner_gid, (slice_gid, _)) in zip(slice_owners, slice_certs)],
+                                     expiration, 'slice', ch_keyfile, ch_certfile,
+                                     trusted_roots, delegatable=True, threads=processes)
+    cred_secs = time.time() - start
+    for (username, user_cred) in zip(usernames, user_creds):
+        user_cred.save_to_file(os.path.join(dir, "%s-cred.xml" % username))
+    for (slicename, slice_cred) in zip(slicenames, slice_creds):
+        slice_cred.save_to_file(os.path.join(dir, "%s-cred.xml" % slicename))
+    print "Created %d user and %d slice credentials in %.1f seconds (%.1f/sec)" % \
+        (len(user_creds), len(slice_creds), cred_secs, (len(user_creds) + len(slice_creds)) / max(cred_secs, 0.001))
+    print "Saved experimenter certs, keys and credentials in %s" % dir
+
 def parse_args(argv):
     parser = optparse.OptionParser()
     parser.add_option("-d", "--directory", default='.',
@@ -204,6 +272,16 @@ def parse_args(argv):
                       help="Set experimenter uuid to this value")
     parser.add_option("--pubkey", help="public key", default=None)
     parser.add_option("--authority", default=None, help="The Authority of the URN in publicid format (such as 'geni.net//gpo//gcf'). Overrides base_name from gcf_config file.")
+    parser.add_option("--bulk-users", default=0, type="int", metavar="N",
+                      help="Also create N experimenter cert/keys and user credentials, named by --bulk-prefix and a number. Use with --notAll to use the existing CH cert/keys.")
+    parser.add_option("--bulk-prefix", default="user",
+                      help="Experimenter username prefix for --bulk-users (default %default)")
+    parser.add_option("--bulk-slices", default=0, type="int", metavar="M",
+                      help="With --bulk-users, also create M slices (and slice credentials) for each experimenter")
+    parser.add_option("--bulk-dir", default=None, metavar="DIR",
+                      help="Directory for --bulk-users files (default: 'bulk' under --directory)")
+    parser.add_option("--processes", default=None, type="int",
+                      help="Number of processes to create --bulk-users keys (default: one per CPU)")
     return parser.parse_args()
 
 def main(argv=None):
@@ -261,7 +339,7 @@ def main(argv=None):
     if not opts.notAll or opts.ch:
         (ch_keys, ch_cert) = make_ch_cert(dir)
     else:
-        if not opts.notAll or opts.exp:
+        if not opts.notAll or opts.exp or opts.bulk_users > 0:
             try:
                 ch_cert = gid.GID(filename=os.path.join(dir,CH_CERT_FILE))
                 ch_keys = cert.Keypair(filename=os.path.join(dir,CH_KEY_FILE))
@@ -277,6 +355,14 @@ def main(argv=None):
                        email=opts.email,
                        uuidArg=opts.uuid)
 
+    if opts.bulk_users > 0:
+        bulk_dir = opts.bulk_dir
+        if bulk_dir is None:
+            bulk_dir = os.path.join(dir, 'bulk')
+        make_bulk_certs(bulk_dir, opts.bulk_users, opts.bulk_prefix,
+                        opts.bulk_slices, ch_keys, ch_cert,
+                        processes=opts.processes)
+
     return 0
 
 if __name__ == "__main__":
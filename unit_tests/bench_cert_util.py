@@ -0,0 +1,89 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Benchmark of creating user certificates (and, if xmlsec1 is installed,
+slice credentials) one at a time as gen-certs did, and in bulk.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python unit_tests/bench_cert_util.py [count]
+"""
+
+import datetime
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from gcf.geni.util import cert_util
+from gcf.geni.util import cred_util
+from gcf.sfa.trust import credential as cred
+
+CH_URN = 'urn:publicid:IDN+ch.example.net+authority+ch'
+
+def report(what, count, elapsed):
+    print "%s: %d in %.2fs (%.1f/s)" % (what, count, elapsed, count / elapsed)
+
+def main(argv):
+    count = 100
+    if len(argv) > 1:
+        count = int(argv[1])
+    dir = tempfile.mkdtemp()
+    try:
+        (ch_gid, ch_keys) = cert_util.create_cert(CH_URN, ca=True)
+        keyfile = os.path.join(dir, 'ch-key.pem')
+        certfile = os.path.join(dir, 'ch-cert.pem')
+        ch_keys.save_to_file(keyfile)
+        ch_gid.save_to_file(certfile)
+        urns = ['urn:publicid:IDN+ch.example.net+user+user%d' % i for i in range(count)]
+
+        start = time.time()
+        for urn in urns:
+            cert_util.create_cert(urn, keyfile, certfile)
+        report("Certificates one at a time", count, time.time() - start)
+
+        start = time.time()
+        cert_util.create_certs(urns, keyfile, certfile, processes=1)
+        report("Certificates in bulk, 1 process", count, time.time() - start)
+
+        processes = multiprocessing.cpu_count()
+        start = time.time()
+        certs = cert_util.create_certs(urns, keyfile, certfile, processes=processes)
+        report("Certificates in bulk, one process per CPU (%d)" % processes, count, time.time() - start)
+
+        if cred.Credential().xmlsec_path == '':
+            print "xmlsec1 is not installed: not creating credentials"
+            return
+        pairs = [(gid, gid) for (gid, keys) in certs]
+        expiration = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        for threads in (1, 4):
+            start = time.time()
+            cred_util.create_credentials(pairs, expiration, 'user', keyfile, certfile,
+                                         [certfile], threads=threads)
+            report("Credentials, %d thread(s)" % threads, count, time.time() - start)
+    finally:
+        shutil.rmtree(dir)
+
+if __name__ == '__main__':
+    main(sys.argv)
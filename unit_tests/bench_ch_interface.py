@@ -0,0 +1,104 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Benchmark of clearinghouse calls against the local stub clearinghouse
+of test_ch_interface: requests per second with the shared CHClient,
+and with a new urllib2 opener and connection per call as invokeCH did.
+Also compares signing with a kept signer to loading the key and certs
+for every message.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python unit_tests/bench_ch_interface.py [calls]
+"""
+
+import json
+import logging
+import sys
+import threading
+import time
+import urllib2
+
+from gcf.geni.util import cert_util
+from gcf.geni.util.ch_interface import CHClient, sign_message, decodeCHResponse
+from test_ch_interface import StubCH
+
+logger = logging.getLogger('bench.ch')
+logger.addHandler(logging.NullHandler())
+
+def old_invoke(url, operation, argsdict):
+    # invokeCH as it was, without signing
+    toencode = dict(operation=operation)
+    toencode.update(argsdict)
+    opener = urllib2.build_opener(urllib2.HTTPSHandler)
+    req = urllib2.Request(url, data=json.dumps(toencode))
+    req.add_header('Content-Type', 'application/json')
+    req.get_method = lambda: 'PUT'
+    return decodeCHResponse(opener.open(req).read(), logger)
+
+def report(what, count, elapsed):
+    print "%s: %d in %.2fs (%.0f/s)" % (what, count, elapsed, count / elapsed)
+
+def main(argv):
+    calls = 2000
+    if len(argv) > 1:
+        calls = int(argv[1])
+    ch = StubCH()
+    thread = threading.Thread(target=ch.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = ch.url + '/ch'
+    client = CHClient()
+    try:
+        start = time.time()
+        for i in range(calls):
+            old_invoke(url, 'lookup', dict(arg=i))
+        report("Calls with a new opener each", calls, time.time() - start)
+
+        start = time.time()
+        for i in range(calls):
+            client.invoke(url, 'lookup', logger, dict(arg=i))
+        report("Calls with CHClient", calls, time.time() - start)
+        print "Connections: %d" % ch.connections
+    finally:
+        for idle in client._idle.values():
+            for conn in idle:
+                conn.close()
+        ch.shutdown()
+        ch.server_close()
+
+    (gid, keys) = cert_util.create_cert('urn:publicid:IDN+ch.example.net+user+alice')
+    key = keys.as_pem()
+    certs = [gid.save_to_string()]
+    msg = json.dumps(dict(operation='lookup', arg=1))
+    signs = calls / 4
+    start = time.time()
+    for i in range(signs):
+        sign_message(key, certs, msg)
+    report("Messages signed loading the key each time", signs, time.time() - start)
+    start = time.time()
+    for i in range(signs):
+        client.sign(key, certs, msg)
+    report("Messages signed with a kept signer", signs, time.time() - start)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,107 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Report the time taken to import omni's modules, like the
+'python -X importtime' of later Pythons: for the slowest imports, the
+time spent in the module itself and including the modules it imports.
+Each target is imported in a new interpreter.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python unit_tests/bench_import_time.py [module ...]
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+TARGETS = ['gcf.oscript', 'gcf.omnilib.amhandler', 'gcf.omnilib.stitchhandler']
+SHOWN = 15
+
+def requested(name, globals, fromlist, level):
+    '''The full names of the modules an import statement may ask for'''
+    package = None
+    if globals:
+        package = globals.get('__package__')
+        if package is None and '__name__' in globals:
+            package = globals['__name__']
+            if '__path__' not in globals:
+                package = package.rpartition('.')[0]
+    bases = [name]
+    if level > 0 and package is not None:
+        base = '.'.join(package.split('.')[:len(package.split('.')) - level + 1])
+        bases = [base + '.' + name if name else base]
+    elif level < 0 and package:
+        # Implicit relative import, then absolute
+        bases = [package + '.' + name, name]
+    names = []
+    for base in bases:
+        names.extend(base + '.' + item for item in fromlist or () if item != '*')
+        names.append(base)
+    return names
+
+def child(target):
+    import __builtin__
+    real_import = __builtin__.__import__
+    # Stack of [module name, time in imports it made]
+    stack = []
+    # module name => (self, cumulative) seconds
+    times = dict()
+    def timed_import(name, globals=None, locals=None, fromlist=None, level=-1):
+        before = set(sys.modules)
+        stack.append([name, 0.0])
+        start = time.time()
+        try:
+            return real_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.time() - start
+            (name, nested) = stack.pop()
+            if stack:
+                stack[-1][1] += elapsed
+            # Only count imports that loaded something new. Python 2 also
+            # records failed implicit relative imports, as None.
+            new = [m for m in set(sys.modules) - before if sys.modules[m] is not None]
+            if new:
+                loaded = [m for m in requested(name, globals, fromlist, level) if m in new]
+                times[(loaded or sorted(new, key=len))[0]] = (elapsed - nested, elapsed)
+    __builtin__.__import__ = timed_import
+    start = time.time()
+    real_import(target)
+    __import__(target)
+    total = time.time() - start
+    __builtin__.__import__ = real_import
+    print "import %s: %.3fs, %d modules" % (target, total, len(times))
+    print "%10s | %10s | %s" % ("self [us]", "cumulative", "imported module")
+    for (name, (own, cumulative)) in sorted(times.items(), key=lambda i: -i[1][1])[:SHOWN]:
+        print "%10d | %10d | %s" % (own * 1e6, cumulative * 1e6, name)
+    print
+
+def main(argv):
+    if len(argv) > 2 and argv[1] == '--child':
+        child(argv[2])
+        return
+    for target in argv[1:] or TARGETS:
+        subprocess.call([sys.executable, os.path.abspath(__file__), '--child', target])
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,61 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Benchmark of examples/readyToLogin.py against simulated aggregates that
+each take a while to answer: the time to gather login information from
+all of them, one at a time and with several values of --parallel.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python unit_tests/bench_ready_to_login.py [aggregates] [latency]
+"""
+
+import sys
+import time
+
+import test_ready_to_login
+from test_ready_to_login import readyToLogin, FakeAMs, amURL, parseOptions
+
+def main(argv):
+    count = 10
+    if len(argv) > 1:
+        count = int(argv[1])
+    if len(argv) > 2:
+        test_ready_to_login.LATENCY = float(argv[2])
+    readyToLogin.omni.initialize = lambda argv, opts: (None, {}, [], opts)
+    readyToLogin.CallHandler = lambda framework, config, opts: None
+    readyToLogin.findUsersAndKeys = lambda: {'alice': ['/dev/null']}
+    readyToLogin.printMsg = lambda msg: None
+    print "%d aggregates, each taking %.2fs per call" % (count, test_ready_to_login.LATENCY)
+    for parallel in (1, 2, 5, 10):
+        ams = FakeAMs()
+        readyToLogin.omniCall = ams.omniCall
+        opts = parseOptions(['--parallel', str(parallel)] +
+                            sum([['-a', amURL(i)] for i in range(count)], []))
+        start = time.time()
+        (loginInfo, keys) = readyToLogin.main_no_print(opts=opts, slicen='slice')
+        elapsed = time.time() - start
+        assert len(loginInfo) == count
+        print "--parallel %2d: %.2fs (%d at once)" % (parallel, elapsed, ams.mostRunning)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,88 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Benchmark of the reservation calendars of the v3 reference AM: schedule
+100k windows on 10k resources, then look for free resources for more
+windows the way Allocate does, and renew and release them all.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python unit_tests/bench_schedule.py
+"""
+
+import datetime
+import random
+import time
+
+from gcf.geni.am.resource import Resource
+from gcf.geni.am.schedule import ResourceSchedule
+
+RESOURCES = 10000
+WINDOWS = 100000
+QUERIES = 1000
+
+def main():
+    rnd = random.Random(41)
+    t0 = datetime.datetime(2016, 3, 1)
+    resources = [Resource(i, 'vm') for i in range(RESOURCES)]
+    schedule = ResourceSchedule()
+    # Windows per resource, laid end to end with random gaps
+    nexts = [t0] * RESOURCES
+    windows = []
+    start = time.time()
+    for i in range(WINDOWS):
+        rid = rnd.randrange(RESOURCES)
+        begin = nexts[rid] + datetime.timedelta(hours=rnd.randint(0, 48))
+        end = begin + datetime.timedelta(hours=rnd.randint(1, 48))
+        nexts[rid] = end
+        schedule.reserve(resources[rid], begin, end, i)
+        windows.append((i, begin))
+    elapsed = time.time() - start
+    print "Reserved %d windows on %d resources in %.2fs (%.1fus each)" % \
+        (WINDOWS, RESOURCES, elapsed, elapsed * 1e6 / WINDOWS)
+
+    start = time.time()
+    found = 0
+    for i in range(QUERIES):
+        begin = t0 + datetime.timedelta(hours=rnd.randint(0, 24 * 300))
+        end = begin + datetime.timedelta(hours=rnd.randint(1, 48))
+        found += len(schedule.free_resources(schedule.reserved_resources(), begin, end, 4))
+    elapsed = time.time() - start
+    print "Found %d free resources for %d windows in %.2fs (%.1fus each)" % \
+        (found, QUERIES, elapsed, elapsed * 1e6 / QUERIES)
+
+    start = time.time()
+    for (owner, begin) in windows:
+        schedule.change_end(owner, begin + datetime.timedelta(hours=1))
+    elapsed = time.time() - start
+    print "Renewed %d windows in %.2fs (%.1fus each)" % \
+        (WINDOWS, elapsed, elapsed * 1e6 / WINDOWS)
+
+    start = time.time()
+    for (owner, begin) in windows:
+        schedule.release(owner)
+    elapsed = time.time() - start
+    print "Released %d windows in %.2fs (%.1fus each)" % \
+        (WINDOWS, elapsed, elapsed * 1e6 / WINDOWS)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Benchmark of ListMySlices in the reference clearinghouse with 100k
+slices, against the original scan of every slice credential.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python unit_tests/bench_slice_registry.py
+"""
+
+import datetime
+import logging
+import time
+
+from gcf.geni.ch import Clearinghouse
+
+SLICES = 100000
+OWNERS = 1000
+CALLS = 100
+
+class FakeGID(object):
+    def __init__(self, urn):
+        self.urn = urn
+
+    def get_urn(self):
+        return self.urn
+
+class FakeCred(object):
+    # Just what ListMySlices uses of a slice credential
+    def __init__(self, owner, urn, expiration):
+        self.caller = FakeGID(owner)
+        self.object = FakeGID(urn)
+        self.expiration = expiration
+
+    def get_gid_caller(self):
+        return self.caller
+
+    def get_gid_object(self):
+        return self.object
+
+def old_list_my_slices(ch, urn):
+    # Clearinghouse.ListMySlices as it was, with a dict of slices
+    ret = list()
+    for slicecred in ch.slices.values():
+        if slicecred.get_gid_caller().get_urn() == urn:
+            slice_exp = slicecred.expiration
+            sliceurn = slicecred.get_gid_object().get_urn()
+            if slice_exp <= datetime.datetime.utcnow():
+                ch.slices.pop(sliceurn)
+                continue
+            ret.append(sliceurn)
+        else:
+            ch.logger.debug("Found slice %s owned by different user %s", slicecred.get_gid_object().get_urn(), slicecred.get_gid_caller().get_urn())
+    return ret
+
+def owner(i):
+    return 'urn:publicid:IDN+ch.example.net+user+user%d' % (i % OWNERS)
+
+def time_calls(list_my_slices, ch):
+    start = time.time()
+    count = 0
+    for i in range(CALLS):
+        count += len(list_my_slices(ch, owner(i)))
+    return (time.time() - start, count)
+
+def main():
+    logging.getLogger('gcf-ch').setLevel(logging.INFO)
+    expiration = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    creds = [FakeCred(owner(i), 'urn:publicid:IDN+ch.example.net+slice+s%d' % i, expiration)
+             for i in range(SLICES)]
+
+    ch = Clearinghouse()
+    start = time.time()
+    for slice_cred in creds:
+        ch.slices[slice_cred.get_gid_object().get_urn()] = slice_cred
+    print "Registered %d slices in %.2fs" % (SLICES, time.time() - start)
+    (elapsed, count) = time_calls(Clearinghouse.ListMySlices, ch)
+    print "ListMySlices: %d calls listing %d slices in %.3fs (%.2fms each)" % \
+        (CALLS, count, elapsed, elapsed * 1e3 / CALLS)
+
+    ch = Clearinghouse()
+    ch.slices = dict((slice_cred.get_gid_object().get_urn(), slice_cred) for slice_cred in creds)
+    (elapsed, count) = time_calls(old_list_my_slices, ch)
+    print "Original ListMySlices: %d calls listing %d slices in %.3fs (%.2fms each)" % \
+        (CALLS, count, elapsed, elapsed * 1e3 / CALLS)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of refreshing the agg_nick_cache: the new cache replaces the old
+one in a single rename, and the background refresh does not keep Omni
+from exiting.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import logging
+import optparse
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib
+
+from gcf import oscript
+
+logger = logging.getLogger('omni')
+
+CACHE = "[aggregate_nicknames]\n" + \
+    "".join("am%d=urn:publicid:IDN+am%d.example.net+authority+am,https://am%d.example.net/am\n" % (i, i, i)
+            for i in range(20))
+
+class AggNickCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.dir, 'agg_nick_cache.base')
+        self.cachedir = os.path.join(self.dir, 'gcf')
+        self.opts = optparse.Values(dict(
+                aggNickCacheName=os.path.join(self.cachedir, 'agg_nick_cache'),
+                aggNickDefinitiveLocation='file:' + urllib.pathname2url(self.source)))
+        self.savedRename = os.rename
+
+    def tearDown(self):
+        os.rename = self.savedRename
+        shutil.rmtree(self.dir)
+
+    def write(self, filename, content):
+        with open(filename, 'w') as f:
+            f.write(content)
+
+    def read_cache(self):
+        with open(self.opts.aggNickCacheName) as f:
+            return f.read()
+
+    def test_new_cache(self):
+        self.write(self.source, CACHE)
+        oscript.update_agg_nick_cache(self.opts, logger)
+        self.assertEqual(self.read_cache(), CACHE)
+        # No temporary files left
+        self.assertEqual(os.listdir(self.cachedir), ['agg_nick_cache'])
+
+    def test_replace_in_one_rename(self):
+        os.makedirs(self.cachedir)
+        self.write(self.opts.aggNickCacheName, CACHE.replace('am1', 'xx1'))
+        self.write(self.source, CACHE)
+        renames = []
+        def rename(src, dst):
+            # The old cache is still complete, and the new one is next to it
+            self.assertEqual(self.read_cache(), CACHE.replace('am1', 'xx1'))
+            with open(src) as f:
+                self.assertEqual(f.read(), CACHE)
+            renames.append((os.path.dirname(src), dst))
+            self.savedRename(src, dst)
+        os.rename = rename
+        oscript.update_agg_nick_cache(self.opts, logger)
+        self.assertEqual(renames, [(self.cachedir, self.opts.aggNickCacheName)])
+        self.assertEqual(self.read_cache(), CACHE)
+        self.assertEqual(os.listdir(self.cachedir), ['agg_nick_cache'])
+
+    def test_keep_old_cache(self):
+        os.makedirs(self.cachedir)
+        self.write(self.opts.aggNickCacheName, CACHE)
+        # Download failed
+        oscript.update_agg_nick_cache(self.opts, logger)
+        # Download empty
+        self.write(self.source, '')
+        oscript.update_agg_nick_cache(self.opts, logger)
+        self.assertEqual(self.read_cache(), CACHE)
+        self.assertEqual(os.listdir(self.cachedir), ['agg_nick_cache'])
+
+    def test_background(self):
+        started = threading.Event()
+        finish = threading.Event()
+        calls = []
+        def update(opts, logger):
+            calls.append(opts)
+            started.set()
+            finish.wait()
+        savedUpdate = oscript.update_agg_nick_cache
+        oscript.update_agg_nick_cache = update
+        try:
+            oscript.update_agg_nick_cache_in_background(self.opts, logger)
+            started.wait(5)
+            updater = oscript._aggNickCacheUpdater
+            # Does not keep Omni from exiting
+            self.assertTrue(updater.daemon)
+            # Only one refresh at a time
+            oscript.update_agg_nick_cache_in_background(self.opts, logger)
+            self.assertTrue(oscript._aggNickCacheUpdater is updater)
+            finish.set()
+            updater.join(5)
+            self.assertEqual(calls, [self.opts])
+        finally:
+            finish.set()
+            oscript.update_agg_nick_cache = savedUpdate
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,301 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests that the indexed aggregate nickname lookups in handler_utils give
+the same answers as the linear scans they replaced (including the
+stitcher's alternate aggregate URL lookup), using the nicknames
+in agg_nick_cache.base, and that the index follows (re)loaded nicknames.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import ConfigParser
+import logging
+import os
+import random
+import unittest
+from StringIO import StringIO
+
+from gcf import oscript
+from gcf.omnilib.util import handler_utils
+from gcf.omnilib.util.handler_utils import _extractURL, _isBetterNick
+
+AGG_NICK_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              os.pardir, 'agg_nick_cache.base')
+
+logger = logging.getLogger('omni')
+
+# The original linear lookups from handler_utils, as the oracle
+def oldLookupAggNick(handler, aggregate_urn_or_url):
+    retNick = None
+    for nick, (urn, url) in handler.config['aggregate_nicknames'].items():
+        # Case 1
+        if aggregate_urn_or_url == urn or aggregate_urn_or_url == url:
+#            handler.logger.debug("For urn/url %s found match: %s=%s,%s", aggregate_urn_or_url, nick, urn, url)
+            if _isBetterNick(retNick, nick, handler.logger):
+                retNick = nick
+    if retNick is not None:
+        return retNick
+    for nick, (urn, url) in handler.config['aggregate_nicknames'].items():
+        # Case 2
+        if aggregate_urn_or_url.startswith(url):
+#            handler.logger.debug("Queried %s startswith url for nick %s", aggregate_urn_or_url, nick)
+            if _isBetterNick(retNick, nick, handler.logger):
+                retNick = nick
+    if retNick is not None:
+        return retNick
+    aggregate_urn_or_url = _extractURL(handler.logger, aggregate_urn_or_url)
+    for nick, (urn, url) in handler.config['aggregate_nicknames'].items():
+        # Case 3
+        if _extractURL(handler.logger,url) == aggregate_urn_or_url:
+#            handler.logger.debug("Queried & trimmed %s is end of url %s for nick %s", aggregate_urn_or_url, url, nick)
+            if _isBetterNick(retNick, nick, handler.logger):
+                retNick = nick
+    if retNick is not None:
+        return retNick
+    for nick, (urn, url) in handler.config['aggregate_nicknames'].items():
+        # Case 4
+        if aggregate_urn_or_url in urn:
+#            handler.logger.debug("Trimmed %s is in urn for %s=%s,%s", aggregate_urn_or_url, nick, urn, url)
+            if _isBetterNick(retNick, nick, handler.logger):
+                retNick = nick
+        elif _extractURL(handler.logger, url).startswith(aggregate_urn_or_url):
+            # Case 5
+#            handler.logger.debug("Trimmed %s is in url for %s=%s,%s", aggregate_urn_or_url, nick, urn, url)
+            if _isBetterNick(retNick, nick, handler.logger):
+                retNick = nick
+#    if retNick is None:
+#        handler.logger.debug("Found no match for %s", aggregate_urn_or_url)
+#    else:
+#        handler.logger.debug("Returning %s", retNick)
+    return retNick
+
+def oldLookupAggURNFromURLInNicknames(logger, config, agg_url):
+    urn = ""
+    retNick = None
+    # Take exact match else take row where agg_url startswith url in cache else
+    # take row where extractURL exact match extractURL in cache
+    nagg_url = _extractURL(logger, agg_url)
+    if agg_url:
+        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
+            if agg_url.strip() == amURL.strip() and amURN.strip() != '':
+                if _isBetterNick(retNick, nick, logger):
+                    urn = amURN.strip()
+#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches URL %s, nick %s T1)", agg_url, urn, amURL, nick)
+                    retNick = nick
+        if retNick is not None:
+            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T1)", agg_url, urn, retNick)
+            return urn
+
+        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
+            if agg_url.strip().startswith(amURL.strip()) and amURN.strip() != '':
+                if _isBetterNick(retNick, nick, logger):
+                    urn = amURN.strip()
+#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches %s T2)", agg_url, urn, amURL)
+                    retNick = nick
+        if retNick is not None:
+            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T2)", agg_url, urn, retNick)
+            return urn
+
+        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
+            if nagg_url == amURL.strip() and amURN.strip() != '':
+                if _isBetterNick(retNick, nick, logger):
+                    urn = amURN.strip()
+#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches %s T3)", agg_url, urn, amURL)
+                    retNick = nick
+        if retNick is not None:
+            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T3)", agg_url, urn, retNick)
+            return urn
+
+        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
+            extr_nick_url = _extractURL(logger, amURL)
+            if nagg_url == extr_nick_url and amURN.strip() != '':
+                if _isBetterNick(retNick, nick, logger):
+                    urn = amURN.strip()
+#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches %s T4)", agg_url, urn, amURL)
+                    retNick = nick
+        if retNick is not None:
+            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T4)", agg_url, urn, retNick)
+            return urn
+
+        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
+            extr_nick_url = _extractURL(logger, amURL)
+            if extr_nick_url.startswith(nagg_url) and amURN.strip() != '':
+                if _isBetterNick(retNick, nick, logger):
+                    urn = amURN.strip()
+#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches %s T5)", agg_url, urn, amURL)
+                    retNick = nick
+        if retNick is not None:
+            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T5)", agg_url, urn, retNick)
+            return urn
+
+        for nick, (amURN, amURL) in config['aggregate_nicknames'].items():
+            if nagg_url in amURL and amURN.strip() != '':
+                if _isBetterNick(retNick, nick, logger):
+                    urn = amURN.strip()
+#                    logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (matches %s T6)", agg_url, urn, amURL)
+                    retNick = nick
+        if retNick is not None:
+            logger.debug("Supplied AM URL %s is URN %s according to configured aggregate nicknames (nick %s T6)", agg_url, urn, retNick)
+            return urn
+    return urn
+
+def oldLookupAggNickURLFromURNInNicknames(logger, config, agg_urn):
+    url = ""
+    nick = ""
+    if agg_urn:
+        # Ignore any +cm / +am difference
+        if agg_urn.endswith('+cm') or agg_urn.endswith('+am'):
+            agg_urn = agg_urn[:-3]
+            logger.debug("Trimmed URN for lookup to %s", agg_urn)
+        for amNick in config['aggregate_nicknames'].keys():
+            (amURN, amURL) = config['aggregate_nicknames'][amNick]
+            # Pick the shortest URL / nickname for this URN - stripping of any version diff for the URL
+            if agg_urn in amURN and amURL.strip() != '':
+                if (url == "" or nick == "") or \
+                        (len(amURL) < len(url)) or \
+                        (len(amNick) < len(nick)) or \
+                        (nick.startswith('ig-') and amNick.endswith('-ig')) or \
+                        (nick.startswith('pg-') and amNick.endswith('-pg')) or \
+                        (nick.startswith('og-') and amNick.endswith('-og')) or \
+                        (nick.startswith('clab-') and amNick.endswith('-clab')) or \
+                        (nick.startswith('apt-') and amNick.endswith('-apt')) or \
+                        (nick.startswith('eg-') and amNick.endswith('-eg')):
+                    url = amURL.strip()
+                    nick = amNick.strip()
+                    logger.debug("Supplied AM URN %s is nickname %s, URL %s according to configured aggregate nicknames (matches %s)", agg_urn, nick, url, amURN)
+    return nick, url
+
+# The alternate URL loop from StitchingHandler.add_am_info, as the oracle
+def oldLookupAggAltURL(logger, config, agg_url, urn_syns):
+    for (amURN, amURL) in config['aggregate_nicknames'].values():
+        if amURN.strip() in urn_syns:
+            hadURL = _extractURL(logger, agg_url)
+            newURL = _extractURL(logger, amURL)
+            if hadURL != newURL and not hadURL in newURL and not newURL in hadURL and not newURL.strip == '':
+                return amURL.strip()
+    return None
+
+class Handler(object):
+    def __init__(self, config):
+        self.config = config
+        self.logger = logger
+
+def load_nicknames(text, config=None):
+    """Load the aggregate nicknames in the given config file text into
+    the given config, as Omni does"""
+    if config is None:
+        config = {}
+    confparser = ConfigParser.RawConfigParser()
+    confparser.readfp(StringIO(text))
+    return oscript.load_aggregate_nicknames(config, confparser, 'test', logger, None)
+
+def queries(config, rand):
+    """URNs and URLs to look up: those of the nicknames and variants of them"""
+    values = set(['', 'https://', 'boss.', 'www.', 'nosuchaggregate', 'urn:publicid:IDN'])
+    for (urn, url) in config['aggregate_nicknames'].values():
+        values.update([urn, url, urn + '+cm', urn + '+am', url.strip(),
+                       _extractURL(None, url), url + '/extra', url + ':12369',
+                       url.replace('https://', 'http://'),
+                       url.replace('https://', 'https://www.'),
+                       url.replace('https://', 'https://boss.')])
+        for value in (urn, url):
+            if len(value) > 2:
+                i = rand.randint(0, len(value) - 1)
+                j = rand.randint(i + 1, len(value))
+                values.add(value[i:j])
+                values.add(value[:j])
+    return sorted(values)
+
+class AggNickLookupTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(AGG_NICK_CACHE, 'r') as f:
+            self.config = load_nicknames(f.read())
+        self.assertTrue(len(self.config['aggregate_nicknames']) > 100)
+
+    def assertSameLookups(self, config, rand):
+        handler = Handler(config)
+        urns = sorted(set(urn.strip() for (urn, url) in config['aggregate_nicknames'].values()))
+        urlURNs = dict((url, urn.strip()) for (urn, url) in config['aggregate_nicknames'].values())
+        for value in queries(config, rand):
+            # Often the URN of the aggregate at this URL, whose other
+            # URLs are the alternates
+            urn_syns = rand.sample(urns, min(len(urns), rand.randint(0, 2)))
+            if value in urlURNs and rand.random() < 0.8:
+                urn_syns.append(urlURNs[value])
+            self.assertEqual(handler_utils._lookupAggAltURLInNicknames(logger, config, value, urn_syns),
+                             oldLookupAggAltURL(logger, config, value, urn_syns), (value, urn_syns))
+            self.assertEqual(handler_utils._lookupAggNick(handler, value),
+                             oldLookupAggNick(handler, value), value)
+            self.assertEqual(handler_utils._lookupAggURNFromURLInNicknames(logger, config, value),
+                             oldLookupAggURNFromURLInNicknames(logger, config, value), value)
+            self.assertEqual(handler_utils._lookupAggNickURLFromURNInNicknames(logger, config, value),
+                             oldLookupAggNickURLFromURNInNicknames(logger, config, value), value)
+
+    def test_agg_nick_cache(self):
+        self.assertSameLookups(self.config, random.Random(27))
+
+    def test_random_nicknames(self):
+        # Random subsets of the nicknames, with some URNs cleared,
+        # so that ties and missing URNs come up in different orders
+        rand = random.Random(2027)
+        allNicks = self.config['aggregate_nicknames'].items()
+        for i in range(20):
+            nicknames = dict()
+            for (nick, (urn, url)) in rand.sample(allNicks, 60):
+                if rand.random() < 0.2:
+                    urn = ''
+                nicknames[nick] = [urn, url]
+            self.assertSameLookups({'aggregate_nicknames': nicknames}, rand)
+
+    def test_reload_in_place(self):
+        # Loading more nicknames into the same dictionary, redefining one
+        # without changing the number of nicknames, updates the index
+        config = load_nicknames("[aggregate_nicknames]\n"
+                                "a-ig=urn:publicid:IDN+a.example.net+authority+cm,https://a.example.net/am\n"
+                                "b-ig=urn:publicid:IDN+b.example.net+authority+cm,https://b.example.net/am\n")
+        handler = Handler(config)
+        self.assertEqual(handler_utils._lookupAggNick(handler, 'https://b.example.net/am'), 'b-ig')
+        nicknames = config['aggregate_nicknames']
+        load_nicknames("[aggregate_nicknames]\n"
+                       "b-ig=urn:publicid:IDN+c.example.net+authority+cm,https://c.example.net/am\n",
+                       config)
+        self.assertTrue(config['aggregate_nicknames'] is nicknames)
+        self.assertEqual(len(nicknames), 2)
+        self.assertEqual(handler_utils._lookupAggNick(handler, 'https://b.example.net/am'), None)
+        self.assertEqual(handler_utils._lookupAggNick(handler, 'https://c.example.net/am'), 'b-ig')
+        self.assertEqual(handler_utils._lookupAggURNFromURLInNicknames(logger, config, 'https://c.example.net/am'),
+                         'urn:publicid:IDN+c.example.net+authority+cm')
+
+    def test_replaced_nicknames(self):
+        # A config whose nicknames were replaced gets a new index
+        config = {'aggregate_nicknames': {'a': ['urn:publicid:IDN+a.example.net+authority+cm', 'https://a.example.net/am']}}
+        handler = Handler(config)
+        self.assertEqual(handler_utils._lookupAggNick(handler, 'https://a.example.net/am'), 'a')
+        config['aggregate_nicknames'] = {'b': ['urn:publicid:IDN+a.example.net+authority+cm', 'https://a.example.net/am']}
+        self.assertEqual(handler_utils._lookupAggNick(handler, 'https://a.example.net/am'), 'b')
+
+if __name__ == '__main__':
+    unittest.main()
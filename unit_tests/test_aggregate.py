@@ -0,0 +1,264 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests that gcf.geni.am.aggregate.Aggregate, which keeps a pool of free
+resources, tracks allocations the same way as the list based Aggregate
+it replaced.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import collections
+import datetime
+import random
+import shutil
+import tempfile
+import unittest
+
+from gcf.geni.am import am2, am3
+from gcf.geni.am.aggregate import Aggregate
+from gcf.geni.am.resource import Resource
+
+class OldAggregate(object):
+    # aggregate.Aggregate as it was, with a list of resources per container
+
+    def __init__(self):
+        self.resources = []
+        self.containers = {} # of resources, not slivers
+
+    def add_resources(self, resources):
+        self.resources.extend(resources)
+
+    def catalog(self, container=None):
+        if container:
+            if container in self.containers:
+                return self.containers[container]
+            else:
+                return []
+        else:
+            return self.resources
+
+    def allocate(self, container, resources):
+        if container not in self.containers:
+            self.containers[container] = []
+        for r in resources:
+            self.containers[container].append(r)
+
+    def deallocate(self, container, resources):
+        if container and not self.containers.has_key(container):
+            return
+        if container and resources:
+            for r in resources:
+                self.containers[container].remove(r)
+        elif container:
+            container_resources = list(self.containers[container])
+            for r in container_resources:
+                self.containers[container].remove(r)
+        elif resources:
+            for r in resources:
+                for c in self.containers.values():
+                    if r in c:
+                        c.remove(r)
+        allkeys = self.containers.keys()
+        for k in allkeys:
+            if not self.containers[k]:
+                del self.containers[k]
+
+    def stop(self, container):
+        if container in self.containers:
+            for r in self.containers[container]:
+                r.status = Resource.STATUS_SHUTDOWN
+
+CONTAINERS = ['urn:publicid:IDN+geni:gpo:gcf+slice+s%d' % i for i in range(4)] + \
+    ['urn:publicid:IDN+geni:gpo:gcf+user+u%d' % i for i in range(3)]
+
+class AggregateEquivalenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.resources = [Resource(i, 'vm' if i % 3 else 'host') for i in range(30)]
+        self.old = OldAggregate()
+        self.new = Aggregate()
+        self.old.add_resources(self.resources)
+        self.new.add_resources(self.resources)
+
+    def check(self):
+        self.assertEqual(sorted(self.old.containers.keys()), sorted(self.new.containers.keys()))
+        for c in CONTAINERS:
+            # The old lists have a resource once per allocation
+            held = collections.Counter(r.id for r in self.old.catalog(c))
+            self.assertEqual(set(held.keys()), set(r.id for r in self.new.catalog(c)))
+            for (rid, count) in held.items():
+                self.assertEqual(self.new._holders[rid][c], count)
+        used = set(r.id for c in self.old.containers.values() for r in c)
+        for rtype in (None, 'vm', 'host'):
+            free = [r.id for r in self.resources
+                    if r.id not in used and (rtype is None or r.type == rtype)]
+            self.assertEqual(sorted(r.id for r in self.new.iter_free(rtype)), free)
+        for r in self.resources:
+            self.assertEqual(self.new.is_free(r), r.id not in used)
+        self.assertEqual(self.new.catalog(), self.old.catalog())
+
+    def test_random_operations(self):
+        rnd = random.Random(42)
+        for step in range(3000):
+            op = rnd.random()
+            c = rnd.choice(CONTAINERS)
+            if op < 0.4:
+                rs = rnd.sample(self.resources, rnd.randint(1, 4))
+                self.old.allocate(c, rs)
+                self.new.allocate(c, rs)
+            elif op < 0.7:
+                # The old Aggregate fails on resources not in the container
+                held = self.old.catalog(c)
+                if held:
+                    rs = rnd.sample(held, rnd.randint(1, min(3, len(held))))
+                    self.old.deallocate(c, rs)
+                    self.new.deallocate(c, rs)
+            elif op < 0.8:
+                self.old.deallocate(c, None)
+                self.new.deallocate(c, None)
+            elif op < 0.9:
+                rs = rnd.sample(self.resources, rnd.randint(1, 3))
+                self.old.deallocate(None, rs)
+                self.new.deallocate(None, rs)
+            else:
+                # Unknown containers are ignored
+                self.old.deallocate('urn:publicid:IDN+geni:gpo:gcf+slice+none', self.resources[:2])
+                self.new.deallocate('urn:publicid:IDN+geni:gpo:gcf+slice+none', self.resources[:2])
+            self.check()
+
+    def test_free_resources(self):
+        self.new.allocate(CONTAINERS[0], self.resources[:10])
+        self.assertEqual([r.id for r in self.new.free_resources(5)], range(10, 15))
+        self.assertEqual([r.id for r in self.new.free_resources(3, 'host')], [12, 15, 18])
+        # Resources freed go to the end of the pool
+        self.new.deallocate(CONTAINERS[0], self.resources[:1])
+        self.assertEqual(self.new.free_resources()[-1].id, 0)
+
+    def test_release_from_holders(self):
+        # As am3 expire_slivers and Delete do: releasing from the slice and
+        # its user leaves the resource held by another slice
+        r = self.resources[:1]
+        for agg in (self.old, self.new):
+            agg.allocate(CONTAINERS[0], r)
+            agg.allocate(CONTAINERS[4], r)
+            agg.allocate(CONTAINERS[1], r)
+            agg.allocate(CONTAINERS[5], r)
+            agg.deallocate(CONTAINERS[0], r)
+            agg.deallocate(CONTAINERS[4], r)
+        self.check()
+        self.assertFalse(self.new.is_free(r[0]))
+        self.assertEqual(sorted(self.new.containers.keys()), sorted([CONTAINERS[1], CONTAINERS[5]]))
+
+    def test_stop(self):
+        self.new.allocate(CONTAINERS[0], self.resources[:2])
+        self.new.stop(CONTAINERS[0])
+        self.assertEqual([r.status for r in self.resources[:3]],
+                         [Resource.STATUS_SHUTDOWN, Resource.STATUS_SHUTDOWN, Resource.STATUS_UNKNOWN])
+
+SLICE_URN = 'urn:publicid:IDN+geni:gpo:gcf+slice+s0'
+USER_A = 'urn:publicid:IDN+geni:gpo:gcf+user+a'
+USER_B = 'urn:publicid:IDN+geni:gpo:gcf+user+b'
+
+REQUEST = '''<rspec xmlns="http://www.geni.net/resources/rspec/3" type="request">
+  <node client_id="n1"/><node client_id="n2"/><node client_id="n3"/>
+</rspec>'''
+
+class FakeGID(object):
+    # The caller cert option is simply the caller URN
+    def __init__(self, string=None):
+        self.urn = string
+    def get_urn(self):
+        return self.urn
+
+class FakeGIDModule(object):
+    GID = FakeGID
+
+class FakeCred(object):
+    expiration = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+
+class FakeVerifier(object):
+    def verify_from_strings(self, *args):
+        return [FakeCred()]
+
+class FakeServer(object):
+    def get_pem_cert(self):
+        return None
+
+class DeleteByOtherMemberTest(unittest.TestCase):
+    # A slice member other than the one who created the sliver deletes it:
+    # the creator's hold on the resources must go too
+
+    def setUp(self):
+        self.certdir = tempfile.mkdtemp()
+        self.saved = (am2.gid, am3.gid)
+        am2.gid = am3.gid = FakeGIDModule()
+
+    def tearDown(self):
+        (am2.gid, am3.gid) = self.saved
+        shutil.rmtree(self.certdir)
+
+    def makeAM(self, module):
+        am = module.ReferenceAggregateManager(self.certdir, 'geni:gpo:gcf', 'https://localhost:8001/')
+        am._cred_verifier = FakeVerifier()
+        am._server = FakeServer()
+        return am
+
+    def checkAllFree(self, am):
+        self.assertEqual(am._agg.containers, {})
+        self.assertEqual(len(am._agg.free_resources()), len(am._agg.catalog()))
+
+    def test_am2_delete_sliver(self):
+        am = self.makeAM(am2)
+        result = am.CreateSliver(SLICE_URN, [], REQUEST, [], {'geni_true_caller_cert': USER_A})
+        self.assertEqual(result['code']['geni_code'], 0)
+        self.assertEqual(sorted(am._agg.containers.keys()), [SLICE_URN, USER_A])
+        result = am.DeleteSliver(SLICE_URN, [], {'geni_true_caller_cert': USER_B})
+        self.assertEqual(result['code']['geni_code'], 0)
+        self.checkAllFree(am)
+        # The resources can be used again
+        result = am.CreateSliver(SLICE_URN, [], REQUEST, [], {'geni_true_caller_cert': USER_B})
+        self.assertEqual(result['code']['geni_code'], 0)
+
+    def test_am3_delete(self):
+        am = self.makeAM(am3)
+        now = datetime.datetime.utcnow()
+        result = am.Allocate(SLICE_URN, [], REQUEST,
+                             {'geni_true_caller_cert': USER_A,
+                              'geni_end_time': (now + datetime.timedelta(hours=2)).isoformat()})
+        self.assertEqual(result['code']['geni_code'], 0)
+        # Another member adds slivers for a later time
+        result = am.Allocate(SLICE_URN, [], REQUEST.replace('"n', '"m'),
+                             {'geni_true_caller_cert': USER_B,
+                              'geni_start_time': (now + datetime.timedelta(hours=3)).isoformat()})
+        self.assertEqual(result['code']['geni_code'], 0)
+        self.assertEqual(sorted(am._agg.containers.keys()), [SLICE_URN, USER_A, USER_B])
+        self.assertEqual(len(am._agg.catalog(USER_A)), 3)
+        self.assertEqual(len(am._agg.catalog(USER_B)), 3)
+        result = am.Delete([SLICE_URN], [], {'geni_true_caller_cert': USER_B})
+        self.assertEqual(result['code']['geni_code'], 0)
+        self.checkAllFree(am)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of creating certificates, keys and credentials in bulk.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import datetime
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from gcf.geni.util import cert_util
+from gcf.geni.util import cred_util
+from gcf.sfa.trust import credential as cred
+
+CH_URN = 'urn:publicid:IDN+ch.example.net+authority+ch'
+
+def user_urn(i):
+    return 'urn:publicid:IDN+ch.example.net+user+user%d' % i
+
+def slice_urn(i):
+    return 'urn:publicid:IDN+ch.example.net+slice+slice%d' % i
+
+def have_xmlsec():
+    # Where sfa.trust.credential looks for it
+    return cred.Credential().xmlsec_path != ''
+
+class BulkTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        (cls.ch_gid, cls.ch_keys) = cert_util.create_cert(CH_URN, ca=True)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check_distinct(self, keys):
+        pems = [k.as_pem() for k in keys]
+        self.assertEqual(len(set(pems)), len(pems))
+
+    def test_keypairs(self):
+        self.assertEqual(cert_util.create_keypairs(0), [])
+        keys = cert_util.create_keypairs(3, processes=2)
+        self.assertEqual(len(keys), 3)
+        self.check_distinct(keys)
+        # Usable: can sign a certificate
+        (gid, k) = cert_util.create_cert(user_urn(0), self.ch_keys, self.ch_gid, keys=keys[1])
+        self.assertTrue(gid.is_pubkey(keys[1]))
+
+    def test_one_process(self):
+        # No pool of processes for one process
+        savedPool = multiprocessing.Pool
+        def noPool(*args):
+            raise AssertionError("Pool used")
+        multiprocessing.Pool = noPool
+        try:
+            keys = cert_util.create_keypairs(3, processes=1)
+            certs = cert_util.create_certs([user_urn(i) for i in range(2)],
+                                           self.ch_keys, self.ch_gid, processes=0)
+        finally:
+            multiprocessing.Pool = savedPool
+        self.assertEqual(len(keys), 3)
+        self.check_distinct(keys)
+        self.assertEqual([gid.get_urn() for (gid, k) in certs], [user_urn(i) for i in range(2)])
+
+    def test_certs(self):
+        urns = [user_urn(i) for i in range(3)] + [slice_urn(i) for i in range(2)]
+        # The issuer loaded from files, as gen-certs does
+        keyfile = os.path.join(self.dir, 'ch-key.pem')
+        certfile = os.path.join(self.dir, 'ch-cert.pem')
+        self.ch_keys.save_to_file(keyfile)
+        self.ch_gid.save_to_file(certfile)
+        certs = cert_util.create_certs(urns, keyfile, certfile, processes=2)
+        self.assertEqual([gid.get_urn() for (gid, k) in certs], urns)
+        self.check_distinct([k for (gid, k) in certs])
+        for (gid, k) in certs:
+            self.assertTrue(gid.is_pubkey(k))
+            self.assertTrue(gid.is_signed_by_cert(self.ch_gid))
+            self.assertEqual(gid.get_extension('basicConstraints'), 'CA:FALSE')
+            self.assertEqual(gid.get_issuer(), self.ch_gid.get_subject())
+            gid.verify_chain([self.ch_gid])
+
+    def test_self_signed(self):
+        certs = cert_util.create_certs([user_urn(0), user_urn(1)], processes=1)
+        for (gid, k) in certs:
+            self.assertTrue(gid.is_signed_by_cert(gid))
+            self.assertFalse(gid.is_signed_by_cert(self.ch_gid))
+
+    @unittest.skipUnless(have_xmlsec(), "xmlsec1 is not installed")
+    def test_credentials(self):
+        keyfile = os.path.join(self.dir, 'ch-key.pem')
+        certfile = os.path.join(self.dir, 'ch-cert.pem')
+        self.ch_keys.save_to_file(keyfile)
+        self.ch_gid.save_to_file(certfile)
+        users = [gid for (gid, k) in cert_util.create_certs([user_urn(i) for i in range(2)],
+                                                             self.ch_keys, self.ch_gid, processes=1)]
+        slices = [gid for (gid, k) in cert_util.create_certs([slice_urn(i) for i in range(3)],
+                                                              self.ch_keys, self.ch_gid, processes=1)]
+        pairs = [(users[i % 2], slices[i]) for i in range(3)]
+        expiration = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        creds = cred_util.create_credentials(pairs, expiration, 'slice', keyfile, certfile,
+                                             [certfile], threads=2)
+        self.assertEqual([(c.get_gid_caller().get_urn(), c.get_gid_object().get_urn()) for c in creds],
+                         [(user_urn(i % 2), slice_urn(i)) for i in range(3)])
+        for c in creds:
+            c.verify([certfile])
+
+if __name__ == '__main__':
+    unittest.main()
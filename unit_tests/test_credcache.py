@@ -0,0 +1,158 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of the on disk credential cache, and its use by the CHAPI framework.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import datetime
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from gcf.omnilib.util import credcache
+from gcf.omnilib.util.credcache import CredentialCache
+from gcf.omnilib.frameworks import framework_chapi
+
+CH_URL = 'https://ch.example.net:8444/'
+USER_URN = 'urn:publicid:IDN+ch.example.net+user+alice'
+SLICE_URN = 'urn:publicid:IDN+ch.example.net:proj+slice+s1'
+
+CRED = '''<?xml version="1.0"?>
+<signed-credential><credential xml:id="ref0">
+<type>privilege</type>
+<owner_urn>%s</owner_urn>
+<target_urn>%s</target_urn>
+<target_gid>MIIB</target_gid>
+<expires>%s</expires>
+</credential></signed-credential>'''
+
+def cred_struct(expires):
+    return {'geni_type': 'geni_sfa', 'geni_version': '3',
+            'geni_value': CRED % (USER_URN, SLICE_URN, expires.strftime('%Y-%m-%dT%H:%M:%SZ'))}
+
+class CacheTestCase(unittest.TestCase):
+    # A cache in a temporary directory
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.logger = logging.getLogger('test.credcache')
+        self.cache = CredentialCache(self.cachedir, self.logger)
+        self.now = datetime.datetime.utcnow().replace(microsecond=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def entry_file(self):
+        return self.cache._filename(CH_URL, USER_URN, SLICE_URN)
+
+    def edit_entry(self, func):
+        with open(self.entry_file()) as f:
+            entry = json.load(f)
+        func(entry)
+        with open(self.entry_file(), 'w') as f:
+            json.dump(entry, f)
+
+class CredentialCacheTest(CacheTestCase):
+
+    def test_put_get(self):
+        cred = cred_struct(self.now + datetime.timedelta(days=1))
+        self.cache.put(CH_URL, USER_URN, SLICE_URN, cred)
+        self.assertEqual(self.cache.get(CH_URL, USER_URN, SLICE_URN), cred)
+        self.assertEqual(self.cache.get(CH_URL, USER_URN, USER_URN), None)
+        self.cache.invalidate(CH_URL, USER_URN, SLICE_URN)
+        self.assertEqual(self.cache.get(CH_URL, USER_URN, SLICE_URN), None)
+
+    def test_short_lived_not_saved(self):
+        self.cache.put(CH_URL, USER_URN, SLICE_URN, cred_struct(self.now + datetime.timedelta(minutes=1)))
+        self.assertFalse(os.path.exists(self.entry_file()))
+
+    def test_capped_at_cred_expiration(self):
+        self.cache.put(CH_URL, USER_URN, SLICE_URN, cred_struct(self.now + datetime.timedelta(days=1)))
+        # The entry claims a later expiration than the credential has
+        def swap_cred(entry):
+            entry['expires'] = (self.now + datetime.timedelta(days=30)).isoformat()
+            entry['cred'] = cred_struct(self.now + datetime.timedelta(minutes=5))
+        self.edit_entry(swap_cred)
+        self.assertEqual(self.cache.get(CH_URL, USER_URN, SLICE_URN), None)
+
+    def test_too_old(self):
+        self.cache.put(CH_URL, USER_URN, SLICE_URN, cred_struct(self.now + datetime.timedelta(days=1)))
+        def age(entry):
+            entry['fetched'] = (self.now - credcache.MAX_AGE - datetime.timedelta(minutes=1)).isoformat()
+        self.edit_entry(age)
+        self.assertEqual(self.cache.get(CH_URL, USER_URN, SLICE_URN), None)
+
+class BareFramework(framework_chapi.Framework):
+    # Only the attributes the credential cache methods use
+    def __init__(self, logger, cache):
+        self.logger = logger
+        self.opts = None
+        self.ch_url = CH_URL
+        self.user_urn = USER_URN
+        self.user_cred = None
+        self.user_cred_struct = None
+        self._credcache = cache
+        self._used_cached_creds = set()
+
+    def _cred_cache_user(self):
+        return USER_URN
+
+class FrameworkCredCacheTest(CacheTestCase):
+    '''The CHAPI framework falls back to the CH on a corrupt cache entry,
+    and forgets cached credentials an AM rejected.'''
+
+    def setUp(self):
+        CacheTestCase.setUp(self)
+        self.framework = BareFramework(self.logger, self.cache)
+
+    def test_corrupt_entry(self):
+        self.cache.put(CH_URL, USER_URN, SLICE_URN, cred_struct(self.now + datetime.timedelta(days=1)))
+        def corrupt(entry):
+            entry['cred']['geni_value'] = u'<signed-credential>\u2603</signed-credential>'
+        self.edit_entry(corrupt)
+        self.assertRaises(UnicodeEncodeError, self.cache.get, CH_URL, USER_URN, SLICE_URN)
+        self.assertEqual(self.framework._get_cached_cred(SLICE_URN), None)
+        self.assertFalse(os.path.exists(self.entry_file()))
+
+    def test_put_failure_ignored(self):
+        def fail(*args):
+            raise IOError("disk full")
+        self.cache.put = fail
+        self.framework._cache_cred(SLICE_URN, cred_struct(self.now + datetime.timedelta(days=1)))
+
+    def test_forget_rejected(self):
+        cred = cred_struct(self.now + datetime.timedelta(days=1))
+        self.cache.put(CH_URL, USER_URN, SLICE_URN, cred)
+        self.assertEqual(self.framework._get_cached_cred(SLICE_URN), cred)
+        self.framework.forget_cached_creds()
+        self.assertFalse(os.path.exists(self.entry_file()))
+        self.assertEqual(self.framework._get_cached_cred(SLICE_URN), None)
+
+if __name__ == '__main__':
+    unittest.main()
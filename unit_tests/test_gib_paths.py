@@ -0,0 +1,179 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests that the GENI-in-a-box shortest path searches find the same paths
+as the original depth first search, on the sample request RSpecs in
+gib-rspec-examples and on random topologies.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import glob
+import os
+import random
+import unittest
+from xml.dom.minidom import parse
+
+from gcf.geni.am.gibaggregate import graphUtils
+from gcf.geni.am.gibaggregate.graphUtils import GraphNode
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir, 'gib-rspec-examples')
+
+# The original findShortestPath from graphUtils, as the oracle
+def oldFindShortestPath(startNode, endNode, pathSoFar =[]) :
+    """ Find the shortest path between the specified GraphNode objects 
+        that form the nodes of a graph.
+    """
+    # Add this node to the path explored so far
+    pathSoFar = pathSoFar + [startNode]
+
+    if startNode == endNode :
+        # Found path to the endNode!
+        return pathSoFar
+
+    # Path from here to the endNode.  We currently don't have such a path
+    pathFromHere =  None
+
+    # See if we can get to the endNode through one of our neighbors
+    neighbors = startNode.getNeighbors() 
+    for i in range(len(neighbors)) :
+        if neighbors[i] not in pathSoFar :
+            pathThruNeighbor = oldFindShortestPath(neighbors[i], endNode, \
+                                                    pathSoFar)
+            if pathThruNeighbor != None :
+                if (pathFromHere == None) or (len(pathThruNeighbor) < \
+                                                  len(pathFromHere)) :
+                    # Found a new or shorter path to the endNode 
+                    pathFromHere = pathThruNeighbor
+
+    return pathFromHere
+
+# Hosts, NICs and links connected as in gibaggregate.resources
+class Host(GraphNode):
+    def __init__(self, name):
+        self.name = name
+        self.NICs = []
+    def getNeighbors(self):
+        return self.NICs
+    def getNodeName(self):
+        return self.name
+
+class NIC(GraphNode):
+    def __init__(self, name, host):
+        self.name = name
+        self.myHost = host
+        self.link = None
+    def getNeighbors(self):
+        return [self.link, self.myHost]
+    def getNodeName(self):
+        return self.name
+
+class Link(GraphNode):
+    def __init__(self, name):
+        self.name = name
+        self.endPoints = []
+    def getNeighbors(self):
+        return self.endPoints
+    def getNodeName(self):
+        return self.name
+
+def parseTopology(filename):
+    """Return the hosts and links in the given request RSpec, as
+    gibaggregate.rspec_handler.parseRequestRspec builds them."""
+    dom = parse(filename)
+    hosts = []
+    nics = {}
+    for node in dom.getElementsByTagName('node'):
+        host = Host(node.getAttribute('client_id'))
+        hosts.append(host)
+        for interface in node.getElementsByTagName('interface'):
+            nic = NIC(interface.getAttribute('client_id'), host)
+            host.NICs.append(nic)
+            nics[nic.name] = nic
+    links = []
+    for linkElement in dom.getElementsByTagName('link'):
+        link = Link(linkElement.getAttribute('client_id'))
+        links.append(link)
+        for ref in linkElement.getElementsByTagName('interface_ref'):
+            nic = nics[ref.getAttribute('client_id')]
+            nic.link = link
+            link.endPoints.append(nic)
+    return hosts, links
+
+def randomTopology(rand):
+    """Return the hosts and links of a random topology: up to 6 hosts
+    with up to 3 NICs each, with the NICs on a few links."""
+    hosts = [Host('h%d' % i) for i in range(rand.randint(1, 6))]
+    links = [Link('l%d' % i) for i in range(rand.randint(1, 4))]
+    for host in hosts:
+        for i in range(rand.randint(0, 3)):
+            nic = NIC('%s:if%d' % (host.name, i), host)
+            host.NICs.append(nic)
+            nic.link = rand.choice(links)
+            nic.link.endPoints.append(nic)
+    # Links are in NIC order, as in the RSpec: shuffle them for more ties
+    for link in links:
+        rand.shuffle(link.endPoints)
+    return hosts, links
+
+def names(path):
+    if path is None:
+        return None
+    return [node.getNodeName() for node in path]
+
+class PathEquivalenceTest(unittest.TestCase):
+
+    def assertSamePaths(self, hosts, links, label):
+        # Every path resources._generateBashScript may look for, and more
+        targets = list(links)
+        for host in hosts:
+            targets.append(host)
+            targets.extend(host.NICs)
+        adjacency = graphUtils.buildAdjacency(hosts)
+        for host in hosts:
+            tree = graphUtils.shortestPathTree(host, adjacency)
+            treeNoAdjacency = graphUtils.shortestPathTree(host)
+            for target in targets:
+                expected = names(oldFindShortestPath(host, target))
+                msg = "%s: path from %s to %s" % (label, host.getNodeName(), target.getNodeName())
+                self.assertEqual(names(graphUtils.pathFromTree(tree, target)), expected, msg)
+                self.assertEqual(names(graphUtils.pathFromTree(treeNoAdjacency, target)), expected, msg)
+                self.assertEqual(names(graphUtils.findShortestPath(host, target, adjacency)), expected, msg)
+
+    def test_example_rspecs(self):
+        filenames = sorted(glob.glob(os.path.join(EXAMPLES_DIR, '*.rspec')))
+        self.assertTrue(filenames, "No RSpecs in %s" % EXAMPLES_DIR)
+        for filename in filenames:
+            hosts, links = parseTopology(filename)
+            self.assertSamePaths(hosts, links, os.path.basename(filename))
+
+    def test_random_topologies(self):
+        rand = random.Random(36)
+        for i in range(200):
+            hosts, links = randomTopology(rand)
+            self.assertSamePaths(hosts, links, "topology %d" % i)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests that starting omni does not import the handler, credential and
+SSL modules that most commands never need. See bench_import_time.py
+for the time each import takes.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+# Modules omni commands load only when they need them
+DEFERRED = ['M2Crypto', 'OpenSSL', 'lxml', 'dateutil', 'xml.dom.minidom',
+            'gcf.geni.ch', 'gcf.geni.util.cred_util', 'gcf.sfa.trust.credential',
+            'gcf.omnilib.handler', 'gcf.omnilib.amhandler', 'gcf.omnilib.chhandler',
+            'gcf.omnilib.stitchhandler', 'gcf.omnilib.frameworks.framework_base']
+
+def imported_after(statement):
+    '''Return the DEFERRED modules imported by running statement in a new interpreter'''
+    code = 'import sys\n%s\nprint(" ".join(m for m in %r if m in sys.modules))' % (statement, DEFERRED)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+    proc = subprocess.Popen([sys.executable, '-c', code], env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    (out, err) = proc.communicate()
+    if proc.returncode != 0:
+        raise AssertionError("Failed to run %r: %s" % (statement, err))
+    return out.split()
+
+class ImportTest(unittest.TestCase):
+
+    def test_oscript(self):
+        self.assertEqual(imported_after('import gcf.oscript'), [])
+
+    def test_util(self):
+        self.assertEqual(imported_after('from gcf.omnilib.util import handler_utils, OmniError'), [])
+
+    def test_handler(self):
+        # Still all there once a command needs them
+        imported = imported_after('from gcf.omnilib import amhandler')
+        for module in ('gcf.omnilib.amhandler', 'gcf.sfa.trust.credential', 'M2Crypto'):
+            self.assertTrue(module in imported, module)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,339 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of OmniSession, which runs many Omni calls in one process re-using
+the control framework, of batches of commands run in one session
+(omni --batch), and of the Omni daemon which serves Omni commands
+with one OmniSession. Omni's API_call and load_framework are replaced
+by stubs, so no config file, framework or aggregate is needed.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import json
+import logging
+import os
+import shutil
+import socket
+import stat
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from StringIO import StringIO
+
+from gcf import oscript
+from gcf.oscript import OmniSession
+from gcf.omnilib import daemon
+from gcf.omnilib.util import OmniError
+
+class FakeFramework(object):
+    def __init__(self, opts):
+        self.opts = opts
+
+class StubSession(OmniSession):
+    """An OmniSession with a fixed config, in place of loading omni_config"""
+
+    def __init__(self, configureLogging=False):
+        OmniSession.__init__(self, configureLogging=configureLogging)
+        self.config = {'logger': logging.getLogger('omni'),
+                       'selected_framework': {'type': 'fake', 'ch': 'https://ch.example.net'}}
+
+    def initialize(self, argv, options=None):
+        opts, args = oscript.parse_args(argv, options)
+        return self.config, args, opts
+
+class StubOmni(object):
+    """Stands in for oscript.API_call and load_framework, recording the
+    frameworks loaded and used. Commands:
+      getversion X: return ("Got X", [X])
+      sleep S: sleep S seconds, then return
+      fail: raise an error
+      exit: exit as Omni does on bad arguments"""
+
+    def __init__(self):
+        self.loaded = []
+        self.calls = []
+        self.opts = []
+        self.running = 0
+        self.mostRunning = 0
+        self.lock = threading.Lock()
+
+    def load_framework(self, config, opts):
+        framework = FakeFramework(opts)
+        with self.lock:
+            self.loaded.append(framework)
+        return framework
+
+    def API_call(self, framework, config, args, opts, verbose=False):
+        with self.lock:
+            self.calls.append((framework, args))
+            self.opts.append(opts)
+            self.running += 1
+            self.mostRunning = max(self.mostRunning, self.running)
+        try:
+            if args[0] == 'sleep':
+                time.sleep(float(args[1]))
+            elif args[0] == 'fail':
+                raise OmniError("Failed as asked")
+            elif args[0] == 'exit':
+                raise SystemExit(2)
+            return ("Got %s" % args[-1], args[1:])
+        finally:
+            with self.lock:
+                self.running -= 1
+
+class OmniSessionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.omni = StubOmni()
+        self.saved = (oscript.API_call, oscript.load_framework)
+        oscript.API_call = self.omni.API_call
+        oscript.load_framework = self.omni.load_framework
+        self.session = StubSession()
+
+    def tearDown(self):
+        (oscript.API_call, oscript.load_framework) = self.saved
+
+class OmniSessionTest(OmniSessionTestCase):
+
+    def test_reuse(self):
+        for i in range(3):
+            self.assertEqual(self.session.call(['getversion', str(i)]), ("Got %d" % i, [str(i)]))
+        self.assertEqual(len(self.omni.loaded), 1)
+        self.assertEqual([framework for (framework, args) in self.omni.calls], self.omni.loaded * 3)
+        # The re-used framework gets each call's options
+        opts = self.omni.loaded[0].opts
+        self.session.call(['--debug', 'getversion', 'x'])
+        self.assertFalse(self.omni.loaded[0].opts is opts)
+        self.assertTrue(self.omni.loaded[0].opts.debug)
+        self.assertEqual(len(self.omni.loaded), 1)
+
+    def test_options_and_config(self):
+        # Frameworks are kept by the config and the options they depend on
+        self.session.call(['getversion', 'x'])
+        self.session.call(['--ssltimeout', '10', 'getversion', 'x'])
+        self.assertEqual(len(self.omni.loaded), 2)
+        self.session.config['selected_framework'] = {'type': 'fake', 'ch': 'https://ch2.example.net'}
+        self.session.call(['getversion', 'x'])
+        self.assertEqual(len(self.omni.loaded), 3)
+        self.session.config['selected_framework'] = {'type': 'fake', 'ch': 'https://ch.example.net'}
+        self.session.call(['--ssltimeout', '10', 'getversion', 'x'])
+        self.assertEqual(len(self.omni.loaded), 3)
+
+    def test_expiry(self):
+        self.session.call(['getversion', 'x'])
+        # Age the kept framework past FRAMEWORK_MAX_AGE
+        for free in self.session._frameworks.values():
+            free[:] = [(created - self.session.FRAMEWORK_MAX_AGE, framework)
+                       for (created, framework) in free]
+        self.session.call(['getversion', 'x'])
+        self.assertEqual(len(self.omni.loaded), 2)
+        self.assertEqual([framework for (framework, args) in self.omni.calls], self.omni.loaded)
+        # Only the new one is kept
+        self.assertEqual([framework for free in self.session._frameworks.values()
+                          for (created, framework) in free], self.omni.loaded[1:])
+
+    def test_concurrent(self):
+        # Concurrent calls each use their own framework, and keep them all
+        threads = [threading.Thread(target=self.session.call, args=(['sleep', '0.2'],))
+                   for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.omni.mostRunning, 3)
+        self.assertEqual(len(self.omni.loaded), 3)
+        self.assertEqual(len(set(framework for (framework, args) in self.omni.calls)), 3)
+        for i in range(3):
+            self.session.call(['getversion', 'x'])
+        self.assertEqual(len(self.omni.loaded), 3)
+
+    def test_no_framework(self):
+        self.session.call(['nicknames'])
+        self.assertEqual(self.omni.loaded, [])
+        self.assertEqual(self.omni.calls, [(None, ['nicknames'])])
+
+    def test_errors(self):
+        self.assertRaises(OmniError, self.session.call, ['fail'])
+        self.assertRaises(OmniError, self.session.call, 'getversion')
+        # The framework of a failed call is still kept for re-use
+        self.session.call(['getversion', 'x'])
+        self.assertEqual(len(self.omni.loaded), 1)
+
+BATCH_FILE = '''# Commands to run
+getversion a
+
+  getversion "b c"   
+sleep 0.2
+  # An indented comment
+fail
+exit
+getversion 'd' e\\ f
+'''
+
+BATCH = [['getversion', 'a'], ['getversion', 'b c'], ['sleep', '0.2'], ['fail'], ['exit'],
+         ['getversion', 'd', 'e f']]
+
+class BatchTest(OmniSessionTestCase):
+
+    def setUp(self):
+        OmniSessionTestCase.setUp(self)
+        self.dir = tempfile.mkdtemp()
+        self.batchFile = os.path.join(self.dir, 'batch.txt')
+        with open(self.batchFile, 'w') as f:
+            f.write(BATCH_FILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        OmniSessionTestCase.tearDown(self)
+
+    def expected(self):
+        return [{'argv': ['getversion', 'a'], 'text': 'Got a', 'result': ['a'], 'error': None},
+                {'argv': ['getversion', 'b c'], 'text': 'Got b c', 'result': ['b c'], 'error': None},
+                {'argv': ['sleep', '0.2'], 'text': 'Got 0.2', 'result': ['0.2'], 'error': None},
+                {'argv': ['fail'], 'text': None, 'result': None, 'error': 'OmniError: Failed as asked'},
+                {'argv': ['exit'], 'text': None, 'result': None, 'error': 'Omni exited: 2'},
+                {'argv': ['getversion', 'd', 'e f'], 'text': 'Got e f', 'result': ['d', 'e f'], 'error': None}]
+
+    def test_read_batch_file(self):
+        self.assertEqual(oscript.read_batch_file(self.batchFile), BATCH)
+
+    def test_call_batch(self):
+        self.assertEqual(list(self.session.call_batch(BATCH)), self.expected())
+        self.assertEqual(self.omni.mostRunning, 1)
+        self.assertEqual(len(self.omni.loaded), 1)
+
+    def test_call_batch_threads(self):
+        # Results come in order, though the commands after the sleep finish first
+        self.assertEqual(list(self.session.call_batch(BATCH, threads=3)), self.expected())
+        self.assertTrue(len(self.omni.loaded) <= 3)
+        # Up to threads commands run at once
+        self.omni.mostRunning = 0
+        results = list(self.session.call_batch([['sleep', '0.2']] * 6, threads=3))
+        self.assertEqual([result['error'] for result in results], [None] * 6)
+        self.assertEqual(self.omni.mostRunning, 3)
+        self.assertTrue(len(self.omni.loaded) <= 3)
+
+    def test_options(self):
+        # Options given with the batch apply to every command
+        opts, args = oscript.parse_args(['--ssltimeout', '7'])
+        results = list(self.session.call_batch([['getversion', 'a'], ['-V3', 'getversion', 'b']], opts))
+        self.assertEqual([result['error'] for result in results], [None, None])
+        self.assertEqual([opts.ssltimeout for opts in self.omni.opts], [7, 7])
+        self.assertEqual([opts.api_version for opts in self.omni.opts], [2, 3])
+
+    def runBatch(self, argv):
+        opts, args = oscript.parse_args(argv)
+        savedSession = oscript.OmniSession
+        savedStdout = sys.stdout
+        oscript.OmniSession = StubSession
+        sys.stdout = StringIO()
+        try:
+            retcode = oscript.run_batch(opts)
+            output = sys.stdout.getvalue()
+        finally:
+            oscript.OmniSession = savedSession
+            sys.stdout = savedStdout
+        return retcode, [json.loads(line) for line in output.splitlines()]
+
+    def test_run_batch(self):
+        (retcode, results) = self.runBatch(['--batch', self.batchFile, '--batchThreads', '2'])
+        self.assertEqual(retcode, 1)
+        self.assertEqual(results, self.expected())
+        with open(self.batchFile, 'w') as f:
+            f.write("getversion a\ngetversion b\n")
+        (retcode, results) = self.runBatch(['--batch', self.batchFile])
+        self.assertEqual(retcode, 0)
+        self.assertEqual([result['text'] for result in results], ['Got a', 'Got b'])
+        self.assertRaises(OmniError, self.runBatch, ['--batch', os.path.join(self.dir, 'missing')])
+
+class OmniDaemonTest(OmniSessionTestCase):
+
+    IDLE_TIMEOUT = 0.5
+
+    def setUp(self):
+        OmniSessionTestCase.setUp(self)
+        self.dir = tempfile.mkdtemp()
+        self.socketName = os.path.join(self.dir, 'sockets', 'omni.sock')
+        self.daemon = daemon.OmniDaemon(self.socketName, self.IDLE_TIMEOUT, 2, logging.getLogger('omni'))
+        self.daemon.session = self.session
+        self.thread = threading.Thread(target=self.daemon.serve)
+        self.thread.daemon = True
+        self.thread.start()
+        for i in range(100):
+            if os.path.exists(self.socketName):
+                break
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.thread.join(10)
+        shutil.rmtree(self.dir)
+        OmniSessionTestCase.tearDown(self)
+
+    def test_call(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.socketName).st_mode), 0600)
+        self.assertEqual(daemon.call_daemon(['getversion', 'x'], self.socketName), ("Got x", ['x']))
+        self.assertEqual(daemon.call_daemon(['getversion', 'y'], self.socketName), ("Got y", ['y']))
+        self.assertEqual(len(self.omni.loaded), 1)
+        # Errors come back as OmniErrors
+        try:
+            daemon.call_daemon(['fail'], self.socketName)
+            self.fail("call_daemon did not raise an error")
+        except OmniError, e:
+            self.assertEqual(str(e), "OmniError: Failed as asked")
+        self.assertRaises(OmniError, daemon.call_daemon, ['exit'], self.socketName)
+
+    def test_bad_request(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socketName)
+        try:
+            sock.sendall('["getversion"]\n')
+            reply = daemon._receive(sock)
+        finally:
+            sock.close()
+        self.assertEqual(reply['error'], "Bad request: Malformed request")
+        self.assertEqual(self.omni.calls, [])
+
+    def test_max_calls(self):
+        # At most daemonMaxCalls commands run at once
+        threads = [threading.Thread(target=daemon.call_daemon, args=(['sleep', '0.2'], self.socketName))
+                   for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(self.omni.calls), 4)
+        self.assertEqual(self.omni.mostRunning, 2)
+
+    def test_idle_exit(self):
+        daemon.call_daemon(['getversion', 'x'], self.socketName)
+        self.thread.join(10 * self.IDLE_TIMEOUT)
+        self.assertFalse(self.thread.isAlive())
+        self.assertFalse(os.path.exists(self.socketName))
+        self.assertRaises(OmniError, daemon.call_daemon, ['getversion', 'x'], self.socketName)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of the proxy AM's cache of inside keys and certs and its pool of
+clients to the real AM, under load against a local fake AM.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import os
+import shutil
+import SimpleXMLRPCServer
+import SocketServer
+import tempfile
+import threading
+import time
+import unittest
+import xmlrpclib
+
+from gcf.geni.am import proxyam
+from gcf.geni.util import ch_interface
+
+MA_URL = 'https://ch.example.net/ma'
+MEMBERS = ['member%d' % i for i in range(4)]
+
+class FakeAMHandler(SimpleXMLRPCServer.SimpleXMLRPCRequestHandler):
+    # Keep connections open between calls, and count them
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        SimpleXMLRPCServer.SimpleXMLRPCRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if self.server.reject:
+            self.send_error(403)
+            return
+        SimpleXMLRPCServer.SimpleXMLRPCRequestHandler.do_POST(self)
+
+class FakeAM(SocketServer.ThreadingMixIn, SimpleXMLRPCServer.SimpleXMLRPCServer):
+    """The real AM behind the proxy, over plain HTTP"""
+    daemon_threads = True
+
+    def __init__(self):
+        SimpleXMLRPCServer.SimpleXMLRPCServer.__init__(self, ('127.0.0.1', 0), FakeAMHandler,
+                                                       logRequests=False)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.reject = False
+        self.register_function(lambda: dict(code=dict(geni_code=0), value=dict(geni_api=2)),
+                               'GetVersion')
+        self.url = 'http://127.0.0.1:%d/' % self.server_address[1]
+
+class ProxyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.certdir = tempfile.mkdtemp()
+        self.lookups = []
+        self.savedInvokeCH = ch_interface.invokeCH
+        self.savedMakeClient = proxyam.make_client
+        ch_interface.invokeCH = self.invokeCH
+        proxyam.invokeCH = self.invokeCH
+        proxyam.make_client = self.make_client
+        self.backend = FakeAM()
+        thread = threading.Thread(target=self.backend.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.am = proxyam.ProxyAggregateManager(self.backend.url, self.certdir, 'geni:gpo:gcf')
+        # The peer cert of the member whose call this thread is handling
+        self.am._server = threading.local()
+
+    def tearDown(self):
+        # Close the idle clients, so the fake AM's handler threads end
+        with self.am._inside_certs_lock:
+            for member_id in self.am._inside_certs.keys():
+                self.am._drop_inside_cert(member_id)
+        self.am._remove_inside_cert_files()
+        self.backend.shutdown()
+        self.backend.server_close()
+        ch_interface.invokeCH = self.savedInvokeCH
+        proxyam.invokeCH = self.savedInvokeCH
+        proxyam.make_client = self.savedMakeClient
+        shutil.rmtree(self.certdir)
+
+    def invokeCH(self, url, operation, logger, argsdict):
+        if operation == 'get_services_of_type':
+            return dict(code=0, value=[dict(service_url=MA_URL)])
+        self.assertEqual((url, operation), (MA_URL, 'lookup_keys_and_certs'))
+        self.lookups.append(argsdict['member_id'])
+        return dict(code=0, value=dict(private_key='key of %s' % argsdict['member_id'],
+                                       certificate='cert of %s' % argsdict['member_id']))
+
+    def make_client(self, url, keyfile, certfile):
+        # The fake AM is plain HTTP: just check the inside key and cert are there
+        self.assertEqual(url, self.backend.url)
+        with open(keyfile) as f:
+            self.assertTrue(f.read().startswith('key of '))
+        with open(certfile) as f:
+            self.assertTrue(f.read().startswith('cert of '))
+        return xmlrpclib.ServerProxy(url)
+
+    def call_as(self, member_id):
+        self.am._server.peercert = dict(subjectAltName=(('URI', 'urn:uuid:%s' % member_id),))
+        return self.am.GetVersion(dict())
+
+    def expire_all(self):
+        for entry in self.am._inside_certs.values():
+            entry['expires'] = 0
+
+    def files(self):
+        return set(fname for entry in self.am._inside_certs.values()
+                   for fname in (entry['key'], entry['cert']))
+
+class ProxyTest(ProxyTestCase):
+
+    def test_load(self):
+        threads = 8
+        calls = 50
+        errors = []
+        def worker(n):
+            try:
+                for i in range(calls):
+                    result = self.call_as(MEMBERS[(n + i) % len(MEMBERS)])
+                    self.assertEqual(result['value'], dict(geni_api=2))
+            except Exception, e:
+                errors.append(e)
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        self.assertEqual(errors, [])
+        # One lookup per member (maybe two if members raced), and
+        # far fewer connections than calls. More threads than
+        # MAX_IDLE_CLIENTS can use one member at once, and the extra
+        # clients are dropped, so the count of connections varies.
+        self.assertEqual(sorted(set(self.lookups)), MEMBERS)
+        self.assertTrue(len(self.lookups) <= 2 * len(MEMBERS), self.lookups)
+        self.assertTrue(self.backend.connections <= threads * calls / 4, self.backend.connections)
+        for entry in self.am._inside_certs.values():
+            self.assertEqual(entry['in_use'], 0)
+            self.assertTrue(len(entry['clients']) <= self.am.MAX_IDLE_CLIENTS)
+
+    def test_reuse_and_expire(self):
+        self.call_as(MEMBERS[0])
+        self.call_as(MEMBERS[0])
+        self.assertEqual(self.lookups, MEMBERS[:1])
+        self.assertEqual(self.backend.connections, 1)
+        files = self.files()
+        self.expire_all()
+        # Another member's call forgets the expired entry and its files
+        self.call_as(MEMBERS[1])
+        self.assertEqual(self.am._inside_certs.keys(), MEMBERS[1:2])
+        for fname in files:
+            self.assertFalse(os.path.exists(fname))
+
+    def test_auth_failure(self):
+        self.call_as(MEMBERS[0])
+        files = self.files()
+        self.backend.reject = True
+        self.assertEqual(self.call_as(MEMBERS[0]), None)
+        self.assertEqual(self.am._inside_certs, dict())
+        for fname in files:
+            self.assertFalse(os.path.exists(fname))
+        self.backend.reject = False
+        self.call_as(MEMBERS[0])
+        self.assertEqual(self.lookups, MEMBERS[:1] * 2)
+
+    def test_files_kept_while_in_use(self):
+        self.am._server.peercert = dict(subjectAltName=(('URI', 'urn:uuid:%s' % MEMBERS[0]),))
+        client = self.am.make_proxy_client()
+        files = self.files()
+        self.expire_all()
+        self.call_as(MEMBERS[1])
+        for fname in files:
+            self.assertTrue(os.path.exists(fname))
+        self.am.close_proxy_client(client)
+        for fname in files:
+            self.assertFalse(os.path.exists(fname))
+
+    def test_remove_at_exit(self):
+        self.am._server.peercert = dict(subjectAltName=(('URI', 'urn:uuid:%s' % MEMBERS[0]),))
+        self.am.make_proxy_client()
+        self.call_as(MEMBERS[1])
+        files = self.files()
+        self.assertEqual(len(files), 4)
+        self.am._remove_inside_cert_files()
+        for fname in files:
+            self.assertFalse(os.path.exists(fname))
+
+if __name__ == '__main__':
+    unittest.main()
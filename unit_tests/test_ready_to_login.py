@@ -0,0 +1,184 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of examples/readyToLogin.py gathering login information from
+several simulated aggregates at once, sharing one saved slice
+credential, without changing the caller's options.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+sys.path.insert(0, EXAMPLES)
+import readyToLogin
+
+# Seconds each simulated aggregate takes to answer
+LATENCY = 0.1
+
+CRED = '<?xml version="1.0"?><signed-credential><credential xml:id="ref0"></credential></signed-credential>'
+
+MANIFEST = ('<rspec xmlns="http://www.geni.net/resources/rspec/3" type="manifest">'
+            '<node client_id="node0" sliver_id="%s"><services>'
+            '<login authentication="ssh-keys" hostname="pc1.%s" port="22" username="alice"/>'
+            '</services></node></rspec>')
+
+def amURL(i):
+    return 'https://am%d.example.net:12369/protogeni/xmlrpc/am/2.0' % i
+
+def sliverURN(url):
+    return 'urn:publicid:IDN+%s+sliver+1' % url.split('/')[2].split(':')[0]
+
+class FakeAMs(object):
+    """Stands in for readyToLogin.omniCall, answering as ProtoGENI
+    aggregates at the URLs in the aggregate option, after LATENCY seconds"""
+
+    def __init__(self):
+        self.calls = []
+        # The module's slicecredfile option at each call
+        self.moduleCredFiles = set()
+        self.running = 0
+        self.mostRunning = 0
+        self.lock = threading.Lock()
+
+    def omniCall(self, argv, opts):
+        command = argv[-2] if argv[-1] == 'slice' else argv[-1]
+        credFile = opts.slicecredfile
+        with self.lock:
+            self.calls.append((command, list(opts.aggregate), credFile,
+                               credFile is not None and os.path.exists(credFile)))
+            self.moduleCredFiles.add(readyToLogin.options.slicecredfile)
+            if command not in ('listresources', 'sliverstatus'):
+                return self.answer(command, opts)
+            self.running += 1
+            self.mostRunning = max(self.mostRunning, self.running)
+        try:
+            time.sleep(LATENCY)
+            return self.answer(command, opts)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def answer(self, command, opts):
+        if command == 'getversion':
+            return ("", dict((url, {'code': {'geni_code': 0, 'am_type': 'protogeni'}, 'value': {}})
+                             for url in opts.aggregate))
+        if command == 'getslicecred':
+            return ("", {'geni_type': 'geni_sfa', 'geni_version': '3', 'geni_value': CRED})
+        url = opts.aggregate[0]
+        if command == 'listresources':
+            host = url.split('/')[2].split(':')[0]
+            return ("", {url: {'code': {'geni_code': 0}, 'value': MANIFEST % (sliverURN(url), host)}})
+        if command == 'sliverstatus':
+            return ("", {url: {'geni_resources': [{'geni_urn': sliverURN(url), 'geni_status': 'ready',
+                                                   'pg_status': 'ready'}]}})
+        raise Exception("Unexpected command %s" % command)
+
+def parseOptions(argv):
+    opts, args = readyToLogin.omni.parse_args(argv, parser=readyToLogin.getParser())
+    return opts
+
+class ReadyToLoginTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.ams = FakeAMs()
+        self.saved = (readyToLogin.omniCall, readyToLogin.omni.initialize, readyToLogin.CallHandler,
+                      readyToLogin.findUsersAndKeys, readyToLogin.printMsg)
+        readyToLogin.omniCall = self.ams.omniCall
+        readyToLogin.omni.initialize = lambda argv, opts: (None, {}, [], opts)
+        readyToLogin.CallHandler = lambda framework, config, opts: None
+        readyToLogin.findUsersAndKeys = lambda: {'alice': ['/dev/null']}
+        readyToLogin.printMsg = lambda msg: None
+
+    def tearDown(self):
+        (readyToLogin.omniCall, readyToLogin.omni.initialize, readyToLogin.CallHandler,
+         readyToLogin.findUsersAndKeys, readyToLogin.printMsg) = self.saved
+        shutil.rmtree(self.dir)
+
+    def run_main(self, argv, count):
+        opts = parseOptions(sum([['-a', amURL(i)] for i in range(count)], argv))
+        before = dict(vars(opts))
+        (loginInfo, keys) = readyToLogin.main_no_print(opts=opts, slicen='slice')
+        # The caller's options are left alone
+        self.assertEqual(vars(opts), before)
+        return loginInfo
+
+    def test_parallel(self):
+        loginInfo = self.run_main(['--parallel', '3'], 6)
+        self.assertEqual(sorted(loginInfo.keys()), sorted(amURL(i) for i in range(6)))
+        for (url, info) in loginInfo.items():
+            self.assertEqual(info['amType'], 'protogeni')
+            self.assertEqual([(login['hostname'], login['geni_status'], login['am_status'])
+                              for login in info['info']],
+                             [('pc1.' + url.split('/')[2].split(':')[0], 'ready', 'ready')])
+        self.assertEqual(self.ams.mostRunning, 3)
+        # Each aggregate is asked for its manifest and status, with the
+        # one slice credential, saved to a file that is then removed
+        queries = [call for call in self.ams.calls if call[0] in ('listresources', 'sliverstatus')]
+        self.assertEqual(len(queries), 12)
+        credFiles = set(credFile for (command, aggs, credFile, exists) in queries)
+        self.assertEqual(len(credFiles), 1)
+        self.assertTrue(all(exists for (command, aggs, credFile, exists) in queries))
+        self.assertEqual(len([call for call in self.ams.calls if call[0] == 'getslicecred']), 1)
+        self.assertFalse(os.path.exists(credFiles.pop()))
+        # The queries used a copy of the module's options
+        self.assertEqual(self.ams.moduleCredFiles, set([None]))
+        self.assertEqual(readyToLogin.options.slicecredfile, None)
+
+    def test_one_at_a_time(self):
+        loginInfo = self.run_main(['--parallel', '1'], 3)
+        self.assertEqual(len(loginInfo), 3)
+        self.assertEqual(self.ams.mostRunning, 1)
+
+    def test_user_cred_file(self):
+        # A slice credential file the user gave is used as is, and kept
+        credFile = os.path.join(self.dir, 'cred.xml')
+        with open(credFile, 'w') as f:
+            f.write(CRED)
+        loginInfo = self.run_main(['--slicecredfile', credFile], 2)
+        self.assertEqual(len(loginInfo), 2)
+        self.assertEqual([call for call in self.ams.calls if call[0] == 'getslicecred'], [])
+        queries = [call for call in self.ams.calls if call[0] in ('listresources', 'sliverstatus')]
+        self.assertEqual(set(credFile for (command, aggs, credFile, exists) in queries),
+                         set([credFile]))
+        self.assertTrue(os.path.exists(credFile))
+        self.assertEqual(readyToLogin.options.slicecredfile, credFile)
+
+    def test_new_cred_file(self):
+        # A slice credential file option naming no file yet is kept
+        credFile = os.path.join(self.dir, 'new-cred.xml')
+        self.run_main(['--slicecredfile', credFile], 2)
+        self.assertEqual(self.ams.moduleCredFiles, set([credFile]))
+        self.assertEqual(readyToLogin.options.slicecredfile, credFile)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of examples/remote-execute.py running commands on several hosts,
+using a fake ssh on the PATH that runs the remote command locally.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import imp
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+sys.path.insert(0, EXAMPLES)
+import readyToLogin
+remote_execute = imp.load_source('remote_execute', os.path.join(EXAMPLES, 'remote-execute.py'))
+
+# Ignores the ssh options and user@host, and runs the command (the last argument)
+FAKE_SSH = """#!/bin/sh
+for arg; do command="$arg"; done
+exec /bin/sh -c "$command"
+"""
+
+HOSTS = ['node-0', 'node-1', 'node-2']
+
+def loginInfo(hosts):
+    return {'https://am.example.net:12369/protogeni/xmlrpc/am/2.0':
+            {'amType': 'protogeni',
+             'info': [{'client_id': host, 'hostname': host + '.example.net',
+                       'port': '22', 'username': 'alice', 'geni_status': 'ready'}
+                      for host in hosts]}}
+
+class RemoteExecuteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        ssh = os.path.join(self.tmpdir, 'ssh')
+        with open(ssh, 'w') as f:
+            f.write(FAKE_SSH)
+        os.chmod(ssh, stat.S_IRWXU)
+        self.oldPath = os.environ['PATH']
+        os.environ['PATH'] = self.tmpdir + os.pathsep + self.oldPath
+        self.oldMainNoPrint = readyToLogin.main_no_print
+        readyToLogin.main_no_print = lambda argv=None, opts=None, slicen=None: \
+            (loginInfo(HOSTS), {'alice': ['/dev/null']})
+        self.oldStdout = sys.stdout
+        self.oldStderr = sys.stderr
+        sys.stdout = open(os.devnull, 'w')
+        sys.stderr = open(os.devnull, 'w')
+
+    def tearDown(self):
+        sys.stdout.close()
+        sys.stderr.close()
+        sys.stdout = self.oldStdout
+        sys.stderr = self.oldStderr
+        readyToLogin.main_no_print = self.oldMainNoPrint
+        os.environ['PATH'] = self.oldPath
+        remote_execute.options = None
+        shutil.rmtree(self.tmpdir)
+
+    def run_main(self, command, *args):
+        summary = os.path.join(self.tmpdir, 'summary.json')
+        argv = ['myslice', '-m', command, '--json-summary', summary] + list(args)
+        code = remote_execute.main(argv)
+        with open(summary) as f:
+            results = json.load(f)
+        return (code, dict((r['host'], r) for r in results))
+
+    def test_success(self):
+        (code, results) = self.run_main('echo hello; echo oops >&2')
+        self.assertEqual(code, 0)
+        self.assertEqual(sorted(results.keys()), HOSTS)
+        for r in results.values():
+            self.assertEqual(r['exit_code'], 0)
+            self.assertFalse(r['timed_out'])
+            self.assertEqual(r['stdout'], 'hello\n')
+            self.assertEqual(r['stderr'], 'oops\n')
+
+    def test_failure(self):
+        (code, results) = self.run_main('exit 3', '--host', 'node-1', '--ssh-parallel', '1')
+        self.assertEqual(code, 1)
+        self.assertEqual(results.keys(), ['node-1'])
+        self.assertEqual(results['node-1']['exit_code'], 3)
+
+    def test_timeout(self):
+        (code, results) = self.run_main('sleep 10', '--ssh-timeout', '1', '--stream')
+        self.assertEqual(code, 1)
+        for r in results.values():
+            self.assertTrue(r['timed_out'])
+            self.assertEqual(r['exit_code'], None)
+            self.assertTrue(r['seconds'] < 10)
+
+    def test_not_utf8_output(self):
+        (code, results) = self.run_main('printf "caf\\351\\n"; printf "\\377" >&2')
+        self.assertEqual(code, 0)
+        for r in results.values():
+            self.assertEqual(r['stdout'], u'caf\ufffd\n')
+            self.assertEqual(r['stderr'], u'\ufffd')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of handler_utils.expirations_from_rspec and expires_from_rspec
+against manifests in the formats of several AM families (in manifests/),
+comparing with the regular expressions expires_from_rspec used before.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import datetime
+import os
+import re
+import unittest
+
+from gcf.omnilib.util import handler_utils
+from gcf.omnilib.util.handler_utils import expires_from_rspec, expirations_from_rspec, \
+    _naiveUTCFromString
+
+MANIFEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manifests')
+
+def read_manifest(name):
+    with open(os.path.join(MANIFEST_DIR, name), 'r') as f:
+        return f.read()
+
+def old_expires_from_rspec(rspec):
+    # expires_from_rspec as it was with regular expressions
+    match = re.search("<rspec [^>]*expires\s*=\s*[\'\"]([^\'\"]+)[\'\"]", rspec)
+    if match:
+        expObj = _naiveUTCFromString(match.group(1).strip())
+        match2 = re.search("<rspec [^>]*generated\s*=\s*[\'\"]([^\'\"]+)[\'\"]", rspec)
+        if not match2:
+            return expObj
+        genObj = _naiveUTCFromString(match2.group(1).strip())
+        if expObj - genObj > datetime.timedelta.resolution:
+            return expObj
+    match = re.search("<rspec\s+.+\s+<node\s+.+\s+<.*geni_sliver_info\s+[^>]*expiration_time\s*=\s*[\'\"]([^\'\"]+)[\'\"]", rspec, re.DOTALL)
+    if match:
+        return _naiveUTCFromString(match.group(1).strip())
+    return None
+
+class ExpiresFromRSpecTest(unittest.TestCase):
+
+    def check(self, name, expected):
+        rspec = read_manifest(name)
+        self.assertEqual(old_expires_from_rspec(rspec), expected)
+        self.assertEqual(expires_from_rspec(rspec), expected)
+
+    def test_pg(self):
+        self.check('pg-manifest.xml', datetime.datetime(2016, 3, 8, 15, 4, 5))
+
+    def test_pg_expires_same_as_generated(self):
+        self.check('pg-expires-is-generated.xml', None)
+
+    def test_eg_uses_last_sliver_info(self):
+        self.check('eg-manifest.xml', datetime.datetime(2021, 6, 1))
+
+    def test_foam(self):
+        self.check('foam-manifest.xml', None)
+
+    def test_prefixed_root(self):
+        self.check('prefixed-root.xml', None)
+
+    def test_not_well_formed(self):
+        self.check('eg-not-well-formed.xml', datetime.datetime(2021, 6, 1))
+        self.assertTrue(expirations_from_rspec(read_manifest('eg-not-well-formed.xml'))['error'])
+
+    def test_gcf(self):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src',
+                            'gcf', 'geni', 'am', 'amapi2-manifest.xml')
+        with open(path, 'r') as f:
+            rspec = f.read()
+        self.assertEqual(old_expires_from_rspec(rspec), None)
+        self.assertEqual(expires_from_rspec(rspec), None)
+
+    def test_large_eg(self):
+        # Many nodes, parsed in several chunks
+        node = read_manifest('eg-manifest.xml').split('<node', 1)[1].rsplit('</rspec>', 1)[0]
+        head = read_manifest('eg-manifest.xml').split('<node', 1)[0]
+        nodes = []
+        for i in range(2000):
+            nodes.append('<node' + node.replace('2021-06-01T00:00:00', '2021-06-01T00:%02d:00' % (i % 60)))
+        rspec = head + ''.join(nodes) + '</rspec>\n'
+        self.assertTrue(len(rspec) > 2 * handler_utils._RSPEC_PARSE_CHUNK)
+        self.assertEqual(expires_from_rspec(rspec), old_expires_from_rspec(rspec))
+
+class ExpirationsFromRSpecTest(unittest.TestCase):
+
+    def test_eg_slivers(self):
+        exps = expirations_from_rspec(read_manifest('eg-manifest.xml'))
+        self.assertTrue(exps['rspec'])
+        self.assertEqual(exps['expires'], None)
+        self.assertEqual(exps['error'], None)
+        self.assertEqual([(e['client_id'], e['value']) for e in exps['slivers']],
+                         [('VM', '2020-01-01T14:00:00.000Z'), ('VM-0', '2021-06-01T00:00:00.000Z')])
+        for e in exps['slivers']:
+            self.assertEqual(e['element'], 'geni_sliver_info')
+            self.assertTrue(e['in_node'])
+
+    def test_pg(self):
+        exps = expirations_from_rspec(read_manifest('pg-manifest.xml'))
+        self.assertEqual(exps['expires'], '2016-03-08T15:04:05Z')
+        self.assertEqual(exps['generated'], '2016-03-01T15:04:11Z')
+        self.assertEqual(exps['slivers'], [])
+
+    def test_prefixed_root(self):
+        exps = expirations_from_rspec(read_manifest('prefixed-root.xml'))
+        self.assertFalse(exps['rspec'])
+        self.assertEqual(exps['expires'], None)
+        self.assertEqual(len(exps['slivers']), 1)
+        self.assertFalse(exps['slivers'][0]['after_node'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of the reservation calendars of the v3 reference AM's resources.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import datetime
+import random
+import unittest
+
+from gcf.geni.am.resource import Resource
+from gcf.geni.am.schedule import ReservationCalendar, ResourceSchedule
+
+T0 = datetime.datetime(2016, 3, 1)
+
+def hours(n):
+    return T0 + datetime.timedelta(hours=n)
+
+class CalendarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calendar = ReservationCalendar()
+        self.calendar.reserve(hours(2), hours(4), 'a')
+        self.calendar.reserve(hours(6), hours(8), 'b')
+
+    def test_overlap(self):
+        for (start, end) in [(1, 3), (3, 5), (2, 4), (2, 3), (1, 9), (5, 7), (7, 10), (3, 7)]:
+            self.assertFalse(self.calendar.is_free(hours(start), hours(end)), (start, end))
+            self.assertRaises(ValueError, self.calendar.reserve, hours(start), hours(end), 'c')
+        self.assertEqual(len(self.calendar), 2)
+
+    def test_adjacent(self):
+        # Windows are [start, end): touching windows do not overlap
+        for (start, end) in [(0, 2), (4, 6), (8, 9)]:
+            self.assertTrue(self.calendar.is_free(hours(start), hours(end)), (start, end))
+        self.calendar.reserve(hours(4), hours(6), 'c')
+        self.calendar.reserve(hours(0), hours(2), 'd')
+        self.assertEqual(len(self.calendar), 4)
+        self.assertEqual(self.calendar.last_end(), hours(8))
+
+    def test_in_use(self):
+        self.assertFalse(self.calendar.in_use(hours(1)))
+        self.assertTrue(self.calendar.in_use(hours(2)))
+        self.assertFalse(self.calendar.in_use(hours(4)))
+        self.assertTrue(self.calendar.in_use(hours(7)))
+        self.assertFalse(self.calendar.in_use(hours(8)))
+
+    def test_empty_window(self):
+        self.assertRaises(ValueError, self.calendar.reserve, hours(5), hours(5), 'c')
+        self.assertRaises(ValueError, self.calendar.change_end, 'a', hours(2), hours(1))
+
+    def test_release(self):
+        self.calendar.release('a', hours(2))
+        self.assertTrue(self.calendar.is_free(hours(1), hours(5)))
+        self.assertRaises(KeyError, self.calendar.release, 'a', hours(2))
+        self.assertRaises(KeyError, self.calendar.release, 'c', hours(6))
+        self.calendar.release('b', hours(6))
+        self.assertEqual(len(self.calendar), 0)
+        self.assertEqual(self.calendar.last_end(), None)
+
+    def test_renew(self):
+        # Up to the next reservation, but not into it
+        self.assertTrue(self.calendar.change_end('a', hours(2), hours(6)))
+        self.assertTrue(self.calendar.in_use(hours(6) - datetime.timedelta(seconds=1)))
+        self.assertFalse(self.calendar.change_end('a', hours(2), hours(7)))
+        self.assertTrue(self.calendar.in_use(hours(5)))
+        # Shorter
+        self.assertTrue(self.calendar.change_end('a', hours(2), hours(3)))
+        self.assertFalse(self.calendar.in_use(hours(3)))
+        # The last one can be renewed as far as wanted
+        self.assertTrue(self.calendar.change_end('b', hours(6), hours(100)))
+        self.assertEqual(self.calendar.last_end(), hours(100))
+
+    def test_own_reservation(self):
+        # A window overlapping only the owner's own reservation is free for it
+        self.assertTrue(self.calendar.is_free(hours(1), hours(5), 'a'))
+        self.assertFalse(self.calendar.is_free(hours(1), hours(5), 'b'))
+
+class ScheduleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.resources = [Resource(i, 'vm') for i in range(20)]
+        self.schedule = ResourceSchedule()
+
+    def brute_force_free(self, windows, resource, start, end, owner=None):
+        return all(not (s < end and e > start)
+                   for (o, (rid, s, e)) in windows.items()
+                   if rid == resource.id and o is not owner)
+
+    def check(self, windows):
+        for (owner, window) in windows.items():
+            self.assertEqual(self.schedule.reservation(owner), window)
+        # Every reserved resource once, by the end of its last reservation
+        last_ends = dict()
+        for (rid, start, end) in windows.values():
+            last_ends[rid] = max(end, last_ends.get(rid, end))
+        reserved = list(self.schedule.reserved_resources())
+        self.assertEqual(sorted(r.id for r in reserved), sorted(last_ends.keys()))
+        self.assertEqual([last_ends[r.id] for r in reserved],
+                         sorted(last_ends.values()))
+
+    def test_random_operations(self):
+        rnd = random.Random(41)
+        windows = dict()
+        owners = ['sliver%d' % i for i in range(60)]
+        for step in range(3000):
+            owner = rnd.choice(owners)
+            resource = rnd.choice(self.resources)
+            start = hours(rnd.randint(0, 100))
+            end = start + datetime.timedelta(hours=rnd.randint(1, 20))
+            free = self.brute_force_free(windows, resource, start, end)
+            self.assertEqual(self.schedule.is_free(resource, start, end), free)
+            op = rnd.random()
+            if op < 0.5:
+                if owner in windows or not free:
+                    self.assertRaises(ValueError, self.schedule.reserve, resource, start, end, owner)
+                else:
+                    self.schedule.reserve(resource, start, end, owner)
+                    windows[owner] = (resource.id, start, end)
+            elif op < 0.75:
+                self.schedule.release(owner)
+                windows.pop(owner, None)
+            elif owner in windows:
+                (rid, start, old_end) = windows[owner]
+                resource = self.resources[rid]
+                end = start + datetime.timedelta(hours=rnd.randint(1, 20))
+                ok = self.brute_force_free(windows, resource, start, end, owner)
+                self.assertEqual(self.schedule.change_end(owner, end), ok)
+                if ok:
+                    windows[owner] = (rid, start, end)
+            self.check(windows)
+        for owner in owners:
+            self.schedule.release(owner)
+        self.check(dict())
+
+    def test_free_resources(self):
+        self.schedule.reserve(self.resources[0], hours(0), hours(10), 'a')
+        self.schedule.reserve(self.resources[1], hours(0), hours(2), 'b')
+        self.schedule.reserve(self.resources[1], hours(6), hours(8), 'c')
+        self.schedule.reserve(self.resources[2], hours(0), hours(4), 'd')
+        reserved = list(self.schedule.reserved_resources())
+        self.assertEqual([r.id for r in reserved], [2, 1, 0])
+        self.assertEqual([r.id for r in self.schedule.free_resources(reserved, hours(4), hours(6))],
+                         [2, 1])
+        self.assertEqual([r.id for r in self.schedule.free_resources(reserved, hours(4), hours(6), 1)],
+                         [2])
+        self.assertEqual(self.schedule.free_resources(reserved, hours(1), hours(3)), [])
+        # Renewing reorders the index
+        self.assertTrue(self.schedule.change_end('d', hours(20)))
+        self.assertEqual([r.id for r in self.schedule.reserved_resources()], [1, 0, 2])
+        self.schedule.release('a')
+        self.assertEqual([r.id for r in self.schedule.reserved_resources()], [1, 2])
+
+if __name__ == '__main__':
+    unittest.main()
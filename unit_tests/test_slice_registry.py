@@ -0,0 +1,197 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of the reference clearinghouse's registry of slice credentials.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from gcf.geni.ch import Clearinghouse
+from gcf.geni.util import cert_util
+from gcf.geni.util.slice_registry import SliceRegistry
+from gcf.sfa.trust import credential as cred, rights
+
+CH_URN = 'urn:publicid:IDN+ch.example.net+authority+sa'
+ALICE = 'urn:publicid:IDN+ch.example.net+user+alice'
+BOB = 'urn:publicid:IDN+ch.example.net+user+bob'
+
+def slice_urn(name):
+    return 'urn:publicid:IDN+ch.example.net+slice+%s' % name
+
+class FakeGID(object):
+    def __init__(self, urn):
+        self.urn = urn
+
+    def get_urn(self):
+        return self.urn
+
+class FakeCred(object):
+    # Just what the registry uses of a slice credential
+    def __init__(self, owner, expiration):
+        self.owner = owner
+        self.expiration = expiration
+
+    def get_gid_caller(self):
+        return FakeGID(self.owner)
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = SliceRegistry()
+        self.now = datetime.datetime(2016, 3, 1, 12, 0, 0)
+
+    def hours(self, n):
+        return self.now + datetime.timedelta(hours=n)
+
+    def owned(self, owner):
+        return sorted(self.registry.owned_by(owner))
+
+    def test_owner_index(self):
+        self.registry[slice_urn('s1')] = FakeCred(ALICE, self.hours(1))
+        self.registry[slice_urn('s2')] = FakeCred(ALICE, self.hours(2))
+        self.registry[slice_urn('s3')] = FakeCred(BOB, self.hours(3))
+        self.assertEqual(self.owned(ALICE), [(slice_urn('s1'), self.hours(1)),
+                                             (slice_urn('s2'), self.hours(2))])
+        # Renewed: a new credential with a later expiration
+        self.registry[slice_urn('s1')] = FakeCred(ALICE, self.hours(5))
+        self.assertEqual(self.owned(ALICE), [(slice_urn('s1'), self.hours(5)),
+                                             (slice_urn('s2'), self.hours(2))])
+        self.assertEqual(self.registry.expiration(slice_urn('s1')), self.hours(5))
+        # Deleted
+        del self.registry[slice_urn('s2')]
+        self.assertEqual(self.owned(ALICE), [(slice_urn('s1'), self.hours(5))])
+        del self.registry[slice_urn('s1')]
+        self.assertEqual(self.owned(ALICE), [])
+        self.assertEqual(self.registry._by_owner.keys(), [BOB])
+        # Re-created by someone else
+        self.registry[slice_urn('s2')] = FakeCred(BOB, self.hours(1))
+        self.assertEqual(self.owned(BOB), [(slice_urn('s2'), self.hours(1)),
+                                           (slice_urn('s3'), self.hours(3))])
+        self.assertEqual(len(self.registry), 2)
+
+    def test_remove_expired(self):
+        self.registry[slice_urn('s1')] = FakeCred(ALICE, self.hours(1))
+        self.registry[slice_urn('s2')] = FakeCred(ALICE, self.hours(1))
+        self.registry[slice_urn('s3')] = FakeCred(BOB, self.hours(2))
+        self.registry[slice_urn('s4')] = FakeCred(BOB, self.hours(1))
+        # Renewed past now, deleted, and deleted and re-created later:
+        # their old heap entries are skipped
+        self.registry[slice_urn('s1')] = FakeCred(ALICE, self.hours(4))
+        del self.registry[slice_urn('s2')]
+        del self.registry[slice_urn('s4')]
+        self.registry[slice_urn('s4')] = FakeCred(BOB, self.hours(5))
+        self.assertEqual(self.registry.remove_expired(self.hours(3)), [slice_urn('s3')])
+        self.assertEqual(sorted(self.registry.keys()), [slice_urn('s1'), slice_urn('s4')])
+        self.assertEqual(self.owned(BOB), [(slice_urn('s4'), self.hours(5))])
+        self.assertEqual(self.registry.remove_expired(self.hours(3)), [])
+        self.assertEqual(self.registry.remove_expired(self.hours(4)), [slice_urn('s1')])
+        self.assertEqual(self.owned(ALICE), [])
+        self.assertEqual(self.registry.remove_expired(self.hours(10)), [slice_urn('s4')])
+        self.assertEqual(self.registry._expiry_heap, [])
+
+    def test_pop(self):
+        slice_cred = FakeCred(ALICE, self.hours(1))
+        self.registry[slice_urn('s1')] = slice_cred
+        self.assertEqual(self.registry.pop(slice_urn('s2'), None), None)
+        self.assertEqual(self.registry.pop(slice_urn('s2'), 'none'), 'none')
+        self.assertRaises(KeyError, self.registry.pop, slice_urn('s2'))
+        self.assertTrue(self.registry.pop(slice_urn('s1'), None) is slice_cred)
+        self.assertFalse(slice_urn('s1') in self.registry)
+        self.assertEqual(self.registry.pop(slice_urn('s1'), None), None)
+        self.assertEqual(self.registry.get(slice_urn('s1')), None)
+
+    def test_list_my_slices(self):
+        ch = Clearinghouse()
+        ch.slices = self.registry
+        now = datetime.datetime.utcnow()
+        self.registry[slice_urn('s1')] = FakeCred(ALICE, now - datetime.timedelta(hours=1))
+        self.registry[slice_urn('s2')] = FakeCred(ALICE, now + datetime.timedelta(hours=1))
+        self.registry[slice_urn('s3')] = FakeCred(BOB, now + datetime.timedelta(hours=1))
+        self.assertEqual(ch.ListMySlices(ALICE), [slice_urn('s2')])
+        # The expired slice is gone
+        self.assertFalse(slice_urn('s1') in self.registry)
+        self.assertEqual(ch.ListMySlices(BOB), [slice_urn('s3')])
+        self.assertEqual(ch.ListMySlices(CH_URN), [])
+
+class DatabaseTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        (ch_gid, ch_keys) = cert_util.create_cert(CH_URN, ca=True)
+        cls.gids = dict()
+        for urn in (ALICE, BOB, slice_urn('s1'), slice_urn('s2')):
+            cls.gids[urn] = cert_util.create_cert(urn, ch_keys, ch_gid)[0]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'slices.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_cred(self, owner, urn, expiration):
+        # Unsigned: the registry does not check signatures
+        slice_cred = cred.Credential()
+        slice_cred.set_gid_caller(self.gids[owner])
+        slice_cred.set_gid_object(self.gids[urn])
+        slice_cred.set_expiration(expiration)
+        slice_cred.set_privileges(rights.determine_rights('slice', None))
+        slice_cred.encode()
+        return slice_cred
+
+    def test_round_trip(self):
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        later = now + datetime.timedelta(hours=2)
+        registry = SliceRegistry(self.filename)
+        registry[slice_urn('s1')] = self.make_cred(ALICE, slice_urn('s1'), later)
+        registry[slice_urn('s2')] = self.make_cred(BOB, slice_urn('s2'), now + datetime.timedelta(hours=1))
+
+        registry = SliceRegistry(self.filename)
+        self.assertEqual(len(registry), 2)
+        self.assertEqual(registry.owned_by(ALICE), [(slice_urn('s1'), later)])
+        # Not parsed until asked for
+        self.assertEqual(registry._creds, {slice_urn('s1'): None, slice_urn('s2'): None})
+        slice_cred = registry[slice_urn('s1')]
+        self.assertEqual(slice_cred.get_gid_caller().get_urn(), ALICE)
+        self.assertEqual(slice_cred.get_gid_object().get_urn(), slice_urn('s1'))
+        self.assertTrue(registry._creds[slice_urn('s1')] is slice_cred)
+        self.assertTrue(registry[slice_urn('s1')] is slice_cred)
+        self.assertEqual(registry._creds[slice_urn('s2')], None)
+
+        # Removals are saved too, without parsing
+        self.assertEqual(registry.remove_expired(now + datetime.timedelta(hours=1)), [slice_urn('s2')])
+        registry = SliceRegistry(self.filename)
+        self.assertEqual(registry.keys(), [slice_urn('s1')])
+        self.assertEqual(registry.pop(slice_urn('s1')).get_gid_caller().get_urn(), ALICE)
+        registry = SliceRegistry(self.filename)
+        self.assertEqual(len(registry), 0)
+
+if __name__ == '__main__':
+    unittest.main()
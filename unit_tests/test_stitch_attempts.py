@@ -0,0 +1,279 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests of the stitcher's retries: StitchingHandler.mainStitchingLoop
+driven through several attempts with a stubbed SCS and Launcher, and
+saveAggregateState compared with the original implementation.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import copy
+import datetime
+import logging
+import optparse
+import random
+import traceback
+import unittest
+
+from gcf.omnilib import stitchhandler
+from gcf.omnilib.stitchhandler import StitchingHandler
+from gcf.omnilib.stitch.objects import Aggregate, Hop, HopLink, Path
+from gcf.omnilib.stitch.utils import StitchingError, StitchingCircuitFailedError
+from gcf.omnilib.stitch.VLANRange import VLANRange
+
+AGG_URNS = ['urn:publicid:IDN+am%d.example.net+authority+cm' % i for i in range(3)]
+
+# Aggregate state that saveAggregateState carries over to the next attempt
+CARRIED = ['dcn', 'isOESS', 'isFOAM', 'isGRAM', 'isPG', 'isEG', 'isExoSM',
+           'userRequested', 'alt_url', 'api_version', 'nick', 'doesSchemaV1',
+           'doesSchemaV2', 'slicecred', 'url', 'urn_syns']
+
+def makeAggs(urns):
+    """New Aggregate objects with one hop each, as the SCS workflow gives"""
+    path = Path('path')
+    aggs = []
+    for (i, urn) in enumerate(urns):
+        agg = Aggregate(urn, 'https://am%d.example.net/am' % i)
+        hop = Hop('hop%d' % i, HopLink(urn.replace('authority+cm', 'interface+sw:port')), None)
+        hop.path = path
+        hop.aggregate = agg
+        agg.add_hop(hop)
+        aggs.append(agg)
+    return aggs
+
+class FakeLauncher(object):
+    """Stands in for stitch.Launcher. Each attempt but the last marks a
+    VLAN tag unavailable at each hop, learns state about each aggregate,
+    and fails the circuit."""
+
+    attempts = []
+    lastAttempt = 2
+
+    def __init__(self, opts, slicename, aggs, timeoutTime):
+        self.aggs = aggs
+
+    def launch(self, rspec, scsCalls):
+        FakeLauncher.attempts.append((scsCalls, list(self.aggs), len(traceback.extract_stack())))
+        if scsCalls >= FakeLauncher.lastAttempt:
+            return self.aggs[-1]
+        for agg in self.aggs:
+            agg.triedRes = True
+            agg.nick = 'nick-%s' % agg.urn
+            agg.api_version = 3
+            agg.isPG = True
+            agg.alt_url = agg.url + '/alt'
+            for hop in agg.hops:
+                hop.vlans_unavailable = hop.vlans_unavailable.union(VLANRange(100 + scsCalls))
+        raise StitchingCircuitFailedError("Circuit failed on attempt %d" % scsCalls)
+
+class StitchingLoopTest(unittest.TestCase):
+
+    def setUp(self):
+        self.savedLauncher = stitchhandler.stitch.Launcher
+        stitchhandler.stitch.Launcher = FakeLauncher
+        FakeLauncher.attempts = []
+        self.savedPauses = (Aggregate.PAUSE_FOR_V3_AM_TO_FREE_RESOURCES_SECS,
+                            Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS,
+                            Aggregate.PAUSE_FOR_DCN_AM_TO_FREE_RESOURCES_SECS)
+        Aggregate.PAUSE_FOR_V3_AM_TO_FREE_RESOURCES_SECS = 0
+        Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS = 0
+        Aggregate.PAUSE_FOR_DCN_AM_TO_FREE_RESOURCES_SECS = 0
+
+        handler = StitchingHandler.__new__(StitchingHandler)
+        handler.logger = logging.getLogger('stitch')
+        handler.opts = optparse.Values(dict(timeout=60, noDeleteAtEnd=False, noSCS=False,
+                                            fixedEndpoint=False))
+        handler.config = dict(timeoutTime=datetime.datetime.utcnow() + datetime.timedelta(hours=1))
+        handler.isStitching = True
+        handler.scsCalls = 0
+        handler.maxSCSCalls = 5
+        handler.slicecred = None
+        handler.slicename = 'slice'
+        handler.lastException = None
+        handler.parsedURNNewAggs = []
+        self.scsExistingAggs = []
+        self.deleted = []
+        handler.callSCS = self.callSCS
+        handler.parseSCSResponse = self.parseSCSResponse
+        handler.deleteAllReservations = self.deleteAllReservations
+        handler.updateAvailRanges = lambda sliceurn, requestDOM: None
+        for name in ('createObjectsFromParsedAMURNs', 'ensureOneExoSM', 'ensureSliverType',
+                     'changeRequestsToAny', 'handleNoReservation', 'handleGenRequest'):
+            setattr(handler, name, lambda: None)
+        handler.add_am_info = lambda aggs: None
+        handler.dump_objects = lambda rspec, aggs: None
+        self.handler = handler
+
+    def tearDown(self):
+        stitchhandler.stitch.Launcher = self.savedLauncher
+        (Aggregate.PAUSE_FOR_V3_AM_TO_FREE_RESOURCES_SECS,
+         Aggregate.PAUSE_FOR_AM_TO_FREE_RESOURCES_SECS,
+         Aggregate.PAUSE_FOR_DCN_AM_TO_FREE_RESOURCES_SECS) = self.savedPauses
+        Aggregate.clearCache()
+
+    def callSCS(self, sliceurn, requestDOM, existingAggs):
+        self.scsExistingAggs.append(existingAggs)
+        return 'workflow %d' % self.handler.scsCalls
+
+    def parseSCSResponse(self, scsResponse):
+        # Each SCS call gives a full new workflow, with new Aggregate objects
+        return (optparse.Values(dict(amURNs=AGG_URNS)), optparse.Values(dict(aggs=makeAggs(AGG_URNS))))
+
+    def deleteAllReservations(self, launcher):
+        self.deleted.append(launcher.aggs)
+        return ("", dict())
+
+    def test_two_attempts(self):
+        lastAM = self.handler.mainStitchingLoop('urn:slice', None)
+        self.assertEqual(self.handler.scsCalls, 2)
+        ((first, firstAggs, _), (second, secondAggs, _)) = FakeLauncher.attempts
+        self.assertEqual((first, second), (1, 2))
+        self.assertTrue(lastAM is secondAggs[-1])
+        # The first attempt's reservations were deleted, and its
+        # aggregates passed to the second SCS call
+        self.assertEqual(self.deleted, [firstAggs])
+        self.assertEqual(self.scsExistingAggs, [None, firstAggs])
+        for (old, new) in zip(firstAggs, secondAggs):
+            self.assertFalse(old is new)
+            self.assertEqual(new.urn, old.urn)
+            for name in CARRIED:
+                self.assertEqual(getattr(new, name), getattr(old, name), name)
+            self.assertEqual(new.nick, 'nick-%s' % new.urn)
+            self.assertFalse(old.triedRes)
+            self.assertEqual([str(hop.vlans_unavailable) for hop in new.hops], ['101'])
+
+    def test_many_attempts(self):
+        # Retries loop, without growing the stack, and carry the
+        # unavailable VLANs of every earlier attempt
+        FakeLauncher.lastAttempt = self.handler.maxSCSCalls
+        try:
+            self.handler.mainStitchingLoop('urn:slice', None)
+        finally:
+            FakeLauncher.lastAttempt = 2
+        self.assertEqual([attempt[0] for attempt in FakeLauncher.attempts], range(1, 6))
+        self.assertEqual(len(set(attempt[2] for attempt in FakeLauncher.attempts)), 1)
+        (_, lastAggs, _) = FakeLauncher.attempts[-1]
+        for agg in lastAggs:
+            self.assertEqual([str(hop.vlans_unavailable) for hop in agg.hops], ['101-104'])
+
+    def test_max_attempts(self):
+        FakeLauncher.lastAttempt = 100
+        try:
+            self.assertRaises(StitchingError, self.handler.mainStitchingLoop, 'urn:slice', None)
+        finally:
+            FakeLauncher.lastAttempt = 2
+        self.assertEqual(len(FakeLauncher.attempts), self.handler.maxSCSCalls)
+        self.assertEqual(len(self.deleted), self.handler.maxSCSCalls)
+
+# The original StitchingHandler.saveAggregateState, as the oracle
+def oldSaveAggregateState(self, oldAggs, newAggs):
+    '''Save state from old aggregates for use with new aggregates from later SCS call'''
+    for agg in newAggs:
+        for oldAgg in oldAggs:
+            # Is this oldAgg the same as the new 'agg' by URN? If so, copy from old to new
+            # FIXME: Correct to compare urn_syns too?
+            if not (agg.urn == oldAgg.urn or agg.urn in oldAgg.urn_syns or oldAgg.urn in agg.urn_syns):
+                # Not a match
+                continue
+
+            for hop in agg.hops:
+                for oldHop in oldAgg.hops:
+                    if hop.urn == oldHop.urn:
+                        if oldHop.excludeFromSCS:
+                            self.logger.warn("%s had been marked to exclude from SCS, but we got it again", oldHop)
+                        hop.vlans_unavailable = hop.vlans_unavailable.union(oldHop.vlans_unavailable)
+                        break
+            # End of loop over hops
+
+            # FIXME: agg.allocateTries?
+            agg.dcn = oldAgg.dcn
+            agg.isOESS = oldAgg.isOESS
+            agg.isFOAM = oldAgg.isFOAM
+            agg.isGRAM = oldAgg.isGRAM
+            agg.isPG = oldAgg.isPG
+            agg.isEG = oldAgg.isEG
+            agg.isExoSM = oldAgg.isExoSM
+            agg.userRequested = oldAgg.userRequested
+            agg.alt_url = oldAgg.alt_url
+            agg.api_version = oldAgg.api_version
+            agg.nick = oldAgg.nick
+            agg.doesSchemaV1 = oldAgg.doesSchemaV1
+            agg.doesSchemaV2 = oldAgg.doesSchemaV2
+            agg.slicecred = oldAgg.slicecred
+
+            # Since we're restarting, clear out any old error, so don't do this copy
+            # agg.lastError = oldAgg.lastError
+
+            # FIXME: correct?
+            agg.url = oldAgg.url
+            agg.urn_syns = copy.deepcopy(oldAgg.urn_syns)
+            break # out of loop over oldAggs, cause we found the new 'agg'
+        # Loop over oldAggs
+    # Loop over newAggs
+
+class SaveAggregateStateTest(unittest.TestCase):
+
+    def tearDown(self):
+        Aggregate.clearCache()
+
+    def randomAggs(self, rand, prefix, count):
+        # Aggregates and hops with URNs from small pools, so that some
+        # match several old aggregates or hops, and some match none
+        aggs = []
+        for i in range(count):
+            agg = Aggregate(rand.choice(AGG_URNS + ['urn:publicid:IDN+am9.example.net+authority+am']),
+                            'https://%s%d.example.net/am' % (prefix, i))
+            agg.urn_syns = rand.sample(AGG_URNS, rand.randint(0, 2))
+            for name in CARRIED[:-2]:
+                setattr(agg, name, rand.choice([True, False, None, '%s%d' % (prefix, i)]))
+            for j in range(rand.randint(0, 3)):
+                hop = Hop('%s%d.%d' % (prefix, i, j), HopLink('urn:hop%d' % rand.randint(0, 4)), None)
+                hop.excludeFromSCS = rand.random() < 0.2
+                hop.vlans_unavailable = VLANRange(set(rand.sample(range(1, 20), rand.randint(0, 4))))
+                agg.add_hop(hop)
+            aggs.append(agg)
+        return aggs
+
+    def state(self, aggs):
+        return [([getattr(agg, name) for name in CARRIED],
+                 sorted((hop._id, str(hop.vlans_unavailable)) for hop in agg.hops))
+                for agg in aggs]
+
+    def test_random(self):
+        handler = StitchingHandler.__new__(StitchingHandler)
+        handler.logger = logging.getLogger('stitch')
+        for seed in range(300):
+            rand = random.Random(seed)
+            oldAggs = self.randomAggs(rand, 'old', rand.randint(0, 5))
+            # The same new aggregates twice, one for each implementation
+            (newSeed, count) = (rand.random(), rand.randint(0, 5))
+            newAggs = self.randomAggs(random.Random(newSeed), 'new', count)
+            expectedAggs = self.randomAggs(random.Random(newSeed), 'new', count)
+            oldSaveAggregateState(handler, oldAggs, expectedAggs)
+            handler.saveAggregateState(oldAggs, newAggs)
+            self.assertEqual(self.state(newAggs), self.state(expectedAggs), seed)
+
+if __name__ == '__main__':
+    unittest.main()
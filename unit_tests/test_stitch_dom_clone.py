@@ -0,0 +1,147 @@
+#----------------------------------------------------------------------
+# Copyright (c) 2016 Raytheon BBN Technologies
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and/or hardware specification (the "Work") to
+# deal in the Work without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Work, and to permit persons to whom the Work
+# is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Work.
+#
+# THE WORK IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE WORK OR THE USE OR OTHER DEALINGS
+# IN THE WORK.
+#----------------------------------------------------------------------
+"""
+Tests that request DOMs cloned with stitch.utils.cloneRSpecDomForEdit,
+which share unedited elements with the DOM they were cloned from,
+are not changed by edits to either DOM, including by the manifest combiner.
+
+Run from the top of the tree with:
+  PYTHONPATH=src python -m unittest discover -s unit_tests
+"""
+
+import os
+import unittest
+from xml.dom.minidom import parse
+
+from gcf.omnilib.stitch import defs
+from gcf.omnilib.stitch import objects
+from gcf.omnilib.stitch.utils import cloneRSpecDomForEdit
+from gcf.omnilib.stitch.ManifestRSpecCombiner import combineManifestRSpecs, getRequestDom
+
+REQUEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                       'stitcherTestFiles', 'request-ig-utah-ig-gpo.xml')
+UTAH_URN = 'urn:publicid:IDN+utah.geniracks.net+authority+cm'
+GPO_URN = 'urn:publicid:IDN+instageni.gpolab.bbn.com+authority+cm'
+
+def rspecElement(dom):
+    return dom.getElementsByTagName(defs.RSPEC_TAG)[0]
+
+def childElements(elem, tag):
+    return [child for child in elem.childNodes if child.localName == tag]
+
+class CloneRSpecDomForEditTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dom = parse(REQUEST)
+        # Give the request a stitching extension to edit
+        stitching = self.dom.createElement(defs.STITCHING_TAG)
+        stitching.setAttribute('lastUpdateTime', '20160301:09:00:00')
+        rspecElement(self.dom).appendChild(stitching)
+        self.original = self.dom.toxml()
+        self.clone = cloneRSpecDomForEdit(self.dom, (defs.LINK_TAG, defs.STITCHING_TAG))
+        self.cloneXML = self.clone.toxml()
+
+    def test_same_document(self):
+        self.assertEqual(self.cloneXML, self.original)
+
+    def test_edit_clone(self):
+        root = rspecElement(self.clone)
+        root.setAttribute(defs.EXPIRES_ATTRIBUTE, '2016-03-08T15:04:05Z')
+        link = childElements(root, defs.LINK_TAG)[0]
+        link.setAttribute('vlantag', '1234')
+        link.appendChild(self.clone.createElement('component_manager'))
+        stitching = childElements(root, defs.STITCHING_TAG)[0]
+        stitching.appendChild(self.clone.createElement('path'))
+        self.assertEqual(self.dom.toxml(), self.original)
+        self.assertNotEqual(self.clone.toxml(), self.cloneXML)
+
+    def test_edit_original(self):
+        root = rspecElement(self.dom)
+        root.setAttribute(defs.EXPIRES_ATTRIBUTE, '2016-03-08T15:04:05Z')
+        link = childElements(root, defs.LINK_TAG)[0]
+        link.removeChild(childElements(link, 'interface_ref')[0])
+        stitching = childElements(root, defs.STITCHING_TAG)[0]
+        stitching.appendChild(self.dom.createElement('path'))
+        self.assertEqual(self.clone.toxml(), self.cloneXML)
+
+    def test_edited_elements_not_shared(self):
+        for tag in (defs.LINK_TAG, defs.STITCHING_TAG):
+            for (orig, copy) in zip(childElements(rspecElement(self.dom), tag),
+                                    childElements(rspecElement(self.clone), tag)):
+                self.assertFalse(orig is copy)
+                self.assertTrue(copy.parentNode is rspecElement(self.clone))
+
+class CombinerTemplateTest(unittest.TestCase):
+    '''The combiner edits its template in place: check that does not change
+    request DOMs sharing elements with the expanded request.'''
+
+    def setUp(self):
+        self.dom = parse(REQUEST)
+        self.original = self.dom.toxml()
+        self.utah = objects.Aggregate.find(UTAH_URN)
+        self.gpo = objects.Aggregate.find(GPO_URN)
+        self.utah.requestDom = None
+        self.gpo.requestDom = self.gpo.getEditedRSpecDom(self.dom)
+        self.gpoRequest = self.gpo.requestDom.toxml()
+
+    def tearDown(self):
+        self.utah.requestDom = None
+        self.gpo.requestDom = None
+
+    def checkShared(self):
+        # Elements the GPO request shares with the expanded request are intact
+        self.assertEqual(self.dom.toxml(), self.original)
+        self.assertEqual(self.gpo.requestDom.toxml(), self.gpoRequest)
+        for node in childElements(rspecElement(self.dom), defs.NODE_TAG):
+            self.assertTrue(node.parentNode is rspecElement(self.dom))
+
+    def test_combine_into_copy(self):
+        template = self.dom.cloneNode(True)
+        combined = combineManifestRSpecs([self.utah, self.gpo], template, useReqs=True)
+        self.checkShared()
+        self.assertTrue(self.utah.requestDom is not None)
+        # Edit the combined DOM and the new Utah request
+        for node in childElements(rspecElement(combined), defs.NODE_TAG):
+            node.setAttribute('exclusive', 'true')
+        for node in childElements(rspecElement(self.utah.requestDom), defs.NODE_TAG):
+            node.setAttribute('exclusive', 'true')
+        self.checkShared()
+
+    def test_request_not_sharing_template(self):
+        template = self.dom.cloneNode(True)
+        request = getRequestDom(self.utah, template)
+        requestNodes = childElements(rspecElement(request), defs.NODE_TAG)
+        for node in childElements(rspecElement(template), defs.NODE_TAG):
+            self.assertFalse(node in requestNodes)
+        requestXML = request.toxml()
+        root = rspecElement(template)
+        node = childElements(root, defs.NODE_TAG)[0]
+        root.replaceChild(node.cloneNode(True), node)
+        root.appendChild(template.createElement(defs.NODE_TAG))
+        self.assertEqual(request.toxml(), requestXML)
+        for node in requestNodes:
+            self.assertFalse(node.parentNode is None)
+        self.assertTrue(getRequestDom(self.utah, template) is request)
+
+if __name__ == '__main__':
+    unittest.main()